@@ -6,11 +6,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from starlette.routing import Match
+from opentelemetry.trace import SpanKind
 import logging
 import time
 from typing import Callable
 
 from app.config import get_settings
+from app.services.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT
+from app.services.tracing import extract_context, tracer
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -19,9 +23,20 @@ settings = get_settings()
 limiter = Limiter(key_func=get_remote_address)
 
 
+def route_template(request: Request) -> str:
+    """The path template of the route serving the request, to bound metric labels"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            path: str = route.path
+            return path
+    return "unmatched"
+
+
 async def log_requests_middleware(request: Request, call_next: Callable):
-    """Log all incoming requests with timing"""
+    """Log and trace all incoming requests with timing"""
     start_time = time.time()
+    route = route_template(request)
 
     # Log request
     logger.info(
@@ -29,11 +44,25 @@ async def log_requests_middleware(request: Request, call_next: Callable):
         f"from {request.client.host if request.client else 'unknown'}"
     )
 
-    # Process request
-    response = await call_next(request)
+    # Process request, continuing the caller's trace if it sent one
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    try:
+        with tracer.start_as_current_span(
+            f"{request.method} {route}",
+            context=extract_context(request.headers),
+            kind=SpanKind.SERVER,
+            attributes={"http.method": request.method, "http.route": route}
+        ) as span:
+            response = await call_next(request)
+            span.set_attribute("http.status_code", response.status_code)
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
 
     # Calculate duration
     duration = time.time() - start_time
+    HTTP_REQUEST_DURATION.labels(
+        request.method, route, str(response.status_code)
+    ).observe(duration)
 
     # Log response
     logger.info(
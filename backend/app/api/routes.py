@@ -1,11 +1,19 @@
 """API routes for the Geo-SQL Agent"""
 
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Depends, Query
+from fastapi.responses import Response, StreamingResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from typing import Any, AsyncGenerator, AsyncIterator, Optional, Tuple
+from urllib.parse import quote
+import asyncio
+import hmac
 import logging
 
 from app.models.schemas import (
+    BatchQueryRequest,
+    BatchQueryResult,
     QueryRequest,
     QueryResponse,
     HealthResponse,
@@ -13,8 +21,19 @@ from app.models.schemas import (
     TableInfo,
     ErrorResponse
 )
-from app.services.query_service import get_query_service
+from app.services.query_service import BatchOutcome, get_query_service
+from app.services.formatters import encode_sse
+from app.services.exporters import EXPORT_FORMATS
 from app.services.database import get_db_service
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.stages import stage
+from app.services.deadline import (
+    ClientDisconnected,
+    Deadline,
+    DeadlineExceeded,
+    iterate_with_deadline,
+    run_with_deadline
+)
 from app.config import get_settings
 from app import __version__
 
@@ -24,6 +43,82 @@ settings = get_settings()
 router = APIRouter()
 limiter = Limiter(key_func=get_remote_address)
 
+# Streaming output formats and their media types
+STREAM_MEDIA_TYPES = {
+    "geojson": "application/geo+json",
+    "ndjson": "application/x-ndjson",
+}
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# Formats serialized entirely by PostGIS and passed through as-is
+RENDERED_MEDIA_TYPES = {
+    "featurecollection": "application/geo+json",
+}
+
+
+def negotiate_stream_format(request: Request, output_format: Optional[str]) -> Optional[str]:
+    """Pick a streaming or rendered format from the `format` parameter or the Accept header"""
+    if output_format:
+        if output_format == "json":
+            return None
+        if output_format not in STREAM_MEDIA_TYPES and output_format not in RENDERED_MEDIA_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported format: {output_format}"
+            )
+        return output_format
+
+    accept = request.headers.get("accept", "")
+    for name, media_type in STREAM_MEDIA_TYPES.items():
+        if media_type in accept:
+            return name
+    return None
+
+
+async def run_request(request: Request, coro):
+    """
+    Run a request's work under its deadline, cancelling it if the client disconnects
+
+    The deadline comes from the request timeout header (seconds) or the
+    REQUEST_TIMEOUT default.
+    """
+    query_service = get_query_service()
+    try:
+        deadline = Deadline.from_header(request.headers.get(settings.request_timeout_header))
+    except ValueError as e:
+        coro.close()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        return await run_with_deadline(coro, deadline, request.is_disconnected)
+
+    except DeadlineExceeded as e:
+        query_service.record_cancellation("deadline")
+        logger.warning(f"Request cancelled: {e}")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e)
+        )
+
+    except ClientDisconnected:
+        query_service.record_cancellation("disconnect")
+        logger.info("Request cancelled: client disconnected")
+        raise HTTPException(
+            status_code=499,
+            detail="Client closed request"
+        )
+
+    except CircuitOpenError as e:
+        logger.warning(f"Request rejected: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(int(settings.llm_breaker_reset_timeout))}
+        )
+
 
 @router.get(
     "/",
@@ -42,6 +137,14 @@ async def root():
             "/health": "GET - Health check",
             "/schema": "GET - Database schema information",
             "/query": "POST - Execute natural language query",
+            "/query/stream": "POST - Execute a query, streaming progress as Server-Sent Events",
+            "/query/batch": "POST - Execute a batch of queries, streaming results as NDJSON",
+            "/query/export": "POST - Export query results as GeoParquet, Arrow IPC or FlatGeobuf",
+            "/query/next": "GET - Fetch the next page of a paginated query",
+            "/query/{handle}/tiles/{z}/{x}/{y}.mvt": "GET - Vector tile of a query's results",
+            "/stats": "GET - Cache statistics",
+            "/metrics": "GET - Prometheus metrics",
+            "/admin/slow-queries": "GET - Slow queries with their plans, and plan flips",
             "/docs": "GET - Interactive API documentation",
             "/redoc": "GET - Alternative API documentation"
         },
@@ -64,7 +167,7 @@ async def health_check():
     """Health check endpoint"""
     try:
         db_service = get_db_service()
-        db_healthy = db_service.health_check()
+        db_healthy = await db_service.health_check()
 
         if not db_healthy:
             raise HTTPException(
@@ -121,6 +224,75 @@ async def get_schema():
         )
 
 
+@router.get(
+    "/stats",
+    summary="Get service statistics",
+    description="Get cache hit/miss counters",
+    tags=["Info"]
+)
+async def get_stats():
+    """Service statistics endpoint"""
+    return await get_query_service().get_stats()
+
+
+@router.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Stage latencies, connection pool, queue depths, cache and token counters",
+    tags=["Info"]
+)
+async def get_metrics():
+    """
+    Prometheus scrape endpoint
+
+    Each uvicorn worker has its own registry, so with several workers every
+    scrape reports the worker that happened to serve it.
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    # Collectors read the on-disk caches; keep that off the event loop
+    content = await asyncio.to_thread(generate_latest, REGISTRY)
+    return Response(content=content, media_type=CONTENT_TYPE_LATEST)
+
+
+def require_admin(request: Request) -> None:
+    """
+    Require the X-Admin-Token header to match ADMIN_TOKEN
+
+    Admin endpoints do not exist (404) until ADMIN_TOKEN is configured.
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), settings.admin_token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get(
+    "/admin/slow-queries",
+    summary="Slow-query log",
+    description="Recent slow queries with their EXPLAIN ANALYZE plans, and plan shape flips",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin)]
+)
+async def get_slow_queries(
+    limit: int = Query(50, ge=1, le=1000, description="Entries of each list to return")
+):
+    """
+    Slow-query log
+
+    Executions over SLOW_QUERY_THRESHOLD seconds of database time, newest
+    first, with the question, SQL, timing, row count and the plan captured
+    by re-running the SQL under EXPLAIN (ANALYZE, BUFFERS). `plan_flips`
+    lists SQL whose plan shape changed between two EXPLAINs (e.g. an index
+    scan becoming a sequential scan). Each worker keeps its own log.
+    """
+    if not settings.slow_query_log_enabled:
+        raise HTTPException(status_code=404, detail="The slow-query log is disabled")
+    slow_queries = get_query_service().db_service.slow_queries
+    return {**slow_queries.snapshot(limit), "stats": slow_queries.stats()}
+
+
 @router.post(
     "/query",
     response_model=QueryResponse,
@@ -130,7 +302,11 @@ async def get_schema():
     responses={
         200: {
             "description": "Query executed successfully",
-            "model": QueryResponse
+            "model": QueryResponse,
+            "content": {
+                "application/geo+json": {},
+                "application/x-ndjson": {}
+            }
         },
         400: {
             "description": "Invalid input or SQL validation failed",
@@ -142,13 +318,29 @@ async def get_schema():
         500: {
             "description": "Internal server error during query execution",
             "model": ErrorResponse
+        },
+        503: {
+            "description": "The LLM backend is failing (circuit open); retry later",
+            "model": ErrorResponse
+        },
+        504: {
+            "description": "Request deadline exceeded",
+            "model": ErrorResponse
         }
     }
 )
 @limiter.limit(f"{settings.rate_limit_requests}/{settings.rate_limit_period}second")
 async def execute_query(
     request: Request,
-    query_request: QueryRequest
+    query_request: QueryRequest,
+    output_format: Optional[str] = Query(
+        None,
+        alias="format",
+        description=(
+            "Response format: json (default), geojson or ndjson (streamed), "
+            "or featurecollection (built by PostGIS)"
+        )
+    )
 ):
     """
     Execute a natural language query
@@ -156,15 +348,63 @@ async def execute_query(
     This endpoint converts a natural language question into a PostGIS SQL query,
     executes it, and returns the results with GeoJSON geometries.
 
+    With `?format=geojson` / `?format=ndjson` (or an `Accept: application/geo+json`
+    / `application/x-ndjson` header) the results are streamed from a server-side
+    cursor as a GeoJSON FeatureCollection or newline-delimited Features.
+    `?format=featurecollection` has PostGIS build the whole FeatureCollection
+    and returns its bytes untouched.
+
+    The request is bounded by a deadline (`X-Request-Timeout` header, in
+    seconds) that also caps OpenAI retries and the PostgreSQL
+    statement_timeout; work is cancelled when it passes or the client
+    disconnects.
+
+    Before running, the query is EXPLAINed: queries estimated above
+    MAX_QUERY_COST are rejected (400), expensive ones wait for a slow-lane
+    slot, and the estimate is returned in `plan`.
+
     Example questions:
     - "Find all cafes within 200 meters of the largest park"
     - "Show all parks larger than 5000 square meters"
     - "What is the closest cafe to the smallest park?"
     """
+    stream_format = negotiate_stream_format(request, output_format)
+
     try:
         query_service = get_query_service()
-        result = await query_service.process_query(query_request)
-        return result
+        if stream_format in RENDERED_MEDIA_TYPES:
+            sql_query, rendered = await run_request(
+                request, query_service.render_feature_collection(query_request)
+            )
+            headers = {
+                "X-Generated-SQL": quote(sql_query),
+                "X-Result-Truncated": str(rendered.truncated).lower()
+            }
+            if rendered.estimated_total is not None:
+                headers["X-Estimated-Total"] = str(rendered.estimated_total)
+            return Response(
+                content=rendered.body,
+                media_type=RENDERED_MEDIA_TYPES[stream_format],
+                headers=headers
+            )
+
+        if stream_format:
+            sql_query, body = await run_request(
+                request, query_service.stream_query(query_request, stream_format)
+            )
+            return StreamingResponse(
+                body,
+                media_type=STREAM_MEDIA_TYPES[stream_format],
+                headers={"X-Generated-SQL": quote(sql_query)}
+            )
+
+        result = await run_request(request, query_service.process_query(query_request))
+        # Serialized here rather than by FastAPI so the stage can be timed
+        with stage("serialization"):
+            return Response(content=result.model_dump_json(), media_type="application/json")
+
+    except HTTPException:
+        raise
 
     except ValueError as e:
         # Validation errors (invalid SQL, blocked keywords, etc.)
@@ -181,3 +421,360 @@ async def execute_query(
             status_code=500,
             detail=f"Query execution failed: {str(e)}"
         )
+
+
+async def encode_progress_events(
+    events: AsyncGenerator[Tuple[str, Any], None], deadline: Deadline
+) -> AsyncIterator[bytes]:
+    """
+    Encode query progress events as Server-Sent Events
+
+    The response status is sent before any work is done, so failures are
+    reported as a final `error` event carrying the status the JSON endpoint
+    would have returned.
+    """
+    query_service = get_query_service()
+    try:
+        async for event, data in iterate_with_deadline(events, deadline):
+            yield encode_sse(event, data)
+
+    except DeadlineExceeded as e:
+        query_service.record_cancellation("deadline")
+        logger.warning(f"Progress stream cancelled: {e}")
+        yield encode_sse("error", {"status": 504, "detail": str(e)})
+
+    except asyncio.CancelledError:
+        query_service.record_cancellation("disconnect")
+        logger.info("Progress stream cancelled: client disconnected")
+        raise
+
+    except CircuitOpenError as e:
+        logger.warning(f"Progress stream rejected: {e}")
+        yield encode_sse("error", {"status": 503, "detail": str(e)})
+
+    except ValueError as e:
+        logger.warning(f"Validation error: {e}")
+        yield encode_sse("error", {"status": 400, "detail": str(e)})
+
+    except Exception as e:
+        logger.error(f"Progress stream error: {e}", exc_info=True)
+        yield encode_sse("error", {"status": 500, "detail": f"Query execution failed: {str(e)}"})
+
+
+@router.post(
+    "/query/stream",
+    summary="Execute a query with progress events",
+    description="Run a natural language query and stream its progress as Server-Sent Events",
+    tags=["Query"],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Event stream: sql, validated, executing, rows, done (or error)",
+            "content": {SSE_MEDIA_TYPE: {}}
+        },
+        400: {
+            "description": "Invalid input",
+            "model": ErrorResponse
+        },
+        429: {
+            "description": "Too many requests - rate limit exceeded"
+        }
+    }
+)
+@limiter.limit(f"{settings.rate_limit_requests}/{settings.rate_limit_period}second")
+async def stream_query_progress(request: Request, query_request: QueryRequest):
+    """
+    Execute a natural language query, streaming its progress
+
+    Events are sent as each stage completes:
+    - `sql`: generated SQL text as the LLM produces it (`{"delta": ...}`)
+    - `validated`: the complete statement passed validation (`{"sql", "rewrites"}`)
+    - `executing`: the SQL sent to the database
+    - `rows`: a batch of GeoJSON Features (`{"features": [...]}`)
+    - `done`: `{"result_count", "truncated", "execution_time"}`
+    - `error`: `{"status", "detail"}`, ending the stream
+
+    Validation starts as soon as the generated statement is complete, without
+    waiting for the end of the LLM response. Closing the connection cancels
+    the generation and the database query. The `X-Request-Timeout` deadline
+    applies as on `/query`.
+    """
+    try:
+        deadline = Deadline.from_header(request.headers.get(settings.request_timeout_header))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    events = get_query_service().stream_events(query_request)
+    return StreamingResponse(
+        encode_progress_events(events, deadline),
+        media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def error_status(error: Exception) -> Tuple[int, str]:
+    """Status and detail /query returns for an error raised while answering a question"""
+    if isinstance(error, DeadlineExceeded):
+        return 504, str(error)
+    if isinstance(error, CircuitOpenError):
+        return 503, str(error)
+    if isinstance(error, ValueError):
+        return 400, str(error)
+    return 500, f"Query execution failed: {str(error)}"
+
+
+async def encode_batch_results(
+    outcomes: AsyncGenerator[BatchOutcome, None]
+) -> AsyncIterator[bytes]:
+    """Encode batch outcomes as newline-delimited BatchQueryResult objects"""
+    query_service = get_query_service()
+    try:
+        async for outcome in outcomes:
+            status_code, detail = 200, None
+            if outcome.error is not None:
+                status_code, detail = error_status(outcome.error)
+                if status_code == 500:
+                    logger.error(f"Batch question failed: {outcome.error}")
+            result = BatchQueryResult(
+                indices=outcome.indices,
+                question=outcome.question,
+                status=status_code,
+                response=outcome.response,
+                detail=detail
+            )
+            with stage("serialization"):
+                line = (result.model_dump_json() + "\n").encode("utf-8")
+            yield line
+
+    except asyncio.CancelledError:
+        query_service.record_cancellation("disconnect")
+        logger.info("Batch cancelled: client disconnected")
+        raise
+
+    finally:
+        await outcomes.aclose()
+
+
+@router.post(
+    "/query/batch",
+    summary="Execute a batch of queries",
+    description="Answer a list of natural language questions, streaming each result as it finishes",
+    tags=["Query"],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "One BatchQueryResult per distinct question, as NDJSON",
+            "content": {STREAM_MEDIA_TYPES["ndjson"]: {}}
+        },
+        400: {
+            "description": "Invalid input or too many questions",
+            "model": ErrorResponse
+        },
+        429: {
+            "description": "Too many requests - rate limit exceeded"
+        }
+    }
+)
+@limiter.limit(f"{settings.rate_limit_requests}/{settings.rate_limit_period}second")
+async def execute_batch(request: Request, batch_request: BatchQueryRequest):
+    """
+    Execute a batch of natural language queries
+
+    Repeated questions are answered once, and the distinct questions are
+    answered concurrently (BATCH_CONCURRENCY at a time), their SQL executed
+    over a few shared pooled connections. Each result is streamed as a line
+    of JSON as soon as it is ready, listing the positions of its question in
+    the request; a failed question carries the status `/query` would have
+    returned. A batch counts as one request for rate limiting.
+
+    The `X-Request-Timeout` deadline applies to each question separately,
+    from when it starts. Closing the connection cancels the remaining
+    questions.
+    """
+    if len(batch_request.questions) > settings.batch_max_questions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch may contain at most {settings.batch_max_questions} questions"
+        )
+    try:
+        deadline = Deadline.from_header(request.headers.get(settings.request_timeout_header))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    outcomes = get_query_service().process_batch(batch_request, deadline.timeout)
+    return StreamingResponse(
+        encode_batch_results(outcomes),
+        media_type=STREAM_MEDIA_TYPES["ndjson"],
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+
+@router.post(
+    "/query/export",
+    summary="Export query results",
+    description="Run a natural language query and stream the results as a columnar file",
+    tags=["Query"],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Export file",
+            "content": {media_type: {} for media_type, _ in EXPORT_FORMATS.values()}
+        },
+        400: {
+            "description": "Invalid input, unsupported format or SQL validation failed",
+            "model": ErrorResponse
+        },
+        429: {
+            "description": "Too many requests - rate limit exceeded"
+        },
+        504: {
+            "description": "Request deadline exceeded",
+            "model": ErrorResponse
+        }
+    }
+)
+@limiter.limit(f"{settings.rate_limit_requests}/{settings.rate_limit_period}second")
+async def export_query(
+    request: Request,
+    query_request: QueryRequest,
+    output_format: str = Query(
+        "geoparquet",
+        alias="format",
+        description="Export format: geoparquet, arrow (IPC stream) or flatgeobuf"
+    )
+):
+    """
+    Export the results of a natural language query
+
+    Rows are read from a server-side cursor and written as GeoParquet row
+    groups or Arrow IPC record batches (geometry as WKB) while the response
+    streams, so large results are never held in memory. FlatGeobuf requires
+    pyogrio.
+    """
+    try:
+        sql_query, body = await run_request(
+            request, get_query_service().export_query(query_request, output_format)
+        )
+        media_type, extension = EXPORT_FORMATS[output_format]
+        return StreamingResponse(
+            body,
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f'attachment; filename="query.{extension}"',
+                "X-Generated-SQL": quote(sql_query)
+            }
+        )
+
+    except HTTPException:
+        raise
+
+    except ValueError as e:
+        logger.warning(f"Export rejected: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+    except Exception as e:
+        logger.error(f"Export error: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Export failed: {str(e)}"
+        )
+
+
+@router.get(
+    "/query/next",
+    response_model=QueryResponse,
+    summary="Fetch the next page of results",
+    description="Fetch the next keyset page of a paginated query using its continuation token",
+    tags=["Query"],
+    responses={
+        400: {
+            "description": "Invalid or expired continuation token",
+            "model": ErrorResponse
+        },
+        504: {
+            "description": "Request deadline exceeded",
+            "model": ErrorResponse
+        }
+    }
+)
+async def next_page(
+    request: Request,
+    token: str = Query(..., description="Continuation token from a previous response")
+):
+    """
+    Fetch the next page of a paginated query
+
+    The token is bound to the already-validated SQL, so no LLM call is made.
+    """
+    try:
+        return await run_request(request, get_query_service().fetch_next_page(token))
+
+    except HTTPException:
+        raise
+
+    except ValueError as e:
+        logger.warning(f"Invalid continuation token: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+    except Exception as e:
+        logger.error(f"Page fetch error: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Page fetch failed: {str(e)}"
+        )
+
+
+@router.get(
+    "/query/{handle}/tiles/{z}/{x}/{y}.mvt",
+    summary="Get a vector tile of query results",
+    description="Render a previous query's results as a Mapbox Vector Tile",
+    tags=["Query"],
+    response_class=Response,
+    responses={
+        200: {"content": {MVT_MEDIA_TYPE: {}}},
+        204: {"description": "No features in this tile"},
+        400: {
+            "description": "Invalid handle or tile coordinates",
+            "model": ErrorResponse
+        },
+        504: {
+            "description": "Request deadline exceeded",
+            "model": ErrorResponse
+        }
+    }
+)
+async def get_tile(request: Request, handle: str, z: int, x: int, y: int):
+    """
+    Render a vector tile of a previous query's results
+
+    `handle` is the `query_handle` of a /query response. Tiles are built with
+    ST_AsMVT and cached on disk until a table the query reads changes.
+    """
+    try:
+        tile = await run_request(request, get_query_service().render_tile(handle, z, x, y))
+        if not tile:
+            return Response(status_code=204)
+        return Response(content=tile, media_type=MVT_MEDIA_TYPE)
+
+    except HTTPException:
+        raise
+
+    except ValueError as e:
+        logger.warning(f"Invalid tile request: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+    except Exception as e:
+        logger.error(f"Tile rendering error: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Tile rendering failed: {str(e)}"
+        )
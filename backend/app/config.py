@@ -1,7 +1,7 @@
 """Application configuration using Pydantic Settings"""
 
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List, Optional
 from functools import lru_cache
 
 
@@ -19,13 +19,160 @@ class Settings(BaseSettings):
     db_pool_size: int = 5
     db_max_overflow: int = 10
     db_pool_timeout: int = 30
+    db_async_driver: str = "asyncpg"
+    db_statement_cache_size: int = 256  # prepared statements kept per pooled connection (asyncpg)
 
     # OpenAI
     openai_api_key: str
     openai_model: str = "gpt-4"
+    openai_base_url: Optional[str] = None  # OpenAI-compatible endpoint (e.g. benchmarks/llm_standin.py)
     openai_temperature: float = 0.0
     openai_max_tokens: int = 500
     openai_timeout: int = 30
+    openai_max_connections: int = 20
+    openai_max_keepalive_connections: int = 10
+    openai_keepalive_expiry: float = 30.0
+
+    # Model cascade: questions go to OPENAI_FAST_MODEL first and escalate to
+    # OPENAI_MODEL when its SQL fails validation, EXPLAIN or execution (unset
+    # disables the cascade)
+    openai_fast_model: Optional[str] = None
+    # Circuit breaker per model: open after this many consecutive API
+    # failures, let a trial call through after the reset timeout
+    llm_breaker_failure_threshold: int = 5
+    llm_breaker_reset_timeout: float = 30.0  # seconds
+
+    # Hedged LLM calls: a second, identical request is sent when the first has
+    # not returned within the LLM_HEDGE_QUANTILE latency of recent calls
+    llm_hedge_enabled: bool = True
+    llm_hedge_quantile: float = 0.9
+    llm_hedge_min_delay: float = 1.0  # seconds
+    llm_hedge_initial_delay: float = 5.0  # seconds, until LLM_HEDGE_MIN_SAMPLES calls are timed
+    llm_hedge_min_samples: int = 20
+    llm_hedge_window: int = 500  # recent latencies the quantile is taken over
+    # Extra (hedged or speculative) calls allowed per primary call, and burst
+    llm_extra_call_ratio: float = 0.1
+    llm_extra_call_burst: float = 5.0
+    # Speculative generation: candidates generated in parallel, the first to
+    # pass validation and EXPLAIN is executed (1 disables)
+    llm_speculative_candidates: int = 1
+    llm_speculative_temperature: float = 0.4  # for candidates after the first
+
+    # Prompt built from the schema registry (introspected at startup) and pruned
+    # to the tables, columns and examples a question needs
+    schema_introspection_enabled: bool = True
+    prompt_pruning_enabled: bool = True
+    prompt_max_examples: int = 3
+    prompt_full_table_columns: int = 8  # wider tables list core and mentioned columns only
+
+    # SQL generation cache
+    sql_cache_enabled: bool = True
+    sql_cache_max_size: int = 1000
+    sql_cache_ttl: int = 86400  # seconds
+    sql_cache_negative_ttl: int = 60  # seconds
+    sql_cache_path: Optional[str] = None  # persist to disk when set
+
+    # Index-aware rewriting of generated SQL (bbox prefilters, KNN, semijoins)
+    sql_rewrite_enabled: bool = True
+
+    # Numeric filter literals sent as bind parameters so similar queries share
+    # one prepared statement; per-template stats for the most recent templates
+    sql_templates_enabled: bool = True
+    sql_template_stats_size: int = 200
+
+    # Query result cache (shared by all workers on the host)
+    result_cache_enabled: bool = True
+    result_cache_path: str = "/tmp/geosql_result_cache.sqlite3"
+    result_cache_ttl: int = 300  # seconds
+    result_cache_stale_ttl: int = 600  # seconds a popular entry may be served stale
+    result_cache_swr_min_hits: int = 3
+    result_cache_max_entries: int = 500
+    result_cache_max_bytes: int = 256 * 1024 * 1024
+    result_cache_max_entry_bytes: int = 16 * 1024 * 1024
+    table_version_channel: str = "geo_table_changed"
+
+    # Vector tiles (on-disk cache invalidated by table versions)
+    tile_cache_enabled: bool = True
+    tile_cache_path: str = "/tmp/geosql_tile_cache.sqlite3"
+    tile_cache_ttl: int = 86400  # seconds
+    tile_cache_max_entries: int = 100000
+    tile_cache_max_bytes: int = 512 * 1024 * 1024
+    tile_cache_max_entry_bytes: int = 4 * 1024 * 1024
+    tile_extent: int = 4096
+    tile_buffer: int = 64
+    tile_max_zoom: int = 22
+
+    # Result budgets (per request)
+    max_result_rows: int = 10000
+    max_result_bytes: int = 50 * 1024 * 1024
+    preview_grid_size: int = 8  # cells per axis for spatially stratified previews
+
+    # Geometry detail (zoom/tolerance hints)
+    geojson_max_decimal_digits: int = 9  # coordinate precision; 9 is the PostGIS default
+    # Simplification tolerances (degrees) of geom_lod1..N; must match init-data/06-geometry-lod.sql
+    geometry_lod_tolerances: List[float] = [0.00005, 0.0005, 0.005]
+    geometry_lod_tables: List[str] = ["plans", "parks"]
+
+    # JSONL log of executed SQL, mined by tools/index_advisor.py (disabled when unset)
+    query_log_path: Optional[str] = None
+
+    # Pre-execution cost guard (EXPLAIN estimates, in planner cost units)
+    cost_guard_enabled: bool = True
+    max_query_cost: float = 5e7  # reject queries estimated above this
+    slow_lane_cost: float = 1e6  # run queries estimated above this in the slow lane
+    slow_lane_concurrency: int = 2
+    light_query_cost: float = 1e4
+    buffered_max_bytes: int = 1024 * 1024  # estimated result size fetched in one round trip
+    # Transaction-local settings per query class (light / medium / heavy)
+    query_class_tuning: Dict[str, Dict[str, str]] = {
+        "light": {"work_mem": "4MB", "max_parallel_workers_per_gather": "0"},
+        "medium": {"work_mem": "16MB", "max_parallel_workers_per_gather": "2"},
+        "heavy": {"work_mem": "64MB", "max_parallel_workers_per_gather": "4"},
+    }
+
+    # Streaming responses
+    stream_batch_size: int = 500  # rows fetched from the server-side cursor per round trip
+
+    # Request deadlines
+    request_timeout: float = 60.0  # seconds; default deadline per request
+    max_request_timeout: float = 120.0  # cap on deadlines requested via header
+    request_timeout_header: str = "X-Request-Timeout"
+
+    # Batch queries (/query/batch): distinct questions answered concurrently,
+    # their executions sharing a few pooled connections
+    batch_max_questions: int = 500
+    batch_concurrency: int = 8  # questions in flight at once (the LLM fan-out)
+    batch_execution_concurrency: int = 3  # of the DB_POOL_SIZE connections
+
+    # Prometheus metrics (/metrics)
+    metrics_enabled: bool = True
+    metrics_loop_lag_interval: float = 0.5  # seconds between event-loop lag probes
+
+    # Tracing (OpenTelemetry)
+    tracing_exporter: str = "none"  # none, console, file or otlp
+    tracing_service_name: str = "geosql-agent"
+    tracing_file_path: str = "/tmp/geosql_traces.jsonl"  # JSON span per line (file exporter)
+    tracing_otlp_endpoint: Optional[str] = None  # e.g. http://localhost:4318/v1/traces
+    tracing_sample_ratio: float = 1.0  # of new traces; propagated ones keep their decision
+
+    # Slow-query log (/admin/slow-queries)
+    slow_query_log_enabled: bool = True
+    slow_query_threshold: float = 2.0  # seconds of database time
+    slow_query_log_size: int = 100  # slow queries (and plan flips) kept
+    slow_query_capture_plans: bool = True  # re-run slow SQL under EXPLAIN (ANALYZE, BUFFERS)
+    slow_query_capture_timeout: float = 30.0  # statement_timeout of the EXPLAIN ANALYZE
+    slow_query_capture_interval: float = 300.0  # seconds before the same SQL is captured again
+    slow_query_capture_concurrency: int = 1  # pooled connections used for captures at most
+    plan_shape_max_fingerprints: int = 10000  # SQL whose last plan shape is remembered
+    admin_token: Optional[str] = None  # X-Admin-Token for /admin endpoints; unset disables them
+
+    # Columnar export (GeoParquet / Arrow IPC / FlatGeobuf)
+    export_batch_size: int = 10000  # rows per record batch / row group
+    export_max_rows: int = 5_000_000
+
+    # Pagination / query handles
+    query_handle_secret: Optional[str] = None  # HMAC key; derived from openai_api_key if unset
+    query_handle_ttl: int = 3600  # seconds
 
     # CORS
     cors_origins: List[str] = ["http://localhost:3010", "http://localhost:3000"]
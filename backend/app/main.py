@@ -12,6 +12,10 @@ from app.config import get_settings
 from app.api.routes import router
 from app.api.middleware import setup_middleware
 from app.services.database import get_db_service
+from app.services.openai_service import get_openai_service
+from app.services.metrics import EventLoopLagMonitor
+from app.services.query_service import get_query_service
+from app.services.tracing import setup_tracing
 from app import __version__
 
 # Configure logging
@@ -36,12 +40,18 @@ async def lifespan(app: FastAPI):
     logger.info(f"Debug mode: {settings.debug}")
     logger.info("=" * 80)
 
+    tracer_provider = setup_tracing()
+
     # Initialize services
     db_service = get_db_service()
-    if db_service.health_check():
+    if await db_service.health_check():
         logger.info("Database connection verified")
     else:
         logger.error("Database connection failed!")
+    await get_query_service().start()
+    lag_monitor = EventLoopLagMonitor(settings.metrics_loop_lag_interval)
+    if settings.metrics_enabled:
+        lag_monitor.start()
 
     logger.info("Application startup complete")
 
@@ -49,8 +59,13 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     logger.info("Shutting down application...")
-    db_service.close()
+    await lag_monitor.stop()
+    await get_query_service().close()
+    await db_service.close()
     logger.info("Database connections closed")
+    await get_openai_service().close()
+    if tracer_provider is not None:
+        tracer_provider.shutdown()
     logger.info("Application shutdown complete")
 
 
@@ -15,6 +15,32 @@ class QueryRequest(BaseModel):
         description="Natural language question to convert to SQL",
         example="Find all cafes within 200 meters of parks"
     )
+    page_size: Optional[int] = Field(
+        None,
+        ge=1,
+        le=5000,
+        description="Return results in keyset pages of this size with a continuation token"
+    )
+    max_rows: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Row budget for this request (capped by the server's limit)"
+    )
+    preview: bool = Field(
+        False,
+        description="When truncated, return a spatially stratified sample instead of the first rows"
+    )
+    zoom: Optional[float] = Field(
+        None,
+        ge=0,
+        le=24,
+        description="Map zoom level; picks simplified geometry and coordinate precision to match"
+    )
+    tolerance: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Acceptable geometry error in degrees (alternative to zoom)"
+    )
 
     @validator('question')
     def validate_question(cls, v):
@@ -43,9 +69,29 @@ class QueryResponse(BaseModel):
     """Response model for query execution"""
 
     sql: str = Field(..., description="Generated SQL query")
+    rewrites: List[str] = Field(
+        default_factory=list,
+        description="Index-aware rewrites applied to the generated SQL before execution"
+    )
     results: List[Dict[str, Any]] = Field(..., description="Query results")
     execution_time: float = Field(..., description="Execution time in seconds")
     result_count: int = Field(..., description="Number of results returned")
+    truncated: bool = Field(
+        False, description="Whether the row or byte budget cut the results short"
+    )
+    estimated_total: Optional[int] = Field(
+        None, description="Planner estimate of the full result size when truncated"
+    )
+    plan: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Pre-execution plan estimate (cost, rows, query class, lane, fetch strategy)"
+    )
+    next_token: Optional[str] = Field(
+        None, description="Continuation token for the next page (GET /query/next)"
+    )
+    query_handle: Optional[str] = Field(
+        None, description="Handle for follow-up requests on this query's SQL (e.g. vector tiles)"
+    )
     timestamp: datetime = Field(default_factory=datetime.utcnow, description="Response timestamp")
 
     class Config:
@@ -62,6 +108,36 @@ class QueryResponse(BaseModel):
         }
 
 
+class BatchQueryRequest(BaseModel):
+    """Request model for a batch of natural language queries"""
+
+    questions: List[str] = Field(
+        ...,
+        min_length=1,
+        description="Questions to answer; repeated questions are answered once",
+        examples=[["Show all parks", "How many cafes are there?"]]
+    )
+    max_rows: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Row budget for each question (capped by the server's limit)"
+    )
+    preview: bool = Field(
+        False,
+        description="When truncated, return a spatially stratified sample instead of the first rows"
+    )
+
+
+class BatchQueryResult(BaseModel):
+    """Outcome of one distinct question of a batch, streamed as a line of NDJSON"""
+
+    indices: List[int] = Field(..., description="Positions of the question in the request")
+    question: str = Field(..., description="The question as submitted")
+    status: int = Field(..., description="Status /query would have returned for the question")
+    response: Optional[QueryResponse] = Field(None, description="Query response when successful")
+    detail: Optional[str] = Field(None, description="Error detail when unsuccessful")
+
+
 class HealthResponse(BaseModel):
     """Health check response"""
 
@@ -0,0 +1,173 @@
+"""In-process caches with LRU + TTL eviction and optional disk persistence"""
+
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Hebrew final letters mapped to their regular forms
+_HEBREW_FINAL_LETTERS = str.maketrans({
+    "ך": "כ",
+    "ם": "מ",
+    "ן": "נ",
+    "ף": "פ",
+    "ץ": "צ",
+})
+
+_THOUSANDS_SEPARATOR = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_DECIMAL_POINT = re.compile(r"(?<=\d)\.(?=\d)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Sentence punctuation and quotes; comparison, arithmetic and sign characters
+# (< > = + - % ...) change the meaning of a question and are kept
+_SENTENCE_PUNCTUATION = frozenset(
+    "?!.,;:\u00bf\u00a1\u061f"
+    "\"'`\u2018\u2019\u201a\u201b\u201c\u201d\u201e\u201f\u00ab\u00bb\u2039\u203a"
+    "\u05f3\u05f4\u05c3"
+)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a natural language question for cache lookups
+
+    Folds case and whitespace, strips sentence punctuation and quotes, Hebrew
+    niqqud/cantillation marks and maps Hebrew final letters to their regular
+    forms, so trivially different spellings of the same question share one
+    cache entry.
+
+    Args:
+        question: Natural language question
+
+    Returns:
+        Normalized question string
+    """
+    text = unicodedata.normalize("NFKD", question)
+    # Drop combining marks (niqqud, cantillation, accents)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.translate(_HEBREW_FINAL_LETTERS).casefold()
+
+    # Keep numbers intact: "5,000" -> "5000", "2.5" stays "2.5"
+    text = _THOUSANDS_SEPARATOR.sub("", text)
+    text = _DECIMAL_POINT.sub("\x00", text)
+    text = "".join(" " if ch in _SENTENCE_PUNCTUATION else ch for ch in text)
+    text = text.replace("\x00", ".")
+
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_size: int, ttl: float, name: str = "cache"):
+        """
+        Args:
+            max_size: Maximum number of entries before LRU eviction
+            ttl: Entry lifetime in seconds
+            name: Cache name used in logs and stats
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used entries if full"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        """Remove an entry if present"""
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def save(self, path: str) -> None:
+        """Persist unexpired JSON-serializable entries to disk atomically"""
+        now = time.time()
+        entries = [
+            [key, value, expires_at]
+            for key, (value, expires_at) in self._entries.items()
+            if expires_at > now
+        ]
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            logger.info(f"{self.name}: persisted {len(entries)} entries to {path}")
+        except OSError as e:
+            logger.warning(f"{self.name}: failed to persist to {path}: {e}")
+
+    def load(self, path: str) -> int:
+        """Load entries persisted by save(), skipping expired ones"""
+        if not os.path.exists(path):
+            return 0
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"{self.name}: failed to load {path}: {e}")
+            return 0
+
+        now = time.time()
+        loaded = 0
+        for key, value, expires_at in entries:
+            if expires_at > now:
+                self._entries[key] = (value, expires_at)
+                loaded += 1
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        logger.info(f"{self.name}: loaded {loaded} entries from {path}")
+        return loaded
@@ -0,0 +1,112 @@
+"""Circuit breaker that stops calling a failing upstream until it recovers"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The upstream is failing; calls are rejected until it recovers"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    Closed: calls go through. After `failure_threshold` consecutive failures
+    the circuit opens and calls fail fast with CircuitOpenError. After
+    `reset_timeout` seconds it is half-open: a single trial call goes
+    through, closing the circuit if it succeeds and reopening it if not.
+
+    Only exceptions `is_failure` accepts count as failures; others (bad
+    requests, cancellation) neither trip nor reset the breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        is_failure: Callable[[BaseException], bool] = lambda e: isinstance(e, Exception)
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.counts: Dict[str, int] = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would currently be let through"""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and not self._trial_in_flight)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Run one call through the breaker
+
+        Raises:
+            CircuitOpenError: If the circuit is open (or its trial call is running)
+        """
+        if not self.available:
+            self.counts["rejected"] += 1
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open); try again shortly")
+
+        trial = self.state == HALF_OPEN
+        if trial:
+            self._trial_in_flight = True
+        try:
+            yield
+        except BaseException as e:
+            if self.is_failure(e):
+                self._record_failure()
+            raise
+        else:
+            self._record_success()
+        finally:
+            if trial:
+                self._trial_in_flight = False
+
+    def _record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"Circuit for {self.name} closed")
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def _record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or (
+            self.opened_at is None and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.counts["opened"] += 1
+            logger.warning(
+                f"Circuit for {self.name} opened after {self.consecutive_failures} "
+                f"consecutive failures; retrying in {self.reset_timeout:g}s"
+            )
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            **self.counts,
+        }
@@ -1,16 +1,76 @@
 """Database service for PostGIS operations"""
 
 from sqlalchemy import create_engine, text, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.pool import QueuePool
-from typing import List, Dict, Any, Tuple
+from opentelemetry.trace import Span, StatusCode
+from typing import (
+    List, Dict, Any, Tuple, Callable, AsyncGenerator, NamedTuple, Optional, Set
+)
+import asyncio
+import json
 import logging
-from contextlib import contextmanager
+import time
+from contextlib import AsyncExitStack, contextmanager, asynccontextmanager
 
 from app.config import get_settings
+from app.services.deadline import DeadlineExceeded, remaining_time
+from app.services.metrics import DB_POOL_WAIT
+from app.services.query_planner import current_tuning
+from app.services.schema_registry import (
+    CATALOG_COLUMNS_SQL,
+    CATALOG_GEOMETRY_SQL,
+    SchemaRegistry,
+    build_registry,
+    get_schema_registry
+)
+from app.services.slow_queries import SlowQueryLog
+from app.services.sql_templates import TemplateStats, parameterize_sql
+from app.services.tracing import tracer
+from app.services.sql_utils import (
+    apply_row_limit,
+    feature_collection_sql,
+    fingerprint_sql,
+    is_lod_column,
+    mvt_tile_sql,
+    spatial_preview_sql,
+    strip_statement
+)
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# SQLSTATE raised when a statement is cancelled (statement_timeout or cancel request)
+QUERY_CANCELED = "57014"
+
+
+def _async_database_url(database_url: str) -> str:
+    """Build the async driver URL (e.g. postgresql+asyncpg://) from the configured URL"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{settings.db_async_driver}").render_as_string(
+        hide_password=False
+    )
+
+
+class ResultSet(NamedTuple):
+    """Rows returned by a budgeted query"""
+
+    columns: List[str]
+    rows: List[Tuple]
+    truncated: bool = False
+    estimated_total: Optional[int] = None
+    plan: Optional[Dict[str, Any]] = None
+
+
+class RenderedResult(NamedTuple):
+    """A result already serialized by PostgreSQL"""
+
+    body: bytes
+    truncated: bool = False
+    estimated_total: Optional[int] = None
+
 
 class DatabaseService:
     """Service for database operations with connection pooling and error handling"""
@@ -26,6 +86,35 @@ class DatabaseService:
             pool_pre_ping=True,  # Verify connections before using
             echo=settings.debug
         )
+        # Async engine used on the request path so queries never block the event loop.
+        # asyncpg prepares every statement and keeps an LRU of them per connection,
+        # so a parameterized template is parsed and planned once per connection.
+        connect_args = {}
+        if settings.db_async_driver == "asyncpg":
+            connect_args["prepared_statement_cache_size"] = settings.db_statement_cache_size
+        self.async_engine = create_async_engine(
+            _async_database_url(settings.database_url),
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_pre_ping=True,
+            echo=settings.debug,
+            connect_args=connect_args
+        )
+        # Statements cancelled server-side by statement_timeout or a cancelled request
+        self.cancelled_queries = 0
+        # Callers waiting for a pooled async connection
+        self.pool_waiting = 0
+        # Executions per parameterized SQL template
+        self.templates = TemplateStats(settings.sql_template_stats_size)
+        # Slow executions with their EXPLAIN ANALYZE, and plan shapes per SQL
+        self.slow_queries = SlowQueryLog(
+            size=settings.slow_query_log_size,
+            max_fingerprints=settings.plan_shape_max_fingerprints,
+            capture_interval=settings.slow_query_capture_interval,
+            capture_concurrency=settings.slow_query_capture_concurrency
+        )
+        self._capture_tasks: Set[asyncio.Task] = set()
         logger.info(f"Database engine initialized with pool_size={settings.db_pool_size}")
 
     @contextmanager
@@ -42,17 +131,143 @@ class DatabaseService:
         finally:
             conn.close()
 
-    def health_check(self) -> bool:
+    @asynccontextmanager
+    async def get_async_connection(self):
+        """Async context manager for database connections"""
+        async with AsyncExitStack() as stack:
+            # Time spent waiting for the pool (including opening a connection)
+            self.pool_waiting += 1
+            start = time.perf_counter()
+            try:
+                with tracer.start_as_current_span("db.pool.acquire"):
+                    conn = await stack.enter_async_context(self.async_engine.connect())
+            finally:
+                self.pool_waiting -= 1
+                DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+            try:
+                yield conn
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                logger.error(f"Database error: {e}")
+                raise
+
+    @asynccontextmanager
+    async def get_request_connection(self):
+        """
+        Async connection bounded by the current request's deadline
+
+        The remaining time is applied as a transaction-local statement_timeout,
+        so PostgreSQL aborts the statement itself once the deadline passes.
+        Statements cancelled by the timeout raise DeadlineExceeded; a cancelled
+        request task cancels the running statement through the driver. The
+        current query class's tuning (work_mem, parallel workers) is applied
+        in the same round trip.
+        """
+        timeout_ms = max(1, int(remaining_time(settings.request_timeout) * 1000))
+        session = {"statement_timeout": str(timeout_ms), **current_tuning.get()}
+        set_local = text("SELECT " + ", ".join(
+            f"set_config(:name{i}, :value{i}, true)" for i in range(len(session))
+        ))
+        params = {}
+        for i, (name, value) in enumerate(session.items()):
+            params[f"name{i}"] = name
+            params[f"value{i}"] = value
+        try:
+            async with self.get_async_connection() as conn:
+                await conn.execute(set_local, params)
+                yield conn
+        except exc.DBAPIError as e:
+            if getattr(e.orig, "sqlstate", None) == QUERY_CANCELED:
+                self.cancelled_queries += 1
+                raise DeadlineExceeded("Query cancelled by statement timeout") from e
+            raise
+        except asyncio.CancelledError:
+            self.cancelled_queries += 1
+            logger.info("Query cancelled before completion")
+            raise
+
+    @staticmethod
+    def _template(sql: str) -> Tuple[str, Dict[str, Any]]:
+        """SQL to send and its bind parameters (see sql_templates.parameterize_sql)"""
+        if not settings.sql_templates_enabled:
+            return sql, {}
+        return parameterize_sql(sql)
+
+    @staticmethod
+    def _trace_sql(span: Span, sql: str) -> None:
+        """Identify the statement on its span (by fingerprint: the SQL may hold literals)"""
+        if span.is_recording():
+            span.set_attributes({
+                "db.system": "postgresql",
+                "geosql.sql.fingerprint": fingerprint_sql(sql),
+            })
+
+    def _record_execution(
+        self, sql: str, template: str, params: Dict[str, Any], elapsed: float, rows: int
+    ) -> None:
+        """Record an execution's timing; log it, and capture its plan, if it was slow"""
+        self.templates.record(template, params, elapsed)
+        if not settings.slow_query_log_enabled or elapsed < settings.slow_query_threshold:
+            return
+
+        entry = self.slow_queries.record(sql, elapsed, rows)
+        if not settings.slow_query_capture_plans:
+            entry["capture"] = "disabled"
+            return
+        if self.slow_queries.start_capture(entry):
+            task = asyncio.get_running_loop().create_task(
+                self._capture_plan(entry, template, params)
+            )
+            self._capture_tasks.add(task)
+            task.add_done_callback(self._capture_tasks.discard)
+
+    async def _capture_plan(
+        self, entry: Dict[str, Any], template: str, params: Dict[str, Any]
+    ) -> None:
+        """
+        EXPLAIN (ANALYZE, BUFFERS) a slow query on a connection of its own
+
+        ANALYZE runs the query again, so it runs in a read-only transaction
+        bounded by SLOW_QUERY_CAPTURE_TIMEOUT rather than the request deadline.
+        """
+        timeout_ms = str(int(settings.slow_query_capture_timeout * 1000))
+        explained: Optional[Dict[str, Any]] = None
+        error = "cancelled"
+        try:
+            async with self.get_async_connection() as conn:
+                await conn.execute(text("SET TRANSACTION READ ONLY"))
+                await conn.execute(
+                    text("SELECT set_config('statement_timeout', :timeout, true)"),
+                    {"timeout": timeout_ms}
+                )
+                result = await conn.execute(
+                    text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {strip_statement(template)}"),
+                    params
+                )
+                plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            explained = plan[0]
+        except Exception as e:
+            logger.warning(f"Capturing the plan of slow query {entry['fingerprint']} failed: {e}")
+            error = str(e)
+        finally:
+            # Always release the capture slot, whatever ended the capture
+            self.slow_queries.finish_capture(entry, explained, error)
+
+    async def health_check(self) -> bool:
         """Check database connection health"""
         try:
-            with self.get_connection() as conn:
-                conn.execute(text("SELECT 1"))
+            async with self.get_async_connection() as conn:
+                await conn.execute(text("SELECT 1"))
             return True
         except Exception as e:
             logger.error(f"Health check failed: {e}")
             return False
 
-    def execute_query(self, sql: str) -> Tuple[List[str], List[Tuple]]:
+    async def execute_query(self, sql: str) -> Tuple[List[str], List[Tuple]]:
         """
         Execute SQL query safely and return columns and rows
 
@@ -66,77 +281,369 @@ class DatabaseService:
             exc.SQLAlchemyError: If query execution fails
         """
         logger.info(f"Executing SQL query: {sql[:100]}...")
+        template, params = self._template(sql)
+
+        with tracer.start_as_current_span("db.execute") as span:
+            self._trace_sql(span, sql)
+            try:
+                async with self.get_request_connection() as conn:
+                    start = time.perf_counter()
+                    result = await conn.execute(text(template), params)
+                    columns = list(result.keys())
+                    rows = result.fetchall()
+                    self._record_execution(
+                        sql, template, params, time.perf_counter() - start, len(rows)
+                    )
+
+                    logger.info(f"Query successful: {len(rows)} rows, {len(columns)} columns")
+                    span.set_attribute("db.rows", len(rows))
+                    return columns, rows
+
+            except exc.SQLAlchemyError as e:
+                logger.error(f"SQL execution error: {e}")
+                raise
+
+    async def execute_bounded(
+        self,
+        sql: str,
+        max_rows: int,
+        max_bytes: int,
+        preview: bool = False,
+        buffered: bool = False,
+        estimated_rows: Optional[int] = None
+    ) -> ResultSet:
+        """
+        Execute SQL within a row and byte budget
 
+        A LIMIT of max_rows + 1 is injected (or an existing larger LIMIT is
+        clamped) so overflow can be detected, and rows are fetched in batches
+        from a server-side cursor until either budget is exhausted. When the
+        result is truncated, the planner's row estimate for the unbounded
+        query is returned as estimated_total.
+
+        Results expected to be small can be fetched `buffered`, in a single
+        round trip without declaring a cursor.
+
+        Args:
+            sql: Validated SQL query string
+            max_rows: Maximum number of rows to return
+            max_bytes: Approximate maximum payload size of the returned rows
+            preview: Return a spatially stratified sample instead of the first rows
+            buffered: Fetch all (bounded) rows at once instead of through a cursor
+            estimated_rows: Planner row estimate already known for `sql`
+
+        Returns:
+            ResultSet with the rows, a truncated flag and the estimated total
+        """
+        bounded_sql = await self._bounded_sql(sql, max_rows + 1, preview)
+
+        columns: List[str] = []
+        rows: List[Tuple] = []
+        size = 0
+        truncated = False
+
+        if buffered:
+            batches = self._fetch_all(bounded_sql)
+        else:
+            batches = self.stream_query(
+                bounded_sql, min(settings.stream_batch_size, max_rows + 1)
+            )
         try:
-            with self.get_connection() as conn:
-                result = conn.execute(text(sql))
-                columns = list(result.keys())
-                rows = result.fetchall()
+            async for columns, batch in batches:
+                for row in batch:
+                    size += self._estimate_row_bytes(row)
+                    if len(rows) >= max_rows or size > max_bytes:
+                        truncated = True
+                        break
+                    rows.append(tuple(row))
+                if truncated:
+                    break
+        finally:
+            await batches.aclose()
+
+        estimated_total = None
+        if truncated:
+            estimated_total = await self._estimate_total(sql, estimated_rows, len(rows))
+            logger.info(
+                f"Result truncated at {len(rows)} rows (~{size} bytes), "
+                f"estimated total: {estimated_total}"
+            )
+
+        return ResultSet(columns, rows, truncated, estimated_total)
+
+    async def _bounded_sql(self, sql: str, limit: int, preview: bool) -> str:
+        """The query limited to `limit` rows, as a spatial sample if a preview is asked for"""
+        if preview and "geojson" in await self.describe_columns(sql):
+            return spatial_preview_sql(sql, limit, settings.preview_grid_size)
+        return apply_row_limit(sql, limit)
+
+    async def _estimate_total(
+        self, sql: str, estimated_rows: Optional[int], returned: int
+    ) -> Optional[int]:
+        """The size of a truncated result: the planner estimate, but more than was returned"""
+        if estimated_rows is None:
+            plan = await self.explain(sql)
+            estimated_rows = int(plan.get("Plan Rows", 0)) if plan else None
+        if estimated_rows is None:
+            return None
+        return max(estimated_rows, returned + 1)
+
+    async def execute_feature_collection(
+        self, sql: str, max_rows: int, max_bytes: int
+    ) -> RenderedResult:
+        """
+        Execute SQL and have PostGIS build the GeoJSON FeatureCollection
 
-                logger.info(f"Query successful: {len(rows)} rows, {len(columns)} columns")
-                return columns, rows
+        The document is aggregated with json_agg in the database and returned
+        as-is, so geometries are never parsed or re-serialized in Python.
 
-        except exc.SQLAlchemyError as e:
-            logger.error(f"SQL execution error: {e}")
+        Args:
+            sql: Validated SQL query string
+            max_rows: Maximum number of Features
+            max_bytes: Approximate maximum size of the Features' geometry text
+
+        Returns:
+            RenderedResult with the FeatureCollection bytes
+        """
+        columns = await self.describe_columns(sql)
+        _, rows = await self.execute_query(
+            feature_collection_sql(sql, columns, max_rows, max_bytes)
+        )
+        collection, truncated = rows[0]
+
+        estimated_total = None
+        if truncated:
+            plan = await self.explain(sql)
+            if plan:
+                estimated_total = int(plan.get("Plan Rows", 0))
+            logger.info(f"FeatureCollection truncated, estimated total: {estimated_total}")
+
+        return RenderedResult(collection.encode("utf-8"), bool(truncated), estimated_total)
+
+    async def render_tile(
+        self, sql: str, columns: List[str], z: int, x: int, y: int
+    ) -> bytes:
+        """
+        Render one Mapbox Vector Tile of a query's results with ST_AsMVT
+
+        Args:
+            sql: Validated SQL query string with a `geojson` column
+            columns: Column names the query produces
+            z, x, y: Tile coordinates
+
+        Returns:
+            Encoded tile (empty if no features fall in the tile)
+        """
+        _, rows = await self.execute_query(
+            mvt_tile_sql(sql, columns, z, x, y, settings.tile_extent, settings.tile_buffer)
+        )
+        tile = rows[0][0] if rows else None
+        return bytes(tile) if tile else b""
+
+    async def _fetch_all(self, sql: str) -> AsyncGenerator[Tuple[List[str], List[Tuple]], None]:
+        """Yield a query's whole result as a single batch"""
+        columns, rows = await self.execute_query(sql)
+        yield self._without_lod_columns(columns, rows)
+
+    @staticmethod
+    def _without_lod_columns(
+        columns: List[str], rows: List[Tuple]
+    ) -> Tuple[List[str], List[Tuple]]:
+        """Drop the generated geom_lod<N> columns a SELECT * brings along"""
+        keep = [i for i, column in enumerate(columns) if not is_lod_column(column)]
+        if len(keep) == len(columns):
+            return columns, rows
+        return [columns[i] for i in keep], [tuple(row[i] for i in keep) for row in rows]
+
+    @staticmethod
+    def _estimate_row_bytes(row: Tuple) -> int:
+        """Approximate serialized size of a row"""
+        return sum(
+            len(value) if isinstance(value, (str, bytes)) else 8
+            for value in row
+        )
+
+    async def describe_columns(self, sql: str) -> List[str]:
+        """Return the column names a query produces without fetching rows"""
+        columns, _ = await self.execute_query(
+            f"SELECT * FROM ({strip_statement(sql)}) AS _probe LIMIT 0"
+        )
+        return columns
+
+    async def describe_column_types(self, sql: str) -> List[Optional[int]]:
+        """Return the PostgreSQL type OID of each column a query produces, without fetching rows"""
+        template, params = self._template(
+            f"SELECT * FROM ({strip_statement(sql)}) AS _probe LIMIT 0"
+        )
+        async with self.get_request_connection() as conn:
+            result = await conn.execute(text(template), params)
+            description = result.cursor.description if result.cursor is not None else None
+        return [column[1] for column in description or ()]
+
+    async def explain(self, sql: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the planner's top plan node for a query (EXPLAIN FORMAT JSON)
+
+        Returns None if the query cannot be explained.
+        """
+        template, params = self._template(sql)
+        with tracer.start_as_current_span("db.explain") as span:
+            self._trace_sql(span, sql)
+            try:
+                async with self.get_request_connection() as conn:
+                    result = await conn.execute(
+                        text(f"EXPLAIN (FORMAT JSON) {strip_statement(template)}"), params
+                    )
+                    plan = result.scalar()
+            except (exc.SQLAlchemyError, OSError) as e:
+                logger.warning(f"EXPLAIN failed: {e}")
+                span.set_status(StatusCode.ERROR, str(e))
+                return None
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        top: Dict[str, Any] = plan[0]["Plan"]
+        if settings.slow_query_log_enabled:
+            self.slow_queries.observe_plan(sql, top)
+        return top
+
+    async def stream_query(
+        self, sql: str, batch_size: int
+    ) -> AsyncGenerator[Tuple[List[str], List[Tuple]], None]:
+        """
+        Execute SQL through a named server-side cursor and yield rows in batches
+
+        Only one batch is held in memory at a time. At least one (possibly
+        empty) batch is always yielded so callers receive the column names.
+
+        Args:
+            sql: Validated SQL query string
+            batch_size: Rows fetched per round trip
+
+        Yields:
+            Tuples of (column_names, rows)
+        """
+        logger.info(f"Streaming SQL query: {sql[:100]}...")
+        template, params = self._template(sql)
+
+        # Not made current: the context cannot be held across the yields
+        span = tracer.start_span("db.stream")
+        self._trace_sql(span, sql)
+        total = 0
+        try:
+            # The cursor lives in the transaction opened by the SET LOCAL settings
+            async with self.get_request_connection() as conn:
+                # Time spent in the database, not waiting for the consumer between batches
+                start = time.perf_counter()
+                declare = f"DECLARE geosql_stream NO SCROLL CURSOR FOR {strip_statement(template)}"
+                await conn.execute(text(declare), params)
+                fetch = text(f"FETCH FORWARD {int(batch_size)} FROM geosql_stream")
+                elapsed = 0.0
+                while True:
+                    result = await conn.execute(fetch)
+                    columns, rows = self._without_lod_columns(
+                        list(result.keys()), result.fetchall()
+                    )
+                    elapsed += time.perf_counter() - start
+                    total += len(rows)
+                    yield columns, rows
+                    if len(rows) < batch_size:
+                        break
+                    start = time.perf_counter()
+                await conn.execute(text("CLOSE geosql_stream"))
+                self._record_execution(sql, template, params, elapsed, total)
+
+            logger.info(f"Streaming query finished: {total} rows")
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(StatusCode.ERROR, str(e))
             raise
+        finally:
+            span.set_attribute("db.rows", total)
+            span.end()
+
+    async def get_table_versions(self) -> Dict[str, int]:
+        """
+        Get per-table data versions maintained by the geo_table_versions trigger
+
+        Returns an empty dict if the versions table has not been created or
+        PostgreSQL cannot be reached.
+        """
+        try:
+            async with self.get_async_connection() as conn:
+                result = await conn.execute(
+                    text("SELECT table_name, version FROM geo_table_versions")
+                )
+                return {row[0]: int(row[1]) for row in result.fetchall()}
+        except (exc.SQLAlchemyError, OSError) as e:
+            logger.warning(f"Failed to read table versions: {e}")
+            return {}
+
+    async def listen(self, channel: str, callback: Callable[[str], Any]):
+        """
+        Open a dedicated connection that LISTENs on a notification channel
+
+        Args:
+            channel: PostgreSQL NOTIFY channel name
+            callback: Called with each notification payload
+
+        Returns:
+            The listening asyncpg connection; close it to stop listening
+        """
+        import asyncpg
+
+        dsn = make_url(settings.database_url).set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        conn = await asyncpg.connect(dsn)
+        await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+        logger.info(f"Listening for notifications on channel '{channel}'")
+        return conn
 
     def get_table_count(self, table_name: str) -> int:
         """
         Get count of records in a table
 
-        Note: table_name is validated against known tables in get_schema_info()
-        to prevent SQL injection
+        Note: table_name is validated against the schema registry to prevent
+        SQL injection
         """
-        # Whitelist of allowed tables
-        allowed_tables = ["cafes", "parks", "roads", "plans"]
-        if table_name not in allowed_tables:
+        if table_name not in get_schema_registry():
             logger.warning(f"Invalid table name requested: {table_name}")
             return 0
 
         try:
             with self.get_connection() as conn:
-                # Safe to use here as table_name is whitelisted
-                result = conn.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
+                # Safe to use here as table_name is a registered table
+                result = conn.execute(text(f'SELECT COUNT(*) FROM "{table_name}"'))
                 return result.scalar()
         except exc.SQLAlchemyError as e:
             logger.warning(f"Failed to get count for table {table_name}: {e}")
             return 0
 
     def get_schema_info(self) -> Dict[str, Any]:
-        """Get database schema information"""
+        """Get database schema information from the schema registry"""
         tables_info = {
-            "cafes": {
-                "columns": ["id", "name", "geom", "address"],
-                "geometry_type": "Point",
-                "description": "Coffee shops and cafes"
-            },
-            "parks": {
-                "columns": ["id", "name", "geom", "area"],
-                "geometry_type": "Polygon",
-                "description": "Parks and green spaces"
-            },
-            "roads": {
-                "columns": ["id", "name", "geom", "road_type"],
-                "geometry_type": "LineString",
-                "description": "Roads and streets"
-            },
-            "plans": {
-                "columns": [
-                    "id", "pl_number", "pl_name", "pl_url", "pl_area_dunam",
-                    "quantity_delta_120", "station_desc", "internet_short_status",
-                    "pl_date_advertise", "pl_date_8", "plan_county_name",
-                    "pl_landuse_string", "geom"
-                ],
-                "geometry_type": "Polygon",
-                "description": "תכניות בניין עיר - Israeli Planning Data"
+            table.name: {
+                "columns": table.column_names,
+                "geometry_type": table.geometry_type,
+                "description": table.description,
+                "count": self.get_table_count(table.name),
             }
+            for table in get_schema_registry().tables.values()
         }
+        return tables_info
 
-        # Add counts
-        for table_name in tables_info.keys():
-            tables_info[table_name]["count"] = self.get_table_count(table_name)
+    def introspect_schema(self) -> SchemaRegistry:
+        """
+        Build the schema registry from the live catalog
 
-        return tables_info
+        Raises:
+            exc.SQLAlchemyError: If the catalog cannot be read
+        """
+        with self.get_connection() as conn:
+            column_rows = conn.execute(text(CATALOG_COLUMNS_SQL)).fetchall()
+            geometry_rows = conn.execute(text(CATALOG_GEOMETRY_SQL)).fetchall()
+        return build_registry(column_rows, geometry_rows)
 
     def validate_sql(self, sql: str) -> Tuple[bool, str]:
         """
@@ -165,8 +672,13 @@ class DatabaseService:
 
         return True, ""
 
-    def close(self):
-        """Close database engine and connections"""
+    async def close(self):
+        """Close database engines and connections"""
+        for task in self._capture_tasks:
+            task.cancel()
+        await asyncio.gather(*self._capture_tasks, return_exceptions=True)
+        if self.async_engine:
+            await self.async_engine.dispose()
         if self.engine:
             self.engine.dispose()
             logger.info("Database engine closed")
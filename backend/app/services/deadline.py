@@ -0,0 +1,153 @@
+"""Per-request deadlines propagated through the query pipeline"""
+
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import AsyncGenerator, Awaitable, Callable, Optional, TypeVar
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+T = TypeVar("T")
+
+# How often a running request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """The request ran past its deadline"""
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the request finished"""
+
+
+class Deadline:
+    """Absolute point in (monotonic) time by which a request must finish"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> "Deadline":
+        """
+        Build a deadline from a request timeout header (seconds)
+
+        Missing or invalid values fall back to REQUEST_TIMEOUT; larger values
+        are capped at MAX_REQUEST_TIMEOUT.
+        """
+        timeout = settings.request_timeout
+        if value:
+            try:
+                timeout = float(value)
+            except ValueError:
+                logger.warning(f"Ignoring invalid request timeout header: {value!r}")
+            else:
+                if timeout <= 0:
+                    raise ValueError("Request timeout must be positive")
+        return cls(min(timeout, settings.max_request_timeout))
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        """Raise DeadlineExceeded if the deadline has passed"""
+        if self.expired:
+            raise DeadlineExceeded(f"Request exceeded its {self.timeout:g}s deadline")
+
+
+# Deadline of the request being served, inherited by tasks it spawns
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def remaining_time(default: float) -> float:
+    """
+    Seconds left on the current request's deadline
+
+    Raises DeadlineExceeded if it has already passed; returns `default` when
+    no deadline is set (e.g. background work).
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    deadline.check()
+    return deadline.remaining()
+
+
+async def run_with_deadline(
+    coro: Awaitable[T],
+    deadline: Deadline,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> T:
+    """
+    Run a coroutine under a deadline, cancelling it if the client goes away
+
+    The coroutine runs as a task with `deadline` as its current deadline.
+    Cancelling it propagates down to the database driver, which cancels the
+    running statement server-side.
+
+    Args:
+        coro: The request's work
+        deadline: Deadline to enforce
+        is_disconnected: Optional callback reporting whether the client is gone
+
+    Raises:
+        DeadlineExceeded: If the deadline passes first
+        ClientDisconnected: If the client disconnects first
+    """
+    token = current_deadline.set(deadline)
+    try:
+        task = asyncio.ensure_future(coro)
+    finally:
+        current_deadline.reset(token)
+
+    try:
+        while True:
+            timeout = deadline.remaining()
+            if is_disconnected is not None:
+                timeout = min(timeout, DISCONNECT_POLL_INTERVAL)
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if deadline.expired:
+                raise DeadlineExceeded(f"Request exceeded its {deadline.timeout:g}s deadline")
+            if is_disconnected is not None and await is_disconnected():
+                raise ClientDisconnected("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def iterate_with_deadline(
+    items: AsyncGenerator[T, None], deadline: Deadline
+) -> AsyncGenerator[T, None]:
+    """
+    Iterate an async generator under a deadline
+
+    Each step runs through run_with_deadline, so the generator sees
+    `deadline` as its current deadline and a step still running when it
+    passes is cancelled. The generator is closed when iteration stops,
+    including when the consumer is cancelled (e.g. the client disconnected).
+
+    Raises:
+        DeadlineExceeded: If the deadline passes before the generator finishes
+    """
+    try:
+        while True:
+            try:
+                item = await run_with_deadline(items.__anext__(), deadline)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await items.aclose()
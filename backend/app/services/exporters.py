@@ -0,0 +1,283 @@
+"""Columnar export of query results as GeoParquet, Arrow IPC or FlatGeobuf"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Name of the WKB geometry column in exported files
+GEOMETRY_COLUMN = "geometry"
+
+# Export format -> (media type, file extension)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "geoparquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "flatgeobuf": ("application/flatgeobuf", "fgb"),
+}
+
+# Size of the chunks a finished FlatGeobuf file is streamed in
+FILE_CHUNK_SIZE = 1024 * 1024
+
+# PostgreSQL type OID -> Arrow type alias, for columns typed from the cursor description
+PG_ARROW_TYPES: Dict[int, str] = {
+    16: "bool",  # bool
+    17: "binary",  # bytea
+    19: "string",  # name
+    20: "int64",  # int8
+    21: "int64",  # int2
+    23: "int64",  # int4
+    25: "string",  # text
+    114: "string",  # json
+    700: "float64",  # float4
+    701: "float64",  # float8
+    1042: "string",  # bpchar
+    1043: "string",  # varchar
+    1082: "date32",  # date
+    1114: "timestamp[us]",  # timestamp
+    1700: "float64",  # numeric
+    2950: "string",  # uuid
+    3802: "string",  # jsonb
+}
+
+# timestamptz has no alias: asyncpg returns aware datetimes, kept in UTC
+PG_TIMESTAMPTZ = 1184
+
+
+def arrow_type(type_oid: Optional[int]) -> Optional["pa.DataType"]:
+    """Return the Arrow type for a PostgreSQL type OID, or None if it must be inferred"""
+    if type_oid == PG_TIMESTAMPTZ:
+        return pa.timestamp("us", tz="UTC")
+    alias = PG_ARROW_TYPES.get(type_oid) if type_oid is not None else None
+    return pa.type_for_alias(alias) if alias else None
+
+
+def check_export_format(output_format: str) -> None:
+    """
+    Check an export format is known and its dependencies are installed
+
+    Raises:
+        ValueError: If the format is unknown or cannot be produced here
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unsupported export format: {output_format} "
+            f"(expected one of {', '.join(EXPORT_FORMATS)})"
+        )
+    if pa is None:
+        raise ValueError("Columnar export requires pyarrow")
+    if output_format == "flatgeobuf":
+        try:
+            import pyogrio  # noqa: F401
+        except ImportError:
+            raise ValueError("FlatGeobuf export requires pyogrio")
+
+
+class _ChunkSink:
+    """Write-only file object that collects written bytes until drained"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class RecordBatchBuilder:
+    """
+    Convert row tuples from the cursor into Arrow record batches
+
+    Column types come from the PostgreSQL types in the cursor description, so
+    an all-NULL first batch or a wider value later on does not change the
+    schema. Columns of unmapped types are inferred from the first batch
+    (nulls become strings, numerics become float64). Later batches are cast
+    to the schema, so every batch of one export shares it. Geometry is kept
+    as WKB binary.
+    """
+
+    def __init__(self, columns: Sequence[str], type_oids: Sequence[Optional[int]] = ()):
+        self.columns = list(columns)
+        self.types = [arrow_type(oid) for oid in type_oids] or [None] * len(self.columns)
+        self.schema: Optional["pa.Schema"] = None
+
+    def build(self, rows: Sequence[Tuple]) -> "pa.RecordBatch":
+        values_by_column = list(zip(*rows)) if rows else [()] * len(self.columns)
+        if self.schema is None:
+            arrays = [
+                self._infer(values) if field_type is None else self._cast(values, field_type)
+                for values, field_type in zip(values_by_column, self.types)
+            ]
+            self.schema = self._schema_for(arrays)
+        else:
+            arrays = [
+                self._cast(values, field.type)
+                for values, field in zip(values_by_column, self.schema)
+            ]
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    @staticmethod
+    def _infer(values: Sequence) -> "pa.Array":
+        array = pa.array(values)
+        if pa.types.is_null(array.type):
+            return array.cast(pa.string())
+        if pa.types.is_decimal(array.type):
+            return array.cast(pa.float64())
+        return array
+
+    @staticmethod
+    def _cast(values: Sequence, arrow_type: "pa.DataType") -> "pa.Array":
+        try:
+            array = pa.array(values)
+            return array if array.type == arrow_type else array.cast(arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            if not pa.types.is_string(arrow_type):
+                raise
+            return pa.array([None if v is None else str(v) for v in values], type=arrow_type)
+
+    def _schema_for(self, arrays: List["pa.Array"]) -> "pa.Schema":
+        fields = []
+        for name, array in zip(self.columns, arrays):
+            if name == GEOMETRY_COLUMN:
+                fields.append(pa.field(
+                    name, pa.binary(), metadata={"ARROW:extension:name": "geoarrow.wkb"}
+                ))
+            else:
+                fields.append(pa.field(name, array.type))
+        geo = {
+            "version": "1.0.0",
+            "primary_column": GEOMETRY_COLUMN,
+            "columns": {GEOMETRY_COLUMN: {"encoding": "WKB", "geometry_types": []}},
+        }
+        return pa.schema(fields, metadata={"geo": json.dumps(geo)})
+
+
+async def export_batches(
+    columns: Sequence[str],
+    batches: AsyncIterator[Tuple[List[str], List[Tuple]]],
+    output_format: str,
+    first_rows: Sequence[Tuple] = (),
+    type_oids: Sequence[Optional[int]] = ()
+) -> AsyncIterator[bytes]:
+    """
+    Encode cursor batches into an export file, yielding bytes as they are written
+
+    GeoParquet writes one row group per batch and Arrow IPC one record batch
+    per batch, so only the current batch is held in memory. FlatGeobuf is
+    written by GDAL (pyogrio) from a temporary Arrow file once all rows are
+    in, then streamed from disk.
+
+    Args:
+        columns: Column names (including the WKB `geometry` column)
+        batches: Remaining (columns, rows) batches from the server-side cursor
+        output_format: One of EXPORT_FORMATS
+        first_rows: Rows already fetched before the export started
+        type_oids: PostgreSQL type OID of each column, from the cursor description
+
+    Yields:
+        Chunks of the export file
+    """
+    builder = RecordBatchBuilder(columns, type_oids)
+    if output_format == "flatgeobuf":
+        async for chunk in _export_flatgeobuf(builder, batches, first_rows):
+            yield chunk
+        return
+
+    sink = _ChunkSink()
+    writer = None
+    try:
+        async for rows in _with_first(batches, first_rows):
+            batch = builder.build(rows)
+            if writer is None:
+                writer = _open_writer(output_format, sink, batch.schema)
+            await asyncio.to_thread(writer.write_batch, batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        if writer is not None:
+            writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+async def _with_first(
+    batches: AsyncIterator[Tuple[List[str], List[Tuple]]], first_rows: Sequence[Tuple]
+) -> AsyncIterator[Sequence[Tuple]]:
+    """Yield the pre-fetched rows (always, so the schema exists) then the remaining batches"""
+    yield first_rows
+    async for _, rows in batches:
+        if rows:
+            yield rows
+
+
+def _open_writer(output_format: str, sink: _ChunkSink, schema: "pa.Schema"):
+    if output_format == "geoparquet":
+        return pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+    return pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+
+
+async def _export_flatgeobuf(
+    builder: RecordBatchBuilder,
+    batches: AsyncIterator[Tuple[List[str], List[Tuple]]],
+    first_rows: Sequence[Tuple]
+) -> AsyncIterator[bytes]:
+    import pyogrio
+
+    with tempfile.TemporaryDirectory(prefix="geosql-export-") as tmp:
+        arrow_path = os.path.join(tmp, "rows.arrow")
+        fgb_path = os.path.join(tmp, "rows.fgb")
+
+        # Spool batches to an Arrow file on disk rather than memory
+        writer = None
+        try:
+            async for rows in _with_first(batches, first_rows):
+                batch = builder.build(rows)
+                if writer is None:
+                    writer = pa.ipc.new_file(arrow_path, batch.schema)
+                await asyncio.to_thread(writer.write_batch, batch)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        def convert() -> None:
+            with pa.memory_map(arrow_path) as source:
+                reader = pa.ipc.open_file(source)
+                table = reader.read_all()
+                pyogrio.write_arrow(
+                    table, fgb_path, driver="FlatGeobuf", geometry_name=GEOMETRY_COLUMN,
+                    geometry_type="Unknown", crs="EPSG:4326"
+                )
+
+        await asyncio.to_thread(convert)
+        logger.info(f"FlatGeobuf export written: {os.path.getsize(fgb_path)} bytes")
+
+        with open(fgb_path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
@@ -0,0 +1,81 @@
+"""Incremental GeoJSON / NDJSON encoding of query rows"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable, Sequence
+
+GEOJSON_COLUMN = "geojson"
+
+FEATURE_COLLECTION_PREFIX = b'{"type":"FeatureCollection","features":['
+FEATURE_COLLECTION_SUFFIX = b"]}"
+
+
+def json_default(value: Any) -> Any:
+    """JSON encoder fallback for database types"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_feature(columns: Sequence[str], row: Sequence[Any]) -> bytes:
+    """
+    Encode one row as a GeoJSON Feature
+
+    The geometry is spliced in from the ST_AsGeoJSON text as-is, so it is
+    never parsed or re-serialized in Python.
+    """
+    properties = {}
+    geometry = "null"
+    for column, value in zip(columns, row):
+        if column == GEOJSON_COLUMN:
+            if value is not None:
+                geometry = value if isinstance(value, str) else json.dumps(value)
+        else:
+            properties[column] = value
+
+    feature_id = properties.get("id")
+    id_member = ""
+    if feature_id is not None:
+        id_member = f'"id":{json.dumps(feature_id, default=json_default)},'
+    return (
+        f'{{"type":"Feature",{id_member}"geometry":{geometry},"properties":'
+        f'{json.dumps(properties, ensure_ascii=False, default=json_default)}}}'
+    ).encode("utf-8")
+
+
+def encode_ndjson_batch(columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> bytes:
+    """Encode rows as newline-delimited GeoJSON Features"""
+    return b"".join(encode_feature(columns, row) + b"\n" for row in rows)
+
+
+def encode_feature_collection_batch(
+    columns: Sequence[str], rows: Sequence[Sequence[Any]], first: bool
+) -> bytes:
+    """Encode rows as comma-separated Features inside a streamed FeatureCollection"""
+    if not rows:
+        return b""
+    body = b",".join(encode_feature(columns, row) for row in rows)
+    return body if first else b"," + body
+
+
+def encode_feature_batch(columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> bytes:
+    """Encode rows as a standalone `{"features": [...]}` JSON object"""
+    return b'{"features":[' + b",".join(encode_feature(columns, row) for row in rows) + b"]}"
+
+
+def encode_sse(event: str, data: Any) -> bytes:
+    """
+    Encode one Server-Sent Event
+
+    `data` is serialized as JSON unless it is already encoded bytes. JSON
+    text never contains raw newlines, so it always fits on one data line.
+    """
+    payload = data if isinstance(data, bytes) else json.dumps(
+        data, ensure_ascii=False, default=json_default
+    ).encode("utf-8")
+    return b"event: " + event.encode("ascii") + b"\ndata: " + payload + b"\n\n"
@@ -0,0 +1,72 @@
+"""Signed, opaque handles binding follow-up requests to already-validated SQL"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+def _secret() -> bytes:
+    """HMAC key shared by all workers"""
+    if settings.query_handle_secret:
+        return settings.query_handle_secret.encode("utf-8")
+    # Fall back to a key derived from configuration every worker already shares
+    return hashlib.sha256(f"geosql-handle:{settings.openai_api_key}".encode("utf-8")).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def encode_handle(payload: Dict[str, Any]) -> str:
+    """
+    Encode a payload as a signed, expiring handle
+
+    The handle is tamper-proof but not encrypted; it may carry validated SQL
+    that the client is allowed to see anyway.
+
+    Args:
+        payload: JSON-serializable state (e.g. {"sql": ..., "after": ...})
+
+    Returns:
+        Opaque URL-safe token
+    """
+    body = dict(payload, exp=int(time.time()) + settings.query_handle_ttl)
+    data = _b64encode(json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    signature = _b64encode(hmac.new(_secret(), data.encode("ascii"), hashlib.sha256).digest())
+    return f"{data}.{signature}"
+
+
+def decode_handle(token: str) -> Dict[str, Any]:
+    """
+    Verify and decode a handle produced by encode_handle
+
+    Raises:
+        ValueError: If the handle is malformed, tampered with or expired
+    """
+    data, _, signature = token.partition(".")
+    if not data or not signature:
+        raise ValueError("Malformed query handle")
+
+    expected = _b64encode(hmac.new(_secret(), data.encode("ascii"), hashlib.sha256).digest())
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("Invalid query handle")
+
+    try:
+        payload: Dict[str, Any] = json.loads(_b64decode(data))
+    except ValueError:
+        raise ValueError("Malformed query handle")
+
+    if payload.pop("exp", 0) < time.time():
+        raise ValueError("Query handle has expired")
+    return payload
@@ -0,0 +1,173 @@
+"""Hedged calls: latency quantiles, an extra-call budget and first-success races"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Latencies of the most recent `window` calls"""
+
+    def __init__(self, window: int):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Nearest-rank quantile of the window (None when empty)"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class CallBudget:
+    """
+    Token bucket capping extra calls at a fraction of primary calls
+
+    Every primary call deposits `ratio` tokens, up to `burst`; an extra
+    (hedged or speculative) call spends one. With ratio 0.1, at most about
+    one call in ten is duplicated however slow the upstream gets, so
+    hedging cannot multiply load during an outage.
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.balance = burst
+
+    def deposit(self) -> None:
+        self.balance = min(self.burst, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one token if available"""
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        return False
+
+
+async def first_success(tasks: Sequence["asyncio.Future[T]"]) -> Tuple[int, T]:
+    """
+    Wait for the first task to succeed
+
+    Returns:
+        Tuple of (index of the winning task, its result)
+
+    Raises:
+        The first task's exception if every task fails
+    """
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for index, task in enumerate(tasks):
+            if task in done and not task.cancelled() and task.exception() is None:
+                return index, task.result()
+    for task in tasks:
+        error = None if task.cancelled() else task.exception()
+        if error is not None:
+            raise error
+    raise asyncio.CancelledError()
+
+
+async def cancel_all(tasks: Sequence[asyncio.Future]) -> None:
+    """Cancel unfinished tasks and wait for them to finish"""
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Hedger:
+    """
+    Send a second, identical call when the first is slower than usual
+
+    The hedge is sent once the first call has been running for the
+    `quantile` latency of recent calls (`initial_delay` until `min_samples`
+    latencies are known, never less than `min_delay`), if the budget
+    allows. Whichever call succeeds first wins and the other is cancelled.
+    """
+
+    def __init__(
+        self,
+        budget: CallBudget,
+        quantile: float = 0.9,
+        min_delay: float = 1.0,
+        initial_delay: float = 5.0,
+        min_samples: int = 20,
+        window: int = 500
+    ):
+        self.budget = budget
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker(window)
+        self.counts: Dict[str, int] = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0}
+
+    def delay(self) -> float:
+        """Seconds to wait for the first call before hedging"""
+        observed = self.latencies.quantile(self.quantile)
+        if observed is None or len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, observed)
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run a call, hedged if it is slow
+
+        Args:
+            call: Starts one attempt; called again for the hedge
+
+        Returns:
+            Result of the first attempt to succeed
+
+        Raises:
+            The first attempt's exception if both fail
+        """
+        self.counts["calls"] += 1
+        self.budget.deposit()
+        start = time.perf_counter()
+        tasks: List["asyncio.Future[T]"] = [asyncio.ensure_future(call())]
+        try:
+            delay = self.delay()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if self.budget.try_spend():
+                    self.counts["hedged"] += 1
+                    logger.info(f"Hedging slow call after {delay:.2f}s")
+                    tasks.append(asyncio.ensure_future(call()))
+                else:
+                    self.counts["budget_denied"] += 1
+
+            index, result = await first_success(tasks)
+            # The first call's time so far: exact when it wins, a lower bound
+            # when the hedge does, which keeps the quantile from drifting down
+            self.latencies.record(time.perf_counter() - start)
+            if index:
+                self.counts["hedge_wins"] += 1
+            return result
+        finally:
+            await cancel_all(tasks)
+
+    def stats(self) -> Dict[str, Any]:
+        hedged = self.counts["hedged"]
+        p90 = self.latencies.quantile(0.9)
+        return {
+            **self.counts,
+            "win_rate": round(self.counts["hedge_wins"] / hedged, 3) if hedged else None,
+            "delay_ms": round(self.delay() * 1000, 1),
+            "p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            "budget_balance": round(self.budget.balance, 2),
+        }
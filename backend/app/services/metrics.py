@@ -0,0 +1,160 @@
+"""Prometheus metrics: stage latencies, HTTP, connection pool, caches and LLM tokens"""
+
+import asyncio
+import logging
+import time
+from typing import Iterator, Optional
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+from app.services.result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from sub-millisecond validation up to LLM calls near the deadline
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+STAGE_DURATION = Histogram(
+    "geosql_stage_duration_seconds",
+    "Time spent in each /query pipeline stage (exclusive of nested stages)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "geosql_http_request_duration_seconds",
+    "HTTP request latency until the response starts",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "geosql_http_requests_in_flight",
+    "HTTP requests being handled",
+)
+DB_POOL_WAIT = Histogram(
+    "geosql_db_pool_wait_seconds",
+    "Time to obtain a pooled database connection",
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_LOOP_LAG = Gauge(
+    "geosql_event_loop_lag_seconds",
+    "How late the event loop last ran a timer scheduled by the lag monitor",
+)
+LLM_TOKENS = Counter(
+    "geosql_llm_tokens_total",
+    "LLM tokens consumed, by model and kind (prompt, cached_prompt, completion)",
+    ["model", "kind"],
+)
+SLOW_QUERIES = Counter(
+    "geosql_slow_queries_total",
+    "Query executions over SLOW_QUERY_THRESHOLD",
+)
+PLAN_FLIPS = Counter(
+    "geosql_plan_flips_total",
+    "Changes of plan shape for the same SQL",
+)
+
+
+class ServiceCollector(Collector):
+    """
+    Gauges read from the services at scrape time
+
+    Connection pool usage, queue depths and cache counters are already kept
+    by the services, so they are collected from them instead of being
+    updated on every change.
+    """
+
+    def describe(self) -> Iterator[Metric]:
+        # Names only: registering must not build the services
+        return iter(self._families())
+
+    def collect(self) -> Iterator[Metric]:
+        from app.services.query_service import get_query_service
+
+        checked_out, overflow, connections, queue, hits, misses, entries = self._families()
+        service = get_query_service()
+
+        pool = service.db_service.async_engine.pool
+        checked_out.add_metric([], pool.checkedout())
+        # QueuePool counts overflow from -pool_size
+        overflow.add_metric([], max(0, pool.overflow()))
+        connections.add_metric([], pool.checkedin() + pool.checkedout())
+
+        queue.add_metric(["db_pool"], service.db_service.pool_waiting)
+        queue.add_metric(["slow_lane"], service.planner.slow_lane_waiting)
+
+        caches = {
+            "sql_cache": service.sql_cache,
+            "sql_negative_cache": service.sql_negative_cache,
+            "result_cache": service.result_cache,
+            "tile_cache": service.tile_cache,
+        }
+        for name, cache in caches.items():
+            if cache is None:
+                continue
+            stats = cache.read_stats() if isinstance(cache, ResultCache) else cache.stats()
+            hits.add_metric([name], stats["hits"] + stats.get("stale_hits", 0))
+            misses.add_metric([name], stats["misses"])
+            entries.add_metric([name], stats["size"] if "size" in stats else stats["entries"])
+
+        return iter((checked_out, overflow, connections, queue, hits, misses, entries))
+
+    @staticmethod
+    def _families():
+        return (
+            GaugeMetricFamily(
+                "geosql_db_pool_checked_out", "Pooled database connections in use"
+            ),
+            GaugeMetricFamily(
+                "geosql_db_pool_overflow", "Connections open beyond DB_POOL_SIZE"
+            ),
+            GaugeMetricFamily(
+                "geosql_db_pool_connections", "Connections open in the pool"
+            ),
+            GaugeMetricFamily(
+                "geosql_queue_depth",
+                "Work waiting for a resource (db_pool: a connection; slow_lane: a slot)",
+                labels=["queue"],
+            ),
+            CounterMetricFamily(
+                "geosql_cache_hits", "Cache lookups answered from the cache", labels=["cache"]
+            ),
+            CounterMetricFamily(
+                "geosql_cache_misses", "Cache lookups that missed", labels=["cache"]
+            ),
+            GaugeMetricFamily("geosql_cache_entries", "Entries held by a cache", labels=["cache"]),
+        )
+
+
+REGISTRY.register(ServiceCollector())
+
+
+class EventLoopLagMonitor:
+    """Background task measuring how late the event loop runs a periodic timer"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            EVENT_LOOP_LAG.set(lag)
+            if lag > 1.0:
+                logger.warning(f"Event loop lagging by {lag:.2f}s")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
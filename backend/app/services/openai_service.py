@@ -1,151 +1,473 @@
 """OpenAI service for SQL generation"""
 
-from openai import OpenAI, OpenAIError
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import asyncio
+import hashlib
+import httpx
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAIError,
+    RateLimitError
+)
+from opentelemetry import trace
+from opentelemetry.trace import Span, StatusCode
+from tenacity import (
+    RetryCallState,
+    retry,
+    stop_after_attempt,
+    wait_random_exponential,
+    retry_if_exception_type,
+    retry_if_not_exception_type
+)
+from tenacity.stop import stop_base
 import logging
-from typing import Optional
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
 
 from app.config import get_settings
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.deadline import DeadlineExceeded, current_deadline, remaining_time
+from app.services.hedging import CallBudget, Hedger, LatencyTracker, cancel_all
+from app.services.metrics import LLM_TOKENS
+from app.services.prompts import Prompt, PromptBuilder, get_prompt_builder
+from app.services.schema_registry import get_schema_registry
+from app.services.tracing import tracer
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 
-# System prompt template
-SYSTEM_PROMPT = """You are a PostGIS SQL expert. Your task is to convert natural language questions into valid PostGIS SQL queries.
-
-Database Schema:
-1. Table: cafes
-   - id (integer, primary key)
-   - name (text)
-   - geom (geometry, SRID 4326 - Point)
-   - address (text)
-
-2. Table: parks
-   - id (integer, primary key)
-   - name (text)
-   - geom (geometry, SRID 4326 - Polygon)
-   - area (float, in square meters)
-
-3. Table: roads
-   - id (integer, primary key)
-   - name (text)
-   - geom (geometry, SRID 4326 - LineString)
-   - road_type (text)
-
-4. Table: plans (תכניות בניין עיר - Israeli Planning Data)
-   - id (integer, primary key)
-   - pl_number (text) - plan number / מספר תכנית
-   - pl_name (text) - plan name / שם תכנית
-   - pl_url (text) - link to planning website / קישור לאתר מידע תכנוני
-   - pl_area_dunam (float) - plan area in dunams / שטח בדונם
-   - quantity_delta_120 (float) - change in housing units / שינוי יחידות דיור
-   - station_desc (text) - status description / תיאור סטטוס
-   - internet_short_status (text) - current planning stage / שלב תכנוני
-   - pl_date_advertise (date) - newspaper publication date / תאריך פרסום בעיתונים
-   - pl_date_8 (date) - official publication date / תאריך פרסום ברשומות
-   - plan_county_name (text) - settlement name / שם יישוב
-   - pl_landuse_string (text) - land use designation / ייעוד קרקע
-   - geom (geometry, SRID 4326 - Polygon) - plan boundaries / גבולות התכנית
-
-Important PostGIS functions to use:
-- ST_DWithin(geom1, geom2, distance) - finds geometries within distance (in meters when using geography cast)
-- ST_Distance(geom1, geom2) - calculates distance between geometries
-- ST_Intersects(geom1, geom2) - checks if geometries intersect
-- ST_Contains(geom1, geom2) - checks if geom1 contains geom2
-- ST_Within(geom1, geom2) - checks if geom1 is within geom2
-- ST_Overlaps(geom1, geom2) - checks if geometries overlap
-- ST_Area(geom) - calculates area
-- ST_AsGeoJSON(geom) - converts geometry to GeoJSON
-- Geography cast: geom::geography for meter-based calculations
-
-Rules:
-1. ALWAYS use ST_AsGeoJSON() to return geometry columns
-2. For distance queries, use geography cast: geom::geography
-3. Return ONLY the SQL query, no explanations
-4. Use proper spatial indexes when possible
-5. Include necessary columns: id, name (or pl_name for plans), and geometry as geojson
-6. For plans table, also include relevant planning fields like status, land use, etc.
-7. Never use DROP, DELETE, UPDATE, INSERT, ALTER, CREATE, or TRUNCATE commands
-8. Always use SELECT queries only
-
-Example queries:
-- "Find cafes within 200m of the largest park" ->
-  SELECT c.id, c.name, ST_AsGeoJSON(c.geom) as geojson
-  FROM cafes c, parks p
-  WHERE p.area = (SELECT MAX(area) FROM parks)
-  AND ST_DWithin(c.geom::geography, p.geom::geography, 200);
-
-- "Show all parks larger than 5000 square meters" ->
-  SELECT id, name, area, ST_AsGeoJSON(geom) as geojson
-  FROM parks
-  WHERE area > 5000;
-
-- "Find planning areas that contain cafes" / "מצא תכניות שמכילות בתי קפה" ->
-  SELECT DISTINCT p.id, p.pl_name, p.station_desc, ST_AsGeoJSON(p.geom) as geojson
-  FROM plans p, cafes c
-  WHERE ST_Contains(p.geom, c.geom);
-
-Now, convert the user's question into a PostGIS SQL query."""
+# Time an attempt needs at least; no retry is attempted with less time left
+MIN_ATTEMPT_TIME = 2
+
+# Full-jitter exponential backoff: up to 0.5 s, 1 s, 2 s, ... capped at 8 s
+_backoff = wait_random_exponential(multiplier=0.5, max=8)
+
+
+class _StopAtDeadline(stop_base):
+    """Stop retrying when the request deadline leaves no room for another attempt"""
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        deadline = current_deadline.get()
+        return deadline is not None and deadline.remaining() <= MIN_ATTEMPT_TIME
+
+
+def _wait_within_deadline(retry_state) -> float:
+    """Jittered backoff, shortened so the next attempt still fits before the deadline"""
+    wait = _backoff(retry_state)
+    deadline = current_deadline.get()
+    if deadline is not None:
+        wait = min(wait, max(0.0, deadline.remaining() - MIN_ATTEMPT_TIME))
+    return wait
+
+
+def _trace_retry(retry_state) -> None:
+    """Record a retry of the LLM call on the generation span"""
+    span = trace.get_current_span()
+    span.set_attribute("llm.retries", retry_state.attempt_number)
+    span.add_event("retry", {
+        "attempt": retry_state.attempt_number,
+        "error": repr(retry_state.outcome.exception()),
+        "wait_seconds": retry_state.next_action.sleep,
+    })
+
+
+def _is_backend_failure(error: BaseException) -> bool:
+    """Errors showing the model backend is degraded (not a bad request or a cancellation)"""
+    return isinstance(
+        error, (APIConnectionError, RateLimitError, InternalServerError, TimeoutError)
+    )
+
+
+def cascade_models() -> List[str]:
+    """Models of the cascade, cheapest first (OPENAI_FAST_MODEL, then OPENAI_MODEL)"""
+    fast_model = settings.openai_fast_model
+    if fast_model and fast_model != settings.openai_model:
+        return [fast_model, settings.openai_model]
+    return [settings.openai_model]
+
+
+class ModelTier:
+    """A model of the cascade, with its own hedging, circuit breaker and statistics"""
+
+    def __init__(self, model: str, budget: CallBudget):
+        self.model = model
+        self.hedger = Hedger(
+            budget,
+            quantile=settings.llm_hedge_quantile,
+            min_delay=settings.llm_hedge_min_delay,
+            initial_delay=settings.llm_hedge_initial_delay,
+            min_samples=settings.llm_hedge_min_samples,
+            window=settings.llm_hedge_window
+        )
+        self.breaker = CircuitBreaker(
+            f"Model {model}",
+            settings.llm_breaker_failure_threshold,
+            settings.llm_breaker_reset_timeout,
+            is_failure=_is_backend_failure
+        )
+        # Latency of successful API calls
+        self.latencies = LatencyTracker(settings.llm_hedge_window)
+        self.counts: Dict[str, int] = {
+            "generations": 0, "api_calls": 0, "api_failures": 0, "escalations": 0
+        }
+        self.escalation_reasons: Dict[str, int] = {}
+
+    def record_escalation(self, reason: str) -> None:
+        """Count a generation passed on to the next tier ("error", "validation", ...)"""
+        self.counts["escalations"] += 1
+        self.escalation_reasons[reason] = self.escalation_reasons.get(reason, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        generations = self.counts["generations"]
+        p50, p90 = self.latencies.quantile(0.5), self.latencies.quantile(0.9)
+        return {
+            "model": self.model,
+            **self.counts,
+            "escalation_rate": (
+                round(self.counts["escalations"] / generations, 3) if generations else None
+            ),
+            "escalation_reasons": dict(self.escalation_reasons),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            "hedging": self.hedger.stats(),
+            "circuit": self.breaker.stats(),
+        }
 
 
 class OpenAIService:
     """Service for OpenAI API interactions with retry logic"""
 
     def __init__(self):
-        """Initialize OpenAI client"""
-        self.client = OpenAI(
-            api_key=settings.openai_api_key,
+        """Initialize async OpenAI client backed by a pooled, kept-alive HTTP connection"""
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+                keepalive_expiry=settings.openai_keepalive_expiry
+            ),
             timeout=settings.openai_timeout
         )
-        logger.info(f"OpenAI service initialized with model={settings.openai_model}")
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
+            timeout=settings.openai_timeout,
+            http_client=self.http_client
+        )
+        self._prompt_builder: Optional[PromptBuilder] = None
+        # Hedged and speculative calls of every tier share one extra-call budget
+        self.call_budget = CallBudget(settings.llm_extra_call_ratio, settings.llm_extra_call_burst)
+        self.tiers: List[ModelTier] = [
+            ModelTier(model, self.call_budget) for model in cascade_models()
+        ]
+        self.speculative_calls = 0
+        # Token usage and latency of completed LLM calls
+        self.usage: Dict[str, float] = {
+            "calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0,
+            "tables": 0, "seconds": 0.0, "max_seconds": 0.0,
+        }
+        logger.info(
+            f"OpenAI service initialized with models={', '.join(tier.model for tier in self.tiers)}"
+        )
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((OpenAIError, TimeoutError)),
-        reraise=True
-    )
-    def generate_sql(self, question: str) -> str:
+    @property
+    def prompt_builder(self) -> PromptBuilder:
+        """Prompt builder for the current schema registry"""
+        registry = get_schema_registry()
+        if self._prompt_builder is None or self._prompt_builder.registry is not registry:
+            self._prompt_builder = get_prompt_builder(registry)
+        return self._prompt_builder
+
+    @property
+    def prompt_version(self) -> str:
+        """
+        Identifies the prompt/model combination so cached generations are
+        invalidated whenever either changes (including the introspected schema)
+        """
+        models = "\n".join(cascade_models())
+        return hashlib.sha256(
+            f"{models}\n{self.prompt_builder.version}".encode("utf-8")
+        ).hexdigest()[:12]
+
+    @property
+    def strongest_tier(self) -> int:
+        """Index of the last (strongest) tier of the cascade"""
+        return len(self.tiers) - 1
+
+    async def generate_sql(self, question: str, tier: Optional[int] = None) -> str:
         """
         Generate SQL query from natural language question
 
+        The strongest tier (the default) is retried on API errors with
+        jittered exponential backoff, as long as the request deadline leaves
+        time for another attempt. Cheaper tiers are tried once: the caller
+        escalates to the next tier instead of retrying. A call still running
+        after the tier's usual (p90) latency is hedged with a second,
+        identical call, within the extra-call budget.
+
         Args:
             question: Natural language question
+            tier: Index of the model tier (the strongest by default)
 
         Returns:
             Generated SQL query
 
         Raises:
             OpenAIError: If API call fails after retries
+            CircuitOpenError: If the tier's circuit breaker is open
+            DeadlineExceeded: If the request deadline passes
+        """
+        index = self.strongest_tier if tier is None else tier
+        with tracer.start_as_current_span(
+            "llm.generate_sql",
+            attributes={"llm.model": self.tiers[index].model, "llm.tier": index}
+        ):
+            if index == self.strongest_tier:
+                return await self._generate_with_retries(question, self.tiers[index])
+            return await self._generate(question, self.tiers[index])
+
+    @retry(
+        stop=stop_after_attempt(3) | _StopAtDeadline(),
+        wait=_wait_within_deadline,
+        retry=(
+            retry_if_exception_type((OpenAIError, TimeoutError))
+            & retry_if_not_exception_type(DeadlineExceeded)
+        ),
+        before_sleep=_trace_retry,
+        reraise=True
+    )
+    async def _generate_with_retries(self, question: str, tier: ModelTier) -> str:
+        return await self._generate(question, tier)
+
+    async def _generate(self, question: str, tier: ModelTier) -> str:
+        """One (possibly hedged) generation with a tier's model"""
+        logger.info(f"Generating SQL with {tier.model} for question: {question[:100]}...")
+        prompt = self.prompt_builder.build(question)
+        tier.counts["generations"] += 1
+
+        try:
+            if settings.llm_hedge_enabled:
+                return await tier.hedger.run(lambda: self._complete(prompt, question, tier))
+            return await self._complete(prompt, question, tier)
+
+        except OpenAIError as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error in SQL generation: {e}")
+            raise
+
+    async def generate_candidates(self, question: str, count: int) -> AsyncGenerator[str, None]:
         """
-        logger.info(f"Generating SQL for question: {question[:100]}...")
+        Generate SQL candidates in parallel, yielding each as it arrives
+
+        The first candidate uses the configured temperature, the others
+        LLM_SPECULATIVE_TEMPERATURE so they can differ from it. Candidates
+        after the first need the extra-call budget; without it fewer are
+        generated. Closing the iterator cancels the calls still running.
+
+        Args:
+            question: Natural language question
+            count: Number of candidates to generate
+
+        Yields:
+            Generated SQL queries, fastest first
+
+        Raises:
+            OpenAIError: If every call fails
+        """
+        logger.info(f"Generating up to {count} SQL candidates for question: {question[:100]}...")
+        prompt = self.prompt_builder.build(question)
+        tier = self.tiers[self.strongest_tier]
+        tier.counts["generations"] += 1
+
+        self.call_budget.deposit()
+        tasks: List[asyncio.Future] = [
+            asyncio.ensure_future(self._complete(prompt, question, tier))
+        ]
+        for _ in range(count - 1):
+            if not self.call_budget.try_spend():
+                logger.info("Extra-call budget exhausted; generating fewer candidates")
+                break
+            self.speculative_calls += 1
+            tasks.append(asyncio.ensure_future(
+                self._complete(prompt, question, tier, settings.llm_speculative_temperature)
+            ))
 
         try:
-            response = self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": question}
-                ],
-                temperature=settings.openai_temperature,
-                max_tokens=settings.openai_max_tokens
-            )
+            errors = []
+            for future in asyncio.as_completed(tasks):
+                try:
+                    yield await future
+                except (OpenAIError, TimeoutError) as e:
+                    logger.warning(f"SQL candidate failed: {e}")
+                    errors.append(e)
+            if len(errors) == len(tasks):
+                raise errors[0]
+        finally:
+            await cancel_all(tasks)
+
+    async def _complete(
+        self, prompt: Prompt, question: str, tier: ModelTier, temperature: Optional[float] = None
+    ) -> str:
+        """Run one chat completion through the tier's circuit breaker and return its cleaned SQL"""
+        # Each call gets at most the time left on the request deadline
+        timeout = min(settings.openai_timeout, remaining_time(settings.openai_timeout))
+
+        if temperature is None:
+            temperature = settings.openai_temperature
+
+        with tracer.start_as_current_span(
+            "llm.completion", attributes={"llm.model": tier.model, "llm.temperature": temperature}
+        ) as span:
+            with tier.breaker.guard():
+                tier.counts["api_calls"] += 1
+                start = time.perf_counter()
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=tier.model,
+                        messages=[
+                            {"role": "system", "content": prompt.system},
+                            {"role": "user", "content": question}
+                        ],
+                        temperature=temperature,
+                        max_tokens=settings.openai_max_tokens,
+                        timeout=timeout
+                    )
+                except (OpenAIError, TimeoutError):
+                    tier.counts["api_failures"] += 1
+                    raise
+            elapsed = time.perf_counter() - start
+            tier.latencies.record(elapsed)
+            self._record_usage(prompt, response, elapsed, tier.model, span)
 
             sql_query = response.choices[0].message.content.strip()
             logger.info(f"SQL generated successfully: {len(sql_query)} characters")
 
             # Clean markdown formatting if present
-            sql_query = self._clean_sql(sql_query)
+            return self._clean_sql(sql_query)
 
-            return sql_query
+    async def stream_sql(self, question: str) -> AsyncGenerator[str, None]:
+        """
+        Generate SQL for a question, yielding the text as the LLM produces it
 
-        except OpenAIError as e:
-            logger.error(f"OpenAI API error: {e}")
-            raise
+        The raw output (markdown fences included) is yielded delta by delta,
+        so the caller can detect the end of the statement itself. Closing the
+        generator early closes the HTTP stream and stops the generation.
+        The strongest tier is used. Unlike generate_sql there are no retries:
+        text already yielded cannot be taken back.
+
+        Args:
+            question: Natural language question
+
+        Yields:
+            Text deltas of the completion
+
+        Raises:
+            OpenAIError: If the API call fails
+            CircuitOpenError: If the model's circuit breaker is open
+            DeadlineExceeded: If the request deadline passes
+        """
+        logger.info(f"Streaming SQL for question: {question[:100]}...")
+
+        timeout = min(settings.openai_timeout, remaining_time(settings.openai_timeout))
+        prompt = self.prompt_builder.build(question)
+        tier = self.tiers[self.strongest_tier]
+        tier.counts["generations"] += 1
+
+        # Not made current: the context cannot be held across the yields
+        span = tracer.start_span(
+            "llm.stream_completion",
+            attributes={"llm.model": tier.model, "llm.temperature": settings.openai_temperature}
+        )
+        start = time.perf_counter()
+        try:
+            with tier.breaker.guard():
+                tier.counts["api_calls"] += 1
+                stream = await self.client.chat.completions.create(
+                    model=tier.model,
+                    messages=[
+                        {"role": "system", "content": prompt.system},
+                        {"role": "user", "content": question}
+                    ],
+                    temperature=settings.openai_temperature,
+                    max_tokens=settings.openai_max_tokens,
+                    timeout=timeout,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+            # The final chunk carries the usage; it is never read when the
+            # caller stops at the end of the statement
+            last_chunk = None
+            try:
+                async for chunk in stream:
+                    last_chunk = chunk
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except OpenAIError as e:
+                logger.error(f"OpenAI API error while streaming: {e}")
+                raise
+            finally:
+                await stream.close()
+                self._record_usage(
+                    prompt, last_chunk, time.perf_counter() - start, tier.model, span
+                )
         except Exception as e:
-            logger.error(f"Unexpected error in SQL generation: {e}")
+            span.record_exception(e)
+            span.set_status(StatusCode.ERROR, str(e))
             raise
+        finally:
+            span.end()
+
+    def _record_usage(
+        self, prompt: Prompt, response: Any, elapsed: float, model: str,
+        span: Optional[Span] = None
+    ) -> None:
+        """Log and accumulate the token usage and latency of one LLM call on its span"""
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["cached_prompt_tokens"] += cached_tokens
+        self.usage["completion_tokens"] += completion_tokens
+        self.usage["tables"] += len(prompt.tables)
+        self.usage["seconds"] += elapsed
+        self.usage["max_seconds"] = max(self.usage["max_seconds"], elapsed)
+        # Cached prompt tokens are a subset of the prompt tokens
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model, "cached_prompt").inc(cached_tokens)
+        LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+        (span or trace.get_current_span()).set_attributes({
+            "llm.prompt_tokens": prompt_tokens,
+            "llm.cached_prompt_tokens": cached_tokens,
+            "llm.completion_tokens": completion_tokens,
+            "llm.prompt_tables": prompt.tables,
+        })
+        logger.info(
+            f"LLM call: {elapsed * 1000:.0f} ms, {prompt_tokens} prompt tokens "
+            f"({cached_tokens} cached), {completion_tokens} completion tokens, "
+            f"tables: {', '.join(prompt.tables)}, examples: {prompt.examples}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.usage["calls"]
+        return {
+            "calls": calls,
+            "prompt_tokens": self.usage["prompt_tokens"],
+            "cached_prompt_tokens": self.usage["cached_prompt_tokens"],
+            "completion_tokens": self.usage["completion_tokens"],
+            "mean_prompt_tokens": round(self.usage["prompt_tokens"] / calls, 1) if calls else 0.0,
+            "mean_tables": round(self.usage["tables"] / calls, 2) if calls else 0.0,
+            "mean_latency_ms": round(self.usage["seconds"] / calls * 1000, 1) if calls else 0.0,
+            "max_latency_ms": round(self.usage["max_seconds"] * 1000, 1),
+            "tiers": [tier.stats() for tier in self.tiers],
+            "speculative_calls": self.speculative_calls,
+        }
 
     @staticmethod
     def _clean_sql(sql: str) -> str:
@@ -160,6 +482,11 @@ class OpenAIService:
 
         return sql
 
+    async def close(self):
+        """Close the underlying HTTP connection pool"""
+        await self.client.close()
+        logger.info("OpenAI client closed")
+
 
 # Singleton instance
 _openai_service = None
@@ -0,0 +1,280 @@
+"""System prompts built from the schema registry, pruned to what a question needs"""
+
+import hashlib
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from app.config import get_settings
+from app.services.schema_registry import ColumnSchema, SchemaRegistry, TableSchema
+from app.services.sql_utils import referenced_tables
+
+settings = get_settings()
+
+
+# Instructions shared by every prompt. They come first and never change, so
+# providers that cache prompt prefixes can reuse them across all questions.
+STATIC_PROMPT = """You are a PostGIS SQL expert. Your task is to convert natural language questions into valid PostGIS SQL queries.
+
+Important PostGIS functions to use:
+- ST_DWithin(geom1, geom2, distance) - finds geometries within distance (in meters when using geography cast)
+- ST_Distance(geom1, geom2) - calculates distance between geometries
+- ST_Intersects(geom1, geom2) - checks if geometries intersect
+- ST_Contains(geom1, geom2) - checks if geom1 contains geom2
+- ST_Within(geom1, geom2) - checks if geom1 is within geom2
+- ST_Overlaps(geom1, geom2) - checks if geometries overlap
+- ST_Area(geom) - calculates area
+- ST_AsGeoJSON(geom) - converts geometry to GeoJSON
+- Geography cast: geom::geography for meter-based calculations
+
+Rules:
+1. ALWAYS use ST_AsGeoJSON() to return geometry columns
+2. For distance queries, use geography cast: geom::geography
+3. Return ONLY the SQL query, no explanations
+4. Use proper spatial indexes when possible
+5. Include necessary columns: id, the table's name column, and geometry as geojson
+6. Only use the tables and columns listed in the schema below
+7. Never use DROP, DELETE, UPDATE, INSERT, ALTER, CREATE, or TRUNCATE commands
+8. Always use SELECT queries only"""
+
+CLOSING_LINE = "Now, convert the user's question into a PostGIS SQL query."
+
+
+class Example(NamedTuple):
+    """A few-shot example"""
+
+    question: str
+    sql: str
+
+
+EXAMPLES: Tuple[Example, ...] = (
+    Example(
+        '"Find cafes within 200m of the largest park"',
+        "SELECT c.id, c.name, ST_AsGeoJSON(c.geom) as geojson\n"
+        "  FROM cafes c, parks p\n"
+        "  WHERE p.area = (SELECT MAX(area) FROM parks)\n"
+        "  AND ST_DWithin(c.geom::geography, p.geom::geography, 200);",
+    ),
+    Example(
+        '"Show all parks larger than 5000 square meters"',
+        "SELECT id, name, area, ST_AsGeoJSON(geom) as geojson\n"
+        "  FROM parks\n"
+        "  WHERE area > 5000;",
+    ),
+    Example(
+        '"Find planning areas that contain cafes" / "מצא תכניות שמכילות בתי קפה"',
+        "SELECT DISTINCT p.id, p.pl_name, p.station_desc, ST_AsGeoJSON(p.geom) as geojson\n"
+        "  FROM plans p, cafes c\n"
+        "  WHERE ST_Contains(p.geom, c.geom);",
+    ),
+    Example(
+        '"Find cafes within 50 meters of a primary road"',
+        "SELECT DISTINCT c.id, c.name, ST_AsGeoJSON(c.geom) as geojson\n"
+        "  FROM cafes c, roads r\n"
+        "  WHERE r.road_type = 'primary'\n"
+        "  AND ST_DWithin(c.geom::geography, r.geom::geography, 50);",
+    ),
+)
+
+
+class Prompt(NamedTuple):
+    """A system prompt and what went into it"""
+
+    system: str
+    tables: Tuple[str, ...]
+    examples: int
+
+
+_WORD = re.compile(r"\w+")
+
+# Words that say nothing about which table or column a question is about
+_STOP_WORDS = {
+    "and", "the", "with", "for", "from", "all", "any", "that", "which", "what", "where",
+    "show", "find", "list", "how", "many", "most", "number", "count", "use", "current",
+    "change", "description", "name", "near", "within", "meter", "square",
+}
+
+
+def _terms(text: str) -> Set[str]:
+    """Lower-cased words of a text, with English plurals reduced to the singular"""
+    terms = set()
+    for word in _WORD.findall(text.lower().replace("_", " ")):
+        if len(word) < (3 if word.isascii() else 2) or word.isdigit() or word in _STOP_WORDS:
+            continue
+        if word.isascii() and len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return terms
+
+
+def _matches(terms: Set[str], question_terms: Set[str]) -> bool:
+    """
+    Whether any term occurs in the question
+
+    Non-Latin terms of three or more letters also match inside a word, since
+    Hebrew attaches prefixes (ה, ב, ל, ש, ...) and plural suffixes to it.
+    """
+    for term in terms:
+        if term in question_terms:
+            return True
+        if not term.isascii() and len(term) >= 3 and any(term in word for word in question_terms):
+            return True
+    return False
+
+
+class PromptBuilder:
+    """
+    Build the system prompt for a question from a schema registry
+
+    A cheap lexical relevance step picks the tables a question mentions, by
+    name or keyword, or through a column term only that table has (e.g.
+    "housing" -> plans.quantity_delta_120). Wide tables are cut down to
+    their core columns plus the columns the question mentions, and only
+    examples whose tables are all in the prompt are included. A question
+    that matches no table gets the whole schema.
+
+    The prompt is the static instructions, then the selected tables in
+    registry order, then the selected examples in a fixed order, so the
+    same table selection always produces the same bytes.
+    """
+
+    def __init__(
+        self,
+        registry: SchemaRegistry,
+        examples: Sequence[Example] = EXAMPLES,
+        prune: bool = True,
+        max_examples: int = 3,
+        full_table_columns: int = 8
+    ):
+        self.registry = registry
+        self.prune = prune
+        self.max_examples = max_examples
+        self.full_table_columns = full_table_columns
+
+        self._table_terms: Dict[str, Set[str]] = {}
+        self._column_terms: Dict[str, Dict[str, Set[str]]] = {}
+        for table in registry.tables.values():
+            self._table_terms[table.name] = _terms(table.name) | {
+                term for keyword in table.keywords for term in _terms(keyword)
+            }
+            # Words naming the table itself ("plan number") do not single out a column
+            self._column_terms[table.name] = {
+                column.name: (
+                    _terms(f"{column.name} {column.description}") - self._table_terms[table.name]
+                )
+                for column in table.columns
+            }
+
+        # Column terms that identify one table (not "id", "name", "area", ...)
+        seen: Dict[str, int] = {}
+        for columns in self._column_terms.values():
+            for term in set().union(*columns.values()) if columns else set():
+                seen[term] = seen.get(term, 0) + 1
+        self._distinctive_terms = {
+            name: {term for terms in columns.values() for term in terms if seen[term] == 1}
+            for name, columns in self._column_terms.items()
+        }
+
+        self.examples: List[Tuple[Example, Set[str], Set[str]]] = [
+            (example, set(referenced_tables(example.sql, registry.names)), _terms(example.question))
+            for example in examples
+        ]
+
+        full = self.build("", prune=False)
+        # Identifies the prompt text so cached generations are invalidated when
+        # the registry, examples or pruning change
+        self.version = hashlib.sha256(
+            f"{full.system}\n{prune}:{max_examples}:{full_table_columns}".encode("utf-8")
+        ).hexdigest()[:12]
+
+    def relevant_tables(self, question: str) -> List[str]:
+        """Tables the question needs, in registry order (all of them if none match)"""
+        question_terms = _terms(question)
+        selected = [
+            name for name in self.registry.names
+            if _matches(self._table_terms[name], question_terms)
+            or _matches(self._distinctive_terms[name], question_terms)
+        ]
+        return selected or self.registry.names
+
+    def build(self, question: str, prune: Optional[bool] = None) -> Prompt:
+        """
+        Build the system prompt for a question
+
+        Args:
+            question: Natural language question
+            prune: Override the builder's pruning setting
+
+        Returns:
+            Prompt with the system message and the tables it describes
+        """
+        prune = self.prune if prune is None else prune
+        question_terms = _terms(question)
+        tables = self.relevant_tables(question) if prune else self.registry.names
+
+        schema = []
+        for index, name in enumerate(tables, 1):
+            table = self.registry.tables[name]
+            columns = self._columns(table, question_terms) if prune else table.columns
+            schema.append(_render_table(index, table, columns))
+
+        examples = self._examples(set(tables), question_terms) if prune else [
+            example for example, _, _ in self.examples
+        ]
+
+        parts = [STATIC_PROMPT, "Database Schema:\n" + "\n\n".join(schema)]
+        if examples:
+            parts.append("Example queries:\n" + "\n\n".join(
+                f"- {example.question} ->\n  {example.sql}" for example in examples
+            ))
+        parts.append(CLOSING_LINE)
+        return Prompt("\n\n".join(parts), tuple(tables), len(examples))
+
+    def _columns(self, table: TableSchema, question_terms: Set[str]) -> List[ColumnSchema]:
+        """All columns of narrow tables; core and mentioned columns of wide ones"""
+        if len(table.columns) <= self.full_table_columns:
+            return list(table.columns)
+        core = set(table.core_columns) or {
+            column.name for column in table.columns
+            if column.name == "id" or "name" in column.name
+            or column.data_type.startswith("geometry")
+        }
+        column_terms = self._column_terms[table.name]
+        return [
+            column for column in table.columns
+            if column.name in core or _matches(column_terms[column.name], question_terms)
+        ]
+
+    def _examples(self, tables: Set[str], question_terms: Set[str]) -> List[Example]:
+        """Examples over the selected tables, most similar first, kept in a fixed order"""
+        candidates = [
+            (-len(example_tables), -len(terms & question_terms), index)
+            for index, (_, example_tables, terms) in enumerate(self.examples)
+            if example_tables and example_tables <= tables
+        ]
+        chosen = sorted(index for *_, index in sorted(candidates)[:self.max_examples])
+        return [self.examples[index][0] for index in chosen]
+
+
+def _render_table(index: int, table: TableSchema, columns: Sequence[ColumnSchema]) -> str:
+    header = f"{index}. Table: {table.name}"
+    if table.description:
+        header += f" ({table.description})"
+    lines = [header]
+    for column in columns:
+        line = f"   - {column.name} ({column.data_type})"
+        if column.description:
+            line += f" - {column.description}"
+        lines.append(line)
+    if table.notes:
+        lines.append(f"   Note: {table.notes}")
+    return "\n".join(lines)
+
+
+def get_prompt_builder(registry: SchemaRegistry) -> PromptBuilder:
+    """Prompt builder for a registry with the configured pruning settings"""
+    return PromptBuilder(
+        registry,
+        prune=settings.prompt_pruning_enabled,
+        max_examples=settings.prompt_max_examples,
+        full_table_columns=settings.prompt_full_table_columns
+    )
@@ -0,0 +1,59 @@
+"""Append-only JSONL log of the SQL each request executes"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class QueryLog:
+    """
+    Record executed SQL, one JSON object per line
+
+    Each entry is appended with a single write on an O_APPEND file, so
+    several workers can share one log. The log is mined offline by
+    tools/index_advisor.py.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self.records = 0
+        logger.info(f"Query log: {path}")
+
+    def record(self, question: str, sql: str, rewrites: Sequence[str] = ()) -> None:
+        """Append one executed query"""
+        entry = {"ts": round(time.time(), 3), "question": question, "sql": sql}
+        if rewrites:
+            entry["rewrites"] = list(rewrites)
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with self._lock:
+                os.write(self._fd, line)
+                self.records += 1
+        except OSError as e:
+            logger.warning(f"Could not write query log entry: {e}")
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def read_query_log(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of a query log, skipping lines that are not valid entries"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed query log line {line_number}")
+                continue
+            if isinstance(entry, dict) and entry.get("sql"):
+                yield entry
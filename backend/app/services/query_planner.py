@@ -0,0 +1,178 @@
+"""Pre-execution cost guard and execution strategy from EXPLAIN estimates"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, NamedTuple
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Query classes, by estimated planner cost
+LIGHT = "light"
+MEDIUM = "medium"
+HEAVY = "heavy"
+
+# Execution lanes: heavy queries share a small number of slow-lane slots
+FAST_LANE = "fast"
+SLOW_LANE = "slow"
+
+# Fetch strategies: one round trip, or batches from a server-side cursor
+BUFFERED = "buffered"
+STREAMING = "streaming"
+
+
+class QueryTooExpensive(ValueError):
+    """The planner's cost estimate for a query is above the configured limit"""
+
+
+class PlanEstimate(NamedTuple):
+    """What the planner expects a query to cost and return"""
+
+    node_type: str
+    total_cost: float
+    rows: int
+    width: int
+    query_class: str
+    lane: str
+    strategy: str
+
+    @property
+    def estimated_bytes(self) -> int:
+        return self.rows * self.width
+
+
+def estimate_plan(plan: Dict[str, Any], row_limit: Optional[int] = None) -> PlanEstimate:
+    """
+    Classify a query from its top plan node (EXPLAIN FORMAT JSON)
+
+    With a row limit, cost and rows are scaled the way PostgreSQL costs a
+    Limit node (startup cost plus the fraction of the run needed for the
+    first `row_limit` rows), so one EXPLAIN of the unbounded query serves
+    both the cost guard and the total row estimate.
+
+    Args:
+        plan: Top plan node
+        row_limit: Rows the query will actually be allowed to return
+
+    Returns:
+        PlanEstimate with the query class, lane and fetch strategy
+    """
+    startup_cost = float(plan.get("Startup Cost", 0.0))
+    total_cost = float(plan.get("Total Cost", 0.0))
+    rows = int(plan.get("Plan Rows", 0))
+    width = int(plan.get("Plan Width", 0))
+
+    if row_limit is not None and rows > row_limit:
+        total_cost = startup_cost + (total_cost - startup_cost) * row_limit / rows
+
+    if total_cost >= settings.slow_lane_cost:
+        query_class = HEAVY
+    elif total_cost >= settings.light_query_cost:
+        query_class = MEDIUM
+    else:
+        query_class = LIGHT
+
+    # Results expected to overrun the row budget, or too large to hold twice
+    # (driver buffer + rows), are fetched in batches so fetching can stop early
+    fits = row_limit is None or rows <= row_limit
+    strategy = BUFFERED if fits and rows * width <= settings.buffered_max_bytes else STREAMING
+
+    return PlanEstimate(
+        node_type=plan.get("Node Type", ""),
+        total_cost=round(total_cost, 2),
+        rows=rows,
+        width=width,
+        query_class=query_class,
+        lane=SLOW_LANE if query_class == HEAVY else FAST_LANE,
+        strategy=strategy
+    )
+
+
+# Transaction-local settings (SET LOCAL) for the query being executed
+current_tuning: ContextVar[Dict[str, str]] = ContextVar("current_tuning", default={})
+
+
+@contextmanager
+def session_tuning(estimate: Optional[PlanEstimate]):
+    """Apply the configured session settings for an estimate's query class"""
+    tuning = settings.query_class_tuning.get(estimate.query_class, {}) if estimate else {}
+    token = current_tuning.set(dict(tuning))
+    try:
+        yield
+    finally:
+        current_tuning.reset(token)
+
+
+class QueryPlanner:
+    """Cost guard and execution lanes for estimated queries"""
+
+    def __init__(self, slow_lane_concurrency: int):
+        self.slow_lane = asyncio.Semaphore(slow_lane_concurrency)
+        self.slow_lane_waiting = 0
+        self.counts: Dict[str, int] = {
+            FAST_LANE: 0, SLOW_LANE: 0, "rejected": 0, "unplanned": 0
+        }
+        self.classes: Dict[str, int] = {LIGHT: 0, MEDIUM: 0, HEAVY: 0}
+
+    def check(self, estimate: PlanEstimate) -> None:
+        """
+        Reject queries estimated to cost more than MAX_QUERY_COST
+
+        Raises:
+            QueryTooExpensive: If the estimate is over the limit
+        """
+        if estimate.total_cost > settings.max_query_cost:
+            self.counts["rejected"] += 1
+            logger.warning(
+                f"Rejecting query: estimated cost {estimate.total_cost:g} "
+                f"({estimate.node_type}, ~{estimate.rows} rows)"
+            )
+            raise QueryTooExpensive(
+                f"Query is too expensive to run (estimated cost {estimate.total_cost:g} "
+                f"exceeds {settings.max_query_cost:g}); try narrowing the question"
+            )
+
+    @asynccontextmanager
+    async def lane(self, estimate: Optional[PlanEstimate]):
+        """
+        Run a query in the lane its estimate calls for
+
+        Heavy queries wait for one of SLOW_LANE_CONCURRENCY slots so a few
+        expensive queries cannot take every pooled connection and worker.
+        Unplanned queries (EXPLAIN failed or the guard is off) run directly.
+
+        Raises:
+            QueryTooExpensive: If the estimate is over the limit
+        """
+        if estimate is None:
+            self.counts["unplanned"] += 1
+            yield
+            return
+
+        self.check(estimate)
+        self.counts[estimate.lane] += 1
+        self.classes[estimate.query_class] += 1
+        if estimate.lane != SLOW_LANE:
+            yield
+            return
+
+        self.slow_lane_waiting += 1
+        try:
+            await self.slow_lane.acquire()
+        finally:
+            self.slow_lane_waiting -= 1
+        try:
+            yield
+        finally:
+            self.slow_lane.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "slow_lane_waiting": self.slow_lane_waiting,
+            "classes": dict(self.classes),
+        }
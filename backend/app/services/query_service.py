@@ -1,32 +1,649 @@
 """Query service orchestrating SQL generation and execution"""
 
+import asyncio
 import logging
 import json
 import time
-from typing import Dict, Any, List
+from contextlib import AsyncExitStack, nullcontext
+from typing import (
+    Dict, Any, List, NamedTuple, Optional, Tuple, AsyncGenerator, AsyncIterator, Awaitable,
+    Callable, TypeVar
+)
 
-from app.services.database import get_db_service
+from openai import OpenAIError
+from opentelemetry import trace
+from sqlalchemy import exc
+
+from app.config import get_settings
+from app.services.cache import TTLCache, normalize_question
+from app.services.circuit_breaker import CircuitOpenError
+from app.services import exporters, formatters
+from app.services.database import RenderedResult, ResultSet, get_db_service
+from app.services.deadline import Deadline, DeadlineExceeded, run_with_deadline
+from app.services.hedging import cancel_all
+from app.services.result_cache import ResultCache
+from app.services.handles import encode_handle, decode_handle
+from app.services.query_log import QueryLog
+from app.services.query_planner import (
+    BUFFERED,
+    PlanEstimate,
+    QueryPlanner,
+    estimate_plan,
+    session_tuning
+)
+from app.services.schema_registry import set_schema_registry
+from app.services.singleflight import SingleFlight
+from app.services.slow_queries import current_question
+from app.services.stages import stage
+from app.services.tracing import tracer
+from app.services.sql_rewriter import rewrite_sql
+from app.services.sql_utils import (
+    apply_row_limit,
+    complete_statement,
+    detail_for_resolution,
+    fingerprint_sql,
+    geometry_detail_sql,
+    keyset_page_sql,
+    wkb_export_sql,
+    zoom_resolution
+)
 from app.services.openai_service import get_openai_service
-from app.models.schemas import QueryRequest, QueryResponse
+from app.models.schemas import BatchQueryRequest, QueryRequest, QueryResponse
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+T = TypeVar("T")
+
+# Column used for keyset pagination
+PAGE_KEY_COLUMN = "id"
+
+# Seconds between attempts to start the table version listener
+VERSION_SYNC_RETRY_INTERVAL = 30
+
+
+class BatchOutcome(NamedTuple):
+    """Outcome of one distinct question of a batch: its response or the error it raised"""
+    question: str
+    indices: List[int]
+    response: Optional[QueryResponse]
+    error: Optional[Exception]
 
 
 class QueryService:
     """Service for handling end-to-end query processing"""
 
-    def __init__(self):
+    def __init__(self) -> None:
         """Initialize query service with database and OpenAI services"""
         self.db_service = get_db_service()
         self.openai_service = get_openai_service()
+
+        # Question -> SQL cache in front of the LLM, plus a short-lived negative
+        # cache for generations that failed validation
+        self.sql_cache = TTLCache(
+            settings.sql_cache_max_size, settings.sql_cache_ttl, name="sql_cache"
+        )
+        self.sql_negative_cache = TTLCache(
+            settings.sql_cache_max_size, settings.sql_cache_negative_ttl, name="sql_negative_cache"
+        )
+        if settings.sql_cache_enabled and settings.sql_cache_path:
+            self.sql_cache.load(settings.sql_cache_path)
+
+        # Result cache shared across workers, invalidated by table versions
+        self.result_cache: Optional[ResultCache] = None
+        if settings.result_cache_enabled:
+            self.result_cache = ResultCache(
+                path=settings.result_cache_path,
+                ttl=settings.result_cache_ttl,
+                stale_ttl=settings.result_cache_stale_ttl,
+                swr_min_hits=settings.result_cache_swr_min_hits,
+                max_entries=settings.result_cache_max_entries,
+                max_bytes=settings.result_cache_max_bytes,
+                max_entry_bytes=settings.result_cache_max_entry_bytes,
+                record_types=(ResultSet, RenderedResult)
+            )
+
+        # Rendered vector tiles, invalidated by the same table versions
+        self.tile_cache: Optional[ResultCache] = None
+        if settings.tile_cache_enabled:
+            self.tile_cache = ResultCache(
+                path=settings.tile_cache_path,
+                ttl=settings.tile_cache_ttl,
+                stale_ttl=0,
+                swr_min_hits=1,
+                max_entries=settings.tile_cache_max_entries,
+                max_bytes=settings.tile_cache_max_bytes,
+                max_entry_bytes=settings.tile_cache_max_entry_bytes
+            )
+        self._version_listener = None
+        self._version_sync_task: Optional[asyncio.Task] = None
+
+        # Coalesce concurrent identical questions onto one generation/execution
+        self.generation_flight = SingleFlight("generation")
+        self.execution_flight = SingleFlight("execution")
+
+        # Executed SQL for offline workload analysis (tools/index_advisor.py)
+        self.query_log: Optional[QueryLog] = None
+        if settings.query_log_path:
+            self.query_log = QueryLog(settings.query_log_path)
+
+        # Cost guard and slow lane driven by EXPLAIN estimates
+        self.planner = QueryPlanner(settings.slow_lane_concurrency)
+
+        # Speculative generation: candidates checked, requests where a later
+        # candidate was used because the first one failed, and rejections
+        self.speculation_stats: Dict[str, int] = {
+            "requests": 0, "candidates": 0, "rescued": 0, "explain": 0, "too_expensive": 0
+        }
+
+        # Questions whose cached SQL came from a cheaper model of the cascade,
+        # regenerated with the strongest model if that SQL fails to execute
+        self.cheap_generations = TTLCache(
+            settings.sql_cache_max_size, settings.sql_cache_ttl, name="cheap_generations"
+        )
+
+        # Index-aware SQL rewrites applied, by name
+        self.rewrite_stats: Dict[str, int] = {}
+
+        # Columnar export counters
+        self.export_stats: Dict[str, Any] = {"requests": 0, "bytes": 0}
+
+        # Requests cancelled because their deadline passed or the client left
+        self.cancellations: Dict[str, int] = {"deadline": 0, "disconnect": 0}
+
+        # Progress event stream counters: time to validated SQL and to the
+        # first rows (seconds), and generations cut off at the end of the statement
+        self.progress_stats: Dict[str, Any] = {
+            "requests": 0, "sql_seconds": 0.0, "first_rows_seconds": 0.0,
+            "first_rows": 0, "early_stops": 0,
+        }
+
+        # Batch counters: questions received, repeats answered once, and
+        # distinct questions that failed
+        self.batch_stats: Dict[str, int] = {
+            "requests": 0, "questions": 0, "duplicates": 0, "errors": 0
+        }
+
+        # Streaming response counters (time-to-first-byte in seconds)
+        self.stream_stats: Dict[str, Any] = {
+            "requests": 0, "rows": 0, "ttfb_total": 0.0, "ttfb_last": None
+        }
+
         logger.info("Query service initialized")
 
-    async def process_query(self, request: QueryRequest) -> QueryResponse:
+    @property
+    def _versioned_caches(self) -> List[ResultCache]:
+        """Caches invalidated by table versions"""
+        return [cache for cache in (self.result_cache, self.tile_cache) if cache is not None]
+
+    async def start(self) -> None:
+        """Load the schema registry, sync table versions from PostgreSQL and listen for changes"""
+        if settings.schema_introspection_enabled:
+            try:
+                set_schema_registry(await asyncio.to_thread(self.db_service.introspect_schema))
+            except Exception as e:
+                logger.warning(f"Schema introspection failed, using the built-in schema: {e}")
+
+        if not self._versioned_caches:
+            return
+
+        if not await self._sync_table_versions():
+            # Start without the database; keep trying to listen in the background
+            self._version_sync_task = asyncio.get_running_loop().create_task(
+                self._retry_version_sync()
+            )
+
+    async def _sync_table_versions(self) -> bool:
+        """
+        LISTEN for table changes, then load the current table versions
+
+        Returns:
+            False if the listener could not be started
+        """
+        try:
+            self._version_listener = await self.db_service.listen(
+                settings.table_version_channel, self._on_table_changed
+            )
+        except Exception as e:
+            logger.warning(f"Table version listener unavailable: {e}")
+            return False
+
+        # Read after listening, so no change falls between the two
+        versions = await self.db_service.get_table_versions()
+        if versions:
+            for cache in self._versioned_caches:
+                await cache.set_table_versions(versions)
+        return True
+
+    async def _retry_version_sync(self) -> None:
+        """Retry starting the table version listener until it succeeds"""
+        while True:
+            await asyncio.sleep(VERSION_SYNC_RETRY_INTERVAL)
+            if await self._sync_table_versions():
+                logger.info("Table version listener started")
+                return
+
+    def _on_table_changed(self, payload: str) -> None:
+        """Handle a 'table:version' notification from the version trigger"""
+        table, _, version = payload.partition(":")
+        logger.info(f"Table changed: {table} (version {version})")
+        for cache in self._versioned_caches:
+            if version.isdigit():
+                update = cache.set_table_versions({table: int(version)})
+            else:
+                update = cache.bump_tables(table)
+            asyncio.get_running_loop().create_task(update)
+
+    def _sql_cache_key(self, question: str) -> str:
+        """Cache key combining the prompt/model version and the normalized question"""
+        return f"{self.openai_service.prompt_version}:{normalize_question(question)}"
+
+    async def _generate_validated_sql(self, question: str, escalate: bool = False) -> str:
+        """
+        Return validated SQL for a question, consulting the SQL caches first
+
+        Concurrent identical (normalized) questions share one LLM generation.
+
+        Args:
+            question: Natural language question
+            escalate: Skip the caches and generate with the strongest model,
+                after SQL from a cheaper model failed to execute
+
+        Raises:
+            ValueError: If the generated SQL fails validation
+        """
+        cache_key = self._sql_cache_key(question)
+        span = trace.get_current_span()
+
+        if settings.sql_cache_enabled and not escalate:
+            cached_sql: Optional[str] = self.sql_cache.get(cache_key)
+            if cached_sql is not None:
+                logger.info("SQL cache hit")
+                span.set_attribute("geosql.sql_cache", "hit")
+                return cached_sql
+
+            cached_error = self.sql_negative_cache.get(cache_key)
+            if cached_error is not None:
+                logger.info("SQL negative cache hit")
+                span.set_attribute("geosql.sql_cache", "negative_hit")
+                raise ValueError(cached_error)
+            span.set_attribute("geosql.sql_cache", "miss")
+
+        return await self.generation_flight.do(
+            f"{cache_key}:escalated" if escalate else cache_key,
+            lambda: self._generate_and_validate(question, cache_key, escalate)
+        )
+
+    async def _generate_and_validate(
+        self, question: str, cache_key: str, escalate: bool = False
+    ) -> str:
+        """Call the LLM, validate its SQL and record the outcome in the SQL caches"""
+        sql_query, tier = await self._generate_cascaded(
+            question, self.openai_service.strongest_tier if escalate else 0
+        )
+        sql_query = self._accept_generated(sql_query, cache_key)
+        if tier < self.openai_service.strongest_tier:
+            self.cheap_generations.set(cache_key, tier)
+        else:
+            self.cheap_generations.delete(cache_key)
+        return sql_query
+
+    async def _generate_cascaded(self, question: str, first_tier: int = 0) -> Tuple[str, int]:
+        """
+        Generate SQL with the cheapest model tier that produces usable SQL
+
+        Each cheaper tier is tried once; its SQL is used if it passes
+        validation and EXPLAIN (within MAX_QUERY_COST). Otherwise, or if
+        the call fails or the tier's circuit is open, the next tier is
+        tried. The strongest tier's SQL is returned as is, for the caller to
+        validate.
+
+        Returns:
+            Tuple of (SQL, index of the tier that generated it)
+        """
+        openai_service = self.openai_service
+        for index in range(first_tier, openai_service.strongest_tier):
+            tier = openai_service.tiers[index]
+            if not tier.breaker.available:
+                tier.record_escalation("circuit_open")
+                continue
+            try:
+                sql_query = await openai_service.generate_sql(question, tier=index)
+            except (OpenAIError, TimeoutError, CircuitOpenError) as e:
+                logger.warning(f"{tier.model} failed, escalating: {e}")
+                tier.record_escalation("error")
+                continue
+
+            try:
+                self._validate_sql(sql_query)
+            except ValueError:
+                tier.record_escalation("validation")
+                continue
+            rejection = await self._plan_rejection(sql_query)
+            if rejection is not None:
+                tier.record_escalation(rejection)
+                continue
+            return sql_query, index
+
+        if settings.llm_speculative_candidates > 1:
+            sql_query = await self._generate_speculatively(question)
+        else:
+            sql_query = await openai_service.generate_sql(question)
+        return sql_query, openai_service.strongest_tier
+
+    async def _generate_speculatively(self, question: str) -> str:
+        """
+        Generate several candidates in parallel and take the first usable one
+
+        Candidates are checked as they arrive: the first that passes
+        validation and EXPLAIN (within MAX_QUERY_COST) is returned and the
+        remaining calls are cancelled. If none passes EXPLAIN, the first
+        valid candidate is returned so execution reports the error.
+
+        Raises:
+            ValueError: If no candidate passes validation
+        """
+        self.speculation_stats["requests"] += 1
+        fallback: Optional[str] = None
+        error: Optional[ValueError] = None
+        seen = set()
+        position = -1
+        candidates = self.openai_service.generate_candidates(
+            question, settings.llm_speculative_candidates
+        )
+        try:
+            async for sql_query in candidates:
+                position += 1
+                self.speculation_stats["candidates"] += 1
+                if sql_query in seen:
+                    continue
+                seen.add(sql_query)
+                try:
+                    self._validate_sql(sql_query)
+                except ValueError as e:
+                    error = error or e
+                    continue
+                rejection = await self._plan_rejection(sql_query)
+                if rejection is None:
+                    if position:
+                        self.speculation_stats["rescued"] += 1
+                    return sql_query
+                self.speculation_stats[rejection] += 1
+                fallback = fallback or sql_query
+        finally:
+            await candidates.aclose()
+
+        if fallback is not None:
+            return fallback
+        raise error or ValueError("Invalid SQL: no SQL was generated")
+
+    async def _plan_rejection(self, sql_query: str) -> Optional[str]:
+        """
+        Why PostgreSQL would not run a query: "explain" if it cannot be
+        planned, "too_expensive" if it is over MAX_QUERY_COST, else None
+        """
+        plan = await self.db_service.explain(sql_query)
+        if plan is None:
+            return "explain"
+        if estimate_plan(plan).total_cost > settings.max_query_cost:
+            return "too_expensive"
+        return None
+
+    def _accept_generated(self, sql_query: str, cache_key: str) -> str:
+        """Validate freshly generated SQL and record the outcome in the SQL caches"""
+        try:
+            self._validate_sql(sql_query)
+        except ValueError as e:
+            if settings.sql_cache_enabled:
+                self.sql_negative_cache.set(cache_key, str(e))
+            raise
+
+        if settings.sql_cache_enabled:
+            self.sql_cache.set(cache_key, sql_query)
+        return sql_query
+
+    async def _generate_executable_sql(
+        self, question: str, escalate: bool = False
+    ) -> Tuple[str, List[str]]:
+        """
+        Return validated SQL for a question, rewritten to use the spatial indexes
+
+        The result is recorded in the query log when one is configured.
+
+        Returns:
+            Tuple of (SQL to execute, names of the rewrites applied)
+        """
+        with stage("generation"):
+            sql_query = await self._generate_validated_sql(question, escalate)
+            return self._make_executable(question, sql_query)
+
+    def _make_executable(self, question: str, sql_query: str) -> Tuple[str, List[str]]:
+        """
+        Rewrite validated SQL to use the spatial indexes and log it
+
+        The question is kept for the rest of the request, so the slow-query
+        log can show what the SQL was generated for.
+        """
+        current_question.set(question)
+        rewrites: List[str] = []
+        if settings.sql_rewrite_enabled:
+            sql_query, rewrites = rewrite_sql(sql_query)
+        if rewrites:
+            logger.info(f"SQL rewrites applied: {', '.join(rewrites)}")
+            for name in rewrites:
+                self.rewrite_stats[name] = self.rewrite_stats.get(name, 0) + 1
+
+        if self.query_log is not None:
+            self.query_log.record(question, sql_query, rewrites)
+        return sql_query, rewrites
+
+    def _validate_sql(self, sql_query: str) -> None:
+        """Validate generated SQL, raising ValueError if it is not allowed"""
+        with stage("validation"):
+            is_valid, error_message = self.db_service.validate_sql(sql_query)
+        if not is_valid:
+            logger.error(f"SQL validation failed: {error_message}")
+            raise ValueError(f"Invalid SQL: {error_message}")
+        logger.info("SQL validation passed")
+
+    async def _execute(
+        self, sql_query: str, max_rows: Optional[int] = None, preview: bool = False
+    ) -> ResultSet:
+        """Execute SQL within the row/byte budget"""
+        max_rows = min(max_rows or settings.max_result_rows, settings.max_result_rows)
+        max_bytes = settings.max_result_bytes
+
+        async def load(sql: str) -> ResultSet:
+            estimate, lane = await self._enter_lane(sql, max_rows + 1)
+            async with lane:
+                with session_tuning(estimate):
+                    result_set = await self.db_service.execute_bounded(
+                        sql, max_rows, max_bytes, preview=preview,
+                        buffered=estimate is not None and estimate.strategy == BUFFERED,
+                        estimated_rows=estimate.rows if estimate else None
+                    )
+            return result_set._replace(plan=estimate._asdict() if estimate else None)
+
+        variant = f"rows={max_rows};bytes={max_bytes};preview={int(preview)}"
+        return await self._load_shared(sql_query, variant, load, self.result_cache)
+
+    async def _plan(
+        self, sql_query: str, row_limit: Optional[int] = None
+    ) -> Optional[PlanEstimate]:
+        """EXPLAIN a query and estimate its cost and fetch strategy (None if unavailable)"""
+        if not settings.cost_guard_enabled:
+            return None
+        plan = await self.db_service.explain(sql_query)
+        if plan is None:
+            return None
+        estimate = estimate_plan(plan, row_limit)
+        logger.info(
+            f"Plan estimate: cost {estimate.total_cost:g}, ~{estimate.rows} rows "
+            f"({estimate.query_class}, {estimate.lane} lane, {estimate.strategy})"
+        )
+        return estimate
+
+    async def _enter_lane(
+        self, sql_query: str, row_limit: Optional[int] = None
+    ) -> Tuple[Optional[PlanEstimate], AsyncExitStack]:
+        """
+        Plan a query, reject it if too expensive and take a slot in its lane
+
+        The returned exit stack holds the slot; closing it releases the slot.
+
+        Raises:
+            QueryTooExpensive: If the estimated cost is over MAX_QUERY_COST
+        """
+        estimate = await self._plan(sql_query, row_limit)
+        lane = AsyncExitStack()
+        await lane.enter_async_context(self.planner.lane(estimate))
+        return estimate, lane
+
+    async def _open_stream(
+        self, sql_query: str, batch_size: int
+    ) -> Tuple[
+        AsyncGenerator[Tuple[List[str], List[Tuple]], None], List[str], List[Tuple], AsyncExitStack
+    ]:
+        """
+        Plan a streamed query, take its lane slot and fetch the first batch
+
+        Returns:
+            Tuple of (remaining batches, columns, first rows, lane); the caller
+            closes the batches and then the lane when the stream ends
+        """
+        estimate, lane = await self._enter_lane(sql_query)
+        try:
+            with session_tuning(estimate):
+                batches = self.db_service.stream_query(sql_query, batch_size)
+                columns, first_rows = await batches.__anext__()
+        except BaseException:
+            await lane.aclose()
+            raise
+        return batches, columns, first_rows, lane
+
+    async def _load_shared(
+        self,
+        sql_query: str,
+        variant: str,
+        load: Callable[[str], Awaitable[T]],
+        cache: Optional[ResultCache]
+    ) -> T:
+        """
+        Run a loader for SQL through a cache and execution coalescing
+
+        Concurrent identical executions (same SQL and variant) share one
+        database round trip, and results are cached when a cache is given.
+        """
+        async def execute() -> T:
+            if cache is None:
+                return await load(sql_query)
+            result: T = await cache.get_or_load(sql_query, load, variant=variant)
+            return result
+
+        return await self.execution_flight.do(f"{fingerprint_sql(sql_query)}:{variant}", execute)
+
+    @staticmethod
+    def _apply_geometry_detail(sql_query: str, request: QueryRequest) -> str:
+        """
+        Rewrite ST_AsGeoJSON calls for the request's zoom/tolerance hint
+
+        Picks the coarsest precomputed level of detail and the fewest decimal
+        digits that are still below one pixel (or the given tolerance). Without
+        a hint only the configured coordinate precision is applied.
+        """
+        max_digits = settings.geojson_max_decimal_digits
+        if request.tolerance is not None:
+            resolution = request.tolerance
+        elif request.zoom is not None:
+            resolution = zoom_resolution(request.zoom)
+        else:
+            if max_digits >= 9:
+                return sql_query
+            return geometry_detail_sql(sql_query, 0, max_digits, settings.geometry_lod_tables)
+
+        level, digits = detail_for_resolution(
+            resolution, settings.geometry_lod_tolerances, max_digits
+        )
+        logger.info(f"Geometry detail: LOD {level}, {digits} decimal digits")
+        return geometry_detail_sql(sql_query, level, digits, settings.geometry_lod_tables)
+
+    def record_cancellation(self, reason: str) -> None:
+        """Count a request cancelled for `reason` ("deadline" or "disconnect")"""
+        self.cancellations[reason] = self.cancellations.get(reason, 0) + 1
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Return cache, coalescing and cancellation counters"""
+        stats = {
+            "sql_cache": self.sql_cache.stats(),
+            "sql_negative_cache": self.sql_negative_cache.stats(),
+            "coalescing": {
+                "generation": self.generation_flight.stats(),
+                "execution": self.execution_flight.stats(),
+            },
+        }
+        if self.result_cache is not None:
+            stats["result_cache"] = await self.result_cache.stats()
+        if self.tile_cache is not None:
+            stats["tile_cache"] = await self.tile_cache.stats()
+
+        stats["rewrites"] = dict(self.rewrite_stats)
+        stats["planner"] = self.planner.stats()
+        stats["llm"] = self.openai_service.stats()
+        stats["speculation"] = dict(self.speculation_stats)
+        stats["templates"] = self.db_service.templates.stats()
+        stats["slow_queries"] = self.db_service.slow_queries.stats()
+        stats["exports"] = dict(self.export_stats)
+        stats["batches"] = dict(self.batch_stats)
+        stats["cancellations"] = dict(
+            self.cancellations,
+            database_queries=self.db_service.cancelled_queries,
+        )
+
+        streams = self.stream_stats["requests"]
+        stats["streaming"] = {
+            "requests": streams,
+            "rows": self.stream_stats["rows"],
+            "ttfb_last": self.stream_stats["ttfb_last"],
+            "ttfb_avg": round(self.stream_stats["ttfb_total"] / streams, 4) if streams else None,
+        }
+
+        progress = self.progress_stats
+        stats["progress_streams"] = {
+            "requests": progress["requests"],
+            "early_stops": progress["early_stops"],
+            "mean_time_to_sql": (
+                round(progress["sql_seconds"] / progress["requests"], 4)
+                if progress["requests"] else None
+            ),
+            "mean_time_to_first_rows": (
+                round(progress["first_rows_seconds"] / progress["first_rows"], 4)
+                if progress["first_rows"] else None
+            ),
+        }
+        return stats
+
+    async def close(self) -> None:
+        """Persist caches to disk if configured, stop listeners and close the query log"""
+        if settings.sql_cache_enabled and settings.sql_cache_path:
+            self.sql_cache.save(settings.sql_cache_path)
+        if self._version_sync_task is not None:
+            self._version_sync_task.cancel()
+            await asyncio.gather(self._version_sync_task, return_exceptions=True)
+        if self._version_listener is not None:
+            await self._version_listener.close()
+        if self.query_log is not None:
+            self.query_log.close()
+
+    async def process_query(
+        self, request: QueryRequest, execution_slot: Optional[asyncio.Semaphore] = None
+    ) -> QueryResponse:
         """
         Process natural language query and return results
 
         Args:
             request: Query request with natural language question
+            execution_slot: Semaphore held while the SQL executes (batches
+                use one to share a few pooled connections)
 
         Returns:
             Query response with SQL, results, and metadata
@@ -42,49 +659,548 @@ class QueryService:
         logger.info(f"Question: {request.question}")
         logger.info("=" * 80)
 
+        with tracer.start_as_current_span("query.process") as span:
+            try:
+                # Step 1: Generate SQL using OpenAI (or the SQL cache), validate it and
+                # rewrite it to use the spatial indexes
+                logger.info("STEP 1: Generating and validating SQL...")
+                generated_sql, rewrites = await self._generate_executable_sql(request.question)
+                logger.info(f"Generated SQL:\n{generated_sql}")
+                sql_query = self._apply_geometry_detail(generated_sql, request)
+                span.set_attribute("geosql.sql.fingerprint", fingerprint_sql(sql_query))
+                span.set_attribute("geosql.rewrites", rewrites)
+
+                # Step 2: Execute SQL query (first keyset page if paginated)
+                logger.info("STEP 2: Executing SQL query...")
+                slot = execution_slot or nullcontext()
+                try:
+                    async with slot:
+                        with stage("execution"):
+                            result_set, next_token = await self._run(sql_query, request)
+                except (exc.ProgrammingError, exc.DataError) as e:
+                    if not self._escalate_after_error(request.question):
+                        raise
+                    logger.warning(f"SQL from a cheaper model failed to execute, escalating: {e}")
+                    generated_sql, rewrites = await self._generate_executable_sql(
+                        request.question, escalate=True
+                    )
+                    sql_query = self._apply_geometry_detail(generated_sql, request)
+                    span.set_attribute("geosql.sql.fingerprint", fingerprint_sql(sql_query))
+                    span.set_attribute("geosql.escalated", True)
+                    async with slot:
+                        with stage("execution"):
+                            result_set, next_token = await self._run(sql_query, request)
+
+                # Step 3: Format results
+                logger.info("STEP 3: Formatting results...")
+                with stage("formatting"):
+                    results = self._format_results(result_set.columns, result_set.rows)
+                span.set_attribute("geosql.rows", len(results))
+                span.set_attribute("geosql.truncated", result_set.truncated)
+
+                execution_time = time.time() - start_time
+
+                logger.info("=" * 80)
+                logger.info("QUERY COMPLETED SUCCESSFULLY")
+                logger.info(f"Execution time: {execution_time:.3f}s")
+                logger.info(f"Results: {len(results)} rows")
+                logger.info("=" * 80)
+
+                return QueryResponse(
+                    sql=sql_query,
+                    rewrites=rewrites,
+                    results=results,
+                    execution_time=execution_time,
+                    result_count=len(results),
+                    truncated=result_set.truncated,
+                    estimated_total=result_set.estimated_total,
+                    plan=result_set.plan,
+                    next_token=next_token,
+                    # Tiles pick their own detail, so the handle keeps the generated SQL
+                    query_handle=encode_handle(
+                        {"sql": generated_sql, "columns": result_set.columns}
+                    )
+                )
+
+            except ValueError as e:
+                logger.error(f"Validation error: {e}")
+                raise
+            except Exception as e:
+                logger.error(f"Query processing error: {e}")
+                raise
+
+    async def process_batch(
+        self, request: BatchQueryRequest, timeout: float
+    ) -> AsyncGenerator[BatchOutcome, None]:
+        """
+        Answer a batch of questions, yielding each outcome as it finishes
+
+        Repeated questions (after normalization) are answered once. Up to
+        BATCH_CONCURRENCY questions are answered at a time, as by
+        process_query, and their executions share
+        BATCH_EXECUTION_CONCURRENCY pooled connections. Each question gets a
+        `timeout` deadline from when it starts; a failing question is
+        reported in its outcome and does not end the batch. Closing the
+        generator cancels the questions still running.
+
+        Args:
+            request: Questions and the options applied to each
+            timeout: Deadline of each question, in seconds
+
+        Yields:
+            One outcome per distinct question, in completion order
+        """
+        distinct: Dict[str, Tuple[str, List[int]]] = {}
+        for index, question in enumerate(request.questions):
+            distinct.setdefault(normalize_question(question), (question, []))[1].append(index)
+
+        self.batch_stats["requests"] += 1
+        self.batch_stats["questions"] += len(request.questions)
+        self.batch_stats["duplicates"] += len(request.questions) - len(distinct)
+        logger.info(
+            f"NEW BATCH: {len(request.questions)} questions, {len(distinct)} distinct"
+        )
+
+        question_slots = asyncio.Semaphore(settings.batch_concurrency)
+        execution_slots = asyncio.Semaphore(settings.batch_execution_concurrency)
+
+        async def answer(question: str, indices: List[int]) -> BatchOutcome:
+            try:
+                query_request = QueryRequest(
+                    question=question, page_size=None, max_rows=request.max_rows,
+                    preview=request.preview, zoom=None, tolerance=None
+                )
+                async with question_slots:
+                    response = await run_with_deadline(
+                        self.process_query(query_request, execution_slots), Deadline(timeout)
+                    )
+            except Exception as e:
+                if isinstance(e, DeadlineExceeded):
+                    self.record_cancellation("deadline")
+                self.batch_stats["errors"] += 1
+                return BatchOutcome(question, indices, None, e)
+            return BatchOutcome(question, indices, response, None)
+
+        tasks = [
+            asyncio.ensure_future(answer(question, indices))
+            for question, indices in distinct.values()
+        ]
         try:
-            # Step 1: Generate SQL using OpenAI
-            logger.info("STEP 1: Generating SQL using OpenAI...")
-            sql_query = self.openai_service.generate_sql(request.question)
-            logger.info(f"Generated SQL:\n{sql_query}")
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            await cancel_all(tasks)
 
-            # Step 2: Validate SQL
-            logger.info("STEP 2: Validating SQL...")
-            is_valid, error_message = self.db_service.validate_sql(sql_query)
-            if not is_valid:
-                logger.error(f"SQL validation failed: {error_message}")
-                raise ValueError(f"Invalid SQL: {error_message}")
-            logger.info("SQL validation passed")
-
-            # Step 3: Execute SQL query
-            logger.info("STEP 3: Executing SQL query...")
-            columns, rows = self.db_service.execute_query(sql_query)
-
-            # Step 4: Format results
-            logger.info("STEP 4: Formatting results...")
-            results = self._format_results(columns, rows)
-
-            execution_time = time.time() - start_time
-
-            logger.info("=" * 80)
-            logger.info("QUERY COMPLETED SUCCESSFULLY")
-            logger.info(f"Execution time: {execution_time:.3f}s")
-            logger.info(f"Results: {len(results)} rows")
-            logger.info("=" * 80)
-
-            return QueryResponse(
-                sql=sql_query,
-                results=results,
-                execution_time=execution_time,
-                result_count=len(results)
+    async def _run(
+        self, sql_query: str, request: QueryRequest
+    ) -> Tuple[ResultSet, Optional[str]]:
+        """Execute SQL for a request: the first keyset page if paginated, else within the budget"""
+        if request.page_size:
+            return await self._fetch_page(sql_query, None, request.page_size)
+        return await self._execute(sql_query, request.max_rows, request.preview), None
+
+    def _escalate_after_error(self, question: str) -> bool:
+        """
+        Whether failed SQL came from a cheaper model and should be regenerated
+        with the strongest one; if so its cached SQL is dropped
+        """
+        cache_key = self._sql_cache_key(question)
+        tier = self.cheap_generations.get(cache_key)
+        if tier is None:
+            return False
+        self.openai_service.tiers[tier].record_escalation("execution")
+        self.cheap_generations.delete(cache_key)
+        self.sql_cache.delete(cache_key)
+        return True
+
+    async def fetch_next_page(self, token: str) -> QueryResponse:
+        """
+        Fetch the next keyset page for a continuation token
+
+        No LLM call is made: the token carries the already-validated SQL.
+
+        Raises:
+            ValueError: If the token is invalid or expired
+        """
+        start_time = time.time()
+        state = decode_handle(token)
+        if "after" not in state:
+            raise ValueError("Not a continuation token")
+        sql_query = state["sql"]
+        self._validate_sql(sql_query)
+
+        result_set, next_token = await self._fetch_page(
+            sql_query, state["after"], state["page_size"]
+        )
+        results = self._format_results(result_set.columns, result_set.rows)
+
+        return QueryResponse(
+            sql=sql_query,
+            results=results,
+            execution_time=time.time() - start_time,
+            result_count=len(results),
+            truncated=False,
+            estimated_total=None,
+            plan=None,
+            next_token=next_token,
+            query_handle=None
+        )
+
+    async def _fetch_page(
+        self, sql_query: str, after: Optional[Any], page_size: int
+    ) -> Tuple[ResultSet, Optional[str]]:
+        """
+        Fetch one page ordered by the key column using keyset pagination
+
+        Returns:
+            Tuple of (page rows, continuation token or None on the last page)
+        """
+        if after is None:
+            # Results without an id column cannot be paged; return them whole
+            if PAGE_KEY_COLUMN not in await self.db_service.describe_columns(sql_query):
+                logger.info("Results have no id column; returning them unpaginated")
+                return await self._execute(sql_query), None
+
+        # Never split rows sharing a key across pages: the next page starts
+        # strictly after the last key on this one. When every row fetched
+        # shares one key, fetch a larger batch until that key's rows fit.
+        limit = page_size
+        while True:
+            page_sql = keyset_page_sql(sql_query, PAGE_KEY_COLUMN, after, limit + 1)
+            result_set = await self._execute(page_sql, limit + 1)
+            columns, rows = result_set.columns, result_set.rows
+            if not rows or (len(rows) <= limit and not result_set.truncated):
+                return result_set, None
+
+            key_index = columns.index(PAGE_KEY_COLUMN)
+            page = list(rows[:limit])
+            if len(rows) > limit and rows[limit][key_index] == page[-1][key_index]:
+                boundary = page[-1][key_index]
+                page = [row for row in page if row[key_index] != boundary]
+            if page:
+                break
+            limit *= 2
+
+        next_token = encode_handle({
+            "sql": sql_query, "after": page[-1][key_index], "page_size": page_size
+        })
+        return ResultSet(columns, page, plan=result_set.plan), next_token
+
+    async def render_feature_collection(
+        self, request: QueryRequest
+    ) -> Tuple[str, RenderedResult]:
+        """
+        Process a query and return the FeatureCollection built by PostGIS
+
+        The collection bytes come straight from the database and are meant to
+        be sent to the client untouched.
+
+        Args:
+            request: Query request with natural language question
+
+        Returns:
+            Tuple of (validated SQL, rendered FeatureCollection)
+
+        Raises:
+            ValueError: If SQL validation fails
+        """
+        logger.info(f"NEW FEATURECOLLECTION QUERY: {request.question}")
+
+        sql_query, _ = await self._generate_executable_sql(request.question)
+        sql_query = self._apply_geometry_detail(sql_query, request)
+        max_rows = min(request.max_rows or settings.max_result_rows, settings.max_result_rows)
+        max_bytes = settings.max_result_bytes
+
+        async def load(sql: str) -> RenderedResult:
+            estimate, lane = await self._enter_lane(sql, max_rows)
+            async with lane:
+                with session_tuning(estimate):
+                    rendered = await self.db_service.execute_feature_collection(
+                        sql, max_rows, max_bytes
+                    )
+            return rendered
+
+        variant = f"featurecollection;rows={max_rows};bytes={max_bytes}"
+        return sql_query, await self._load_shared(sql_query, variant, load, self.result_cache)
+
+    async def render_tile(self, handle: str, z: int, x: int, y: int) -> bytes:
+        """
+        Render a Mapbox Vector Tile of a previous query's results
+
+        Tiles are cached on disk per query fingerprint and tile coordinate,
+        and invalidated when any table the query reads changes.
+
+        Args:
+            handle: Query handle from a previous /query response
+            z, x, y: Tile coordinates
+
+        Returns:
+            Encoded tile (empty if no features fall in the tile)
+
+        Raises:
+            ValueError: If the handle or tile coordinates are invalid
+        """
+        if not 0 <= z <= settings.tile_max_zoom:
+            raise ValueError(f"Zoom must be between 0 and {settings.tile_max_zoom}")
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Tile {z}/{x}/{y} is out of range")
+
+        state = decode_handle(handle)
+        sql_query = state["sql"]
+        self._validate_sql(sql_query)
+
+        columns = state.get("columns") or await self.db_service.describe_columns(sql_query)
+        if formatters.GEOJSON_COLUMN not in columns:
+            raise ValueError("Query results have no geometry to render")
+
+        async def load(sql: str) -> bytes:
+            return await self.db_service.render_tile(sql, columns, z, x, y)
+
+        variant = f"mvt={z}/{x}/{y};extent={settings.tile_extent};buffer={settings.tile_buffer}"
+        return await self._load_shared(sql_query, variant, load, self.tile_cache)
+
+    async def export_query(
+        self, request: QueryRequest, output_format: str
+    ) -> Tuple[str, AsyncIterator[bytes]]:
+        """
+        Process a query and stream its results as a columnar file
+
+        Geometry is converted to WKB by PostGIS and rows go from the
+        server-side cursor into Arrow record batches without being turned
+        into Python dicts. As with stream_query, SQL generation and the first
+        fetch happen before returning so errors surface as HTTP errors.
+
+        Args:
+            request: Query request with natural language question
+            output_format: "geoparquet", "arrow" or "flatgeobuf"
+
+        Returns:
+            Tuple of (validated SQL, async iterator of file chunks)
+
+        Raises:
+            ValueError: If the format is unavailable, SQL validation fails or
+                the results have no geometry
+        """
+        exporters.check_export_format(output_format)
+        logger.info(f"NEW EXPORT QUERY ({output_format}): {request.question}")
+
+        sql_query, _ = await self._generate_executable_sql(request.question)
+        columns = await self.db_service.describe_columns(sql_query)
+        if formatters.GEOJSON_COLUMN not in columns:
+            raise ValueError("Query results have no geometry to export")
+
+        export_sql = wkb_export_sql(
+            apply_row_limit(sql_query, settings.export_max_rows), columns,
+            exporters.GEOMETRY_COLUMN
+        )
+        type_oids = await self.db_service.describe_column_types(export_sql)
+        batches, columns, first_rows, lane = await self._open_stream(
+            export_sql, settings.export_batch_size
+        )
+
+        async def body() -> AsyncIterator[bytes]:
+            start_time = time.time()
+            size = 0
+            try:
+                async for chunk in exporters.export_batches(
+                    columns, batches, output_format, first_rows, type_oids
+                ):
+                    size += len(chunk)
+                    yield chunk
+            finally:
+                await batches.aclose()
+                await lane.aclose()
+                self.export_stats["requests"] += 1
+                self.export_stats["bytes"] += size
+                logger.info(
+                    f"Export finished: {size} bytes of {output_format} "
+                    f"in {time.time() - start_time:.3f}s"
+                )
+
+        return sql_query, body()
+
+    async def stream_query(
+        self, request: QueryRequest, output_format: str
+    ) -> Tuple[str, AsyncIterator[bytes]]:
+        """
+        Process a query and stream its results as GeoJSON or NDJSON
+
+        SQL generation and the first cursor fetch happen before returning, so
+        validation and SQL errors still surface as regular HTTP errors. Rows
+        are then read from a server-side cursor and encoded batch by batch.
+
+        Args:
+            request: Query request with natural language question
+            output_format: "geojson" (FeatureCollection) or "ndjson"
+
+        Returns:
+            Tuple of (validated SQL, async iterator of response chunks)
+
+        Raises:
+            ValueError: If SQL validation fails
+        """
+        start_time = time.time()
+        logger.info(f"NEW STREAMING QUERY ({output_format}): {request.question}")
+
+        sql_query, _ = await self._generate_executable_sql(request.question)
+        sql_query = self._apply_geometry_detail(sql_query, request)
+        batches, columns, first_rows, lane = await self._open_stream(
+            sql_query, settings.stream_batch_size
+        )
+
+        async def body() -> AsyncIterator[bytes]:
+            rows_sent = 0
+            try:
+                if output_format == "geojson":
+                    yield formatters.FEATURE_COLLECTION_PREFIX
+                    yield formatters.encode_feature_collection_batch(
+                        columns, first_rows, first=True
+                    )
+                else:
+                    yield formatters.encode_ndjson_batch(columns, first_rows)
+                rows_sent += len(first_rows)
+
+                ttfb = time.time() - start_time
+                self.stream_stats["requests"] += 1
+                self.stream_stats["ttfb_total"] += ttfb
+                self.stream_stats["ttfb_last"] = round(ttfb, 4)
+                logger.info(f"Streaming time-to-first-byte: {ttfb:.3f}s")
+
+                async for _, rows in batches:
+                    if output_format == "geojson":
+                        yield formatters.encode_feature_collection_batch(
+                            columns, rows, first=rows_sent == 0
+                        )
+                    else:
+                        yield formatters.encode_ndjson_batch(columns, rows)
+                    rows_sent += len(rows)
+
+                if output_format == "geojson":
+                    yield formatters.FEATURE_COLLECTION_SUFFIX
+            finally:
+                await batches.aclose()
+                await lane.aclose()
+                self.stream_stats["rows"] += rows_sent
+                logger.info(
+                    f"Streaming query finished: {rows_sent} rows in {time.time() - start_time:.3f}s"
+                )
+
+        return sql_query, body()
+
+    async def stream_events(
+        self, request: QueryRequest
+    ) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        Process a query, yielding progress events as each stage completes
+
+        Events, in order:
+            sql: {"delta"} text as the LLM generates it ({"delta", "cached"}
+                with the whole statement on an SQL cache hit)
+            validated: {"sql", "rewrites"} once the statement is complete and valid
+            executing: {"sql"} the SQL sent to the database
+            rows: {"features"} a batch of GeoJSON Features (pre-encoded bytes)
+            done: {"result_count", "truncated", "execution_time"}
+
+        The LLM output is read only until the first complete statement; the
+        completion stream is then closed and the statement validated at once,
+        without waiting for the rest of the response. Closing this generator
+        (e.g. when the client disconnects) closes the LLM stream, the cursor
+        and the lane slot. Generations are not coalesced with concurrent
+        identical questions, since each client receives its own tokens.
+
+        Args:
+            request: Query request with natural language question
+
+        Raises:
+            ValueError: If SQL validation fails
+        """
+        start_time = time.time()
+        logger.info(f"NEW PROGRESS STREAM QUERY: {request.question}")
+        self.progress_stats["requests"] += 1
+
+        cache_key = self._sql_cache_key(request.question)
+        sql_query = self._cached_sql(cache_key)
+        if sql_query is not None:
+            yield "sql", {"delta": sql_query, "cached": True}
+        else:
+            text = ""
+            async for delta in self._stream_first_statement(request.question):
+                text += delta
+                yield "sql", {"delta": delta}
+            sql_query = self._accept_generated(
+                complete_statement(text, final=True) or "", cache_key
             )
 
-        except ValueError as e:
-            logger.error(f"Validation error: {e}")
-            raise
-        except Exception as e:
-            logger.error(f"Query processing error: {e}")
-            raise
+        sql_query, rewrites = self._make_executable(request.question, sql_query)
+        self.progress_stats["sql_seconds"] += time.time() - start_time
+        yield "validated", {"sql": sql_query, "rewrites": rewrites}
+
+        sql_query = self._apply_geometry_detail(sql_query, request)
+        max_rows = min(request.max_rows or settings.max_result_rows, settings.max_result_rows)
+        yield "executing", {"sql": sql_query}
+
+        batches, columns, rows, lane = await self._open_stream(
+            apply_row_limit(sql_query, max_rows + 1), settings.stream_batch_size
+        )
+        result_count = 0
+        truncated = False
+        try:
+            self.progress_stats["first_rows"] += 1
+            self.progress_stats["first_rows_seconds"] += time.time() - start_time
+            while True:
+                if result_count + len(rows) > max_rows:
+                    rows = rows[:max_rows - result_count]
+                    truncated = True
+                if rows:
+                    result_count += len(rows)
+                    yield "rows", formatters.encode_feature_batch(columns, rows)
+                if truncated:
+                    break
+                try:
+                    _, rows = await batches.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            await batches.aclose()
+            await lane.aclose()
+
+        execution_time = time.time() - start_time
+        logger.info(f"Progress stream finished: {result_count} rows in {execution_time:.3f}s")
+        yield "done", {
+            "result_count": result_count,
+            "truncated": truncated,
+            "execution_time": round(execution_time, 3),
+        }
+
+    def _cached_sql(self, cache_key: str) -> Optional[str]:
+        """
+        Return SQL cached for a question, or None
+
+        Raises:
+            ValueError: If the question's SQL recently failed validation
+        """
+        if not settings.sql_cache_enabled:
+            return None
+        cached_sql: Optional[str] = self.sql_cache.get(cache_key)
+        if cached_sql is None:
+            cached_error = self.sql_negative_cache.get(cache_key)
+            if cached_error is not None:
+                raise ValueError(cached_error)
+        return cached_sql
+
+    async def _stream_first_statement(self, question: str) -> AsyncGenerator[str, None]:
+        """Yield LLM SQL deltas until they hold a complete statement, then close the stream"""
+        text = ""
+        tokens = self.openai_service.stream_sql(question)
+        try:
+            async for delta in tokens:
+                text += delta
+                yield delta
+                if complete_statement(text) is not None:
+                    self.progress_stats["early_stops"] += 1
+                    break
+        finally:
+            await tokens.aclose()
 
     @staticmethod
     def _format_results(columns: List[str], rows: List[tuple]) -> List[Dict[str, Any]]:
@@ -0,0 +1,438 @@
+"""Query result cache shared across workers through an on-disk SQLite store"""
+
+import asyncio
+import base64
+import contextvars
+import datetime
+import decimal
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from app.services.schema_registry import get_schema_registry
+from app.services.sql_utils import (
+    TRACKED_TABLES,
+    fingerprint_sql,
+    referenced_tables,
+    untracked_tables
+)
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[str], Awaitable[Any]]
+
+# Key marking an encoded value that plain JSON cannot represent
+_TAG = "__t"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    fingerprint TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    versions TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    refreshing_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access);
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+# Scalar types PostgreSQL returns: (type, tag, encoder); datetime before date,
+# as a datetime is also a date
+_SCALAR_ENCODERS: List[Tuple[Any, str, Callable[[Any], Any]]] = [
+    ((bytes, bytearray, memoryview), "bytes", lambda v: base64.b64encode(bytes(v)).decode("ascii")),
+    (decimal.Decimal, "decimal", str),
+    (datetime.datetime, "datetime", lambda v: v.isoformat()),
+    (datetime.date, "date", lambda v: v.isoformat()),
+    (datetime.time, "time", lambda v: v.isoformat()),
+    (datetime.timedelta, "timedelta", lambda v: v.total_seconds()),
+    (uuid.UUID, "uuid", str),
+]
+
+_SCALAR_DECODERS: Dict[str, Callable[[Any], Any]] = {
+    "bytes": base64.b64decode,
+    "decimal": decimal.Decimal,
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "timedelta": lambda v: datetime.timedelta(seconds=v),
+    "uuid": uuid.UUID,
+}
+
+
+def _encode(value: Any) -> Any:
+    """
+    Convert a result to plain JSON data
+
+    Tuples, bytes and the scalar types PostgreSQL returns are tagged so they
+    round-trip. NamedTuples are stored by class name.
+
+    Raises:
+        TypeError: If the value contains a type that cannot be stored
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, tuple):
+        items = [_encode(item) for item in value]
+        if hasattr(value, "_fields"):
+            return {_TAG: "record", "type": type(value).__name__, "v": items}
+        return {_TAG: "tuple", "v": items}
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value) and _TAG not in value:
+            return {key: _encode(item) for key, item in value.items()}
+        return {_TAG: "dict", "v": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    for kind, tag, encode in _SCALAR_ENCODERS:
+        if isinstance(value, kind):
+            return {_TAG: tag, "v": encode(value)}
+    raise TypeError(f"Cannot cache a value of type {type(value).__name__}")
+
+
+def _decode(value: Any, record_types: Dict[str, Any]) -> Any:
+    """
+    Rebuild a result stored by _encode
+
+    Raises:
+        ValueError: If the data names an unknown tag or record type
+    """
+    if isinstance(value, list):
+        return [_decode(item, record_types) for item in value]
+    if not isinstance(value, dict):
+        return value
+    tag = value.get(_TAG)
+    if tag is None:
+        return {key: _decode(item, record_types) for key, item in value.items()}
+
+    data = value["v"]
+    if tag == "tuple":
+        return tuple(_decode(item, record_types) for item in data)
+    if tag == "record":
+        if value["type"] not in record_types:
+            raise ValueError(f"Unknown cached record type: {value['type']}")
+        return record_types[value["type"]](*(_decode(item, record_types) for item in data))
+    if tag == "dict":
+        return {_decode(k, record_types): _decode(v, record_types) for k, v in data}
+    if tag not in _SCALAR_DECODERS:
+        raise ValueError(f"Unknown cached value tag: {tag}")
+    return _SCALAR_DECODERS[tag](data)
+
+
+@dataclass
+class CachedResult:
+    """A cached query result"""
+
+    value: Any
+    stale: bool = False
+
+
+class ResultCache:
+    """
+    Result cache keyed by SQL fingerprint with per-table version invalidation
+
+    Entries record the version of every table the query reads. A bump of any
+    of those versions (from the PostgreSQL NOTIFY trigger) invalidates them.
+    Entries past their TTL are still served for a grace period if they are
+    popular, while a single worker refreshes them in the background
+    (stale-while-revalidate). The store is a SQLite database in WAL mode so
+    every uvicorn worker on the host shares one copy.
+
+    Values are stored as JSON, so nothing read back from the shared file can
+    run code; NamedTuples must be listed in `record_types` to round-trip.
+    Queries reading tables without version tracking are never cached, since
+    nothing would invalidate them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float,
+        stale_ttl: float,
+        swr_min_hits: int,
+        max_entries: int,
+        max_bytes: int,
+        max_entry_bytes: int,
+        record_types: Sequence[Any] = ()
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.swr_min_hits = swr_min_hits
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.record_types = {record_type.__name__: record_type for record_type in record_types}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.refreshes = 0
+        self.uncacheable = 0
+        self._refresh_tasks: Set[asyncio.Task] = set()
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open an autocommit connection to the shared store"""
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Table versions
+    # ------------------------------------------------------------------
+
+    def _read_versions(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        return dict(conn.execute("SELECT table_name, version FROM table_versions").fetchall())
+
+    def _store_versions(self, versions: Dict[str, int]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO table_versions (table_name, version) VALUES (?, ?) "
+                "ON CONFLICT(table_name) DO UPDATE SET version = MAX(version, excluded.version)",
+                list(versions.items())
+            )
+
+    def _bump_local(self, tables: List[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO table_versions (table_name, version) VALUES (?, 1) "
+                "ON CONFLICT(table_name) DO UPDATE SET version = version + 1",
+                [(table,) for table in tables]
+            )
+
+    async def set_table_versions(self, versions: Dict[str, int]) -> None:
+        """Record table versions reported by PostgreSQL (never moves backwards)"""
+        await asyncio.to_thread(self._store_versions, versions)
+
+    async def bump_tables(self, *tables: str) -> None:
+        """Invalidate cached results reading any of the given tables"""
+        await asyncio.to_thread(self._bump_local, list(tables or TRACKED_TABLES))
+
+    # ------------------------------------------------------------------
+    # Entries
+    # ------------------------------------------------------------------
+
+    def _get(self, fingerprint: str, tables: List[str]) -> Optional[Tuple[CachedResult, bool]]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, versions, created_at, hits, refreshing_until "
+                "FROM entries WHERE fingerprint = ?",
+                (fingerprint,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            payload, versions, created_at, hits, refreshing_until = row
+            current = self._read_versions(conn)
+            recorded = json.loads(versions)
+            if any(current.get(table, 0) != recorded.get(table, 0) for table in tables):
+                conn.execute("DELETE FROM entries WHERE fingerprint = ?", (fingerprint,))
+                self.invalidations += 1
+                return None
+
+            age = now - created_at
+            stale = age >= self.ttl
+            if stale and (age >= self.ttl + self.stale_ttl or hits < self.swr_min_hits):
+                return None
+
+            # Claim the background refresh so only one worker recomputes the entry
+            claim_refresh = False
+            if stale and refreshing_until < now:
+                claimed = conn.execute(
+                    "UPDATE entries SET refreshing_until = ? "
+                    "WHERE fingerprint = ? AND refreshing_until < ?",
+                    (now + self.ttl, fingerprint, now)
+                )
+                claim_refresh = claimed.rowcount == 1
+
+            conn.execute(
+                "UPDATE entries SET hits = hits + 1, last_access = ? WHERE fingerprint = ?",
+                (now, fingerprint)
+            )
+
+        try:
+            value = _decode(json.loads(payload), self.record_types)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Dropping unreadable cached result {fingerprint}: {e}")
+            with self._connect() as conn:
+                conn.execute("DELETE FROM entries WHERE fingerprint = ?", (fingerprint,))
+            return None
+        return CachedResult(value=value, stale=stale), claim_refresh
+
+    def _versions_for(self, tables: List[str]) -> Dict[str, int]:
+        with self._connect() as conn:
+            current = self._read_versions(conn)
+        return {table: current.get(table, 0) for table in tables}
+
+    def _set(self, fingerprint: str, versions: Dict[str, int], payload: bytes) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO entries "
+                "(fingerprint, payload, versions, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(fingerprint) DO UPDATE SET payload = excluded.payload, "
+                "versions = excluded.versions, size = excluded.size, "
+                "created_at = excluded.created_at, refreshing_until = 0",
+                (fingerprint, payload, json.dumps(versions), len(payload), now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop least recently used entries until the store is within bounds"""
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        for fingerprint, size in conn.execute(
+            "SELECT fingerprint, size FROM entries ORDER BY last_access"
+        ).fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE fingerprint = ?", (fingerprint,))
+            count -= 1
+            total -= size
+
+    @staticmethod
+    def _key(sql: str, variant: str) -> str:
+        """Entry key: SQL fingerprint plus an optional variant (e.g. row budget)"""
+        return f"{fingerprint_sql(sql)}:{variant}" if variant else fingerprint_sql(sql)
+
+    async def get(self, sql: str, variant: str = "") -> Tuple[Optional[CachedResult], bool]:
+        """
+        Look up a cached result for a query
+
+        Returns:
+            Tuple of (cached result or None, whether the caller should refresh it)
+        """
+        found = await asyncio.to_thread(self._get, self._key(sql, variant), referenced_tables(sql))
+        if found is None:
+            self.misses += 1
+            return None, False
+
+        cached, claim_refresh = found
+        if cached.stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return cached, claim_refresh
+
+    async def set(
+        self,
+        sql: str,
+        value: Any,
+        versions: Optional[Dict[str, int]] = None,
+        variant: str = ""
+    ) -> None:
+        """
+        Store a query result unless it exceeds the per-entry size limit
+
+        Args:
+            sql: SQL query string
+            value: JSON-encodable result (e.g. columns and rows)
+            versions: Table versions observed before the query ran; defaults to
+                the current versions
+            variant: Distinguishes results of the same SQL fetched differently
+        """
+        try:
+            payload = json.dumps(_encode(value), separators=(",", ":")).encode("utf-8")
+        except TypeError as e:
+            logger.info(f"Result not cacheable: {e}")
+            return
+        if len(payload) > self.max_entry_bytes:
+            logger.info(f"Result too large to cache: {len(payload)} bytes")
+            return
+        if versions is None:
+            versions = await asyncio.to_thread(self._versions_for, referenced_tables(sql))
+        await asyncio.to_thread(self._set, self._key(sql, variant), versions, payload)
+
+    async def get_or_load(self, sql: str, loader: Loader, variant: str = "") -> Any:
+        """
+        Return a cached result or run the loader and cache its result
+
+        Stale entries are returned immediately; if this worker claimed the
+        refresh, the loader runs again in the background. Queries reading
+        untracked tables always run the loader.
+        """
+        untracked = untracked_tables(sql, known=get_schema_registry().names)
+        if untracked:
+            logger.debug(f"Not caching a query reading untracked tables: {', '.join(untracked)}")
+            self.uncacheable += 1
+            return await loader(sql)
+
+        cached, claim_refresh = await self.get(sql, variant)
+        if cached is not None:
+            if claim_refresh:
+                # Refreshes outlive the request that triggered them, so they
+                # run without its deadline
+                task = asyncio.create_task(
+                    self._load(sql, loader, variant), context=contextvars.Context()
+                )
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_done)
+            return cached.value
+
+        return await self._load(sql, loader, variant)
+
+    async def _load(self, sql: str, loader: Loader, variant: str) -> Any:
+        # Snapshot versions first so a concurrent bump is never masked
+        versions = await asyncio.to_thread(self._versions_for, referenced_tables(sql))
+        value = await loader(sql)
+        await self.set(sql, value, versions=versions, variant=variant)
+        return value
+
+    def _refresh_done(self, task: asyncio.Task) -> None:
+        self._refresh_tasks.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning(f"Background result refresh failed: {task.exception()}")
+        else:
+            self.refreshes += 1
+
+    async def stats(self) -> Dict[str, Any]:
+        """Return cache counters and store size"""
+        return await asyncio.to_thread(self.read_stats)
+
+    def read_stats(self) -> Dict[str, Any]:
+        """Return cache counters and store size, reading the store synchronously"""
+        with self._connect() as conn:
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            versions = self._read_versions(conn)
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": count,
+            "bytes": total,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "refreshes": self.refreshes,
+            "uncacheable": self.uncacheable,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "table_versions": versions,
+        }
@@ -0,0 +1,246 @@
+"""Registry of the queryable tables, introspected from the live catalog"""
+
+import hashlib
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnSchema(NamedTuple):
+    """A column as described to the LLM"""
+
+    name: str
+    data_type: str
+    description: str = ""
+
+
+class TableSchema(NamedTuple):
+    """A queryable table and how to describe it"""
+
+    name: str
+    columns: Tuple[ColumnSchema, ...]
+    geometry_type: str = "Geometry"
+    description: str = ""
+    # Words (any language) that identify the table in a question
+    keywords: Tuple[str, ...] = ()
+    # Columns always included in a pruned prompt
+    core_columns: Tuple[str, ...] = ()
+    notes: str = ""
+
+    @property
+    def column_names(self) -> List[str]:
+        return [column.name for column in self.columns]
+
+
+# Curated descriptions of the bundled datasets. They also serve as the
+# registry until (or unless) the catalog has been introspected; tables found
+# in the catalog but not listed here are described from their comments.
+DEFAULT_TABLES: Tuple[TableSchema, ...] = (
+    TableSchema(
+        name="cafes",
+        columns=(
+            ColumnSchema("id", "integer", "primary key"),
+            ColumnSchema("name", "text"),
+            ColumnSchema("geom", "geometry, SRID 4326 - Point"),
+            ColumnSchema("address", "text"),
+        ),
+        geometry_type="Point",
+        description="Coffee shops and cafes",
+        keywords=("cafe", "café", "coffee", "espresso", "קפה"),
+    ),
+    TableSchema(
+        name="parks",
+        columns=(
+            ColumnSchema("id", "integer", "primary key"),
+            ColumnSchema("name", "text"),
+            ColumnSchema("geom", "geometry, SRID 4326 - Polygon"),
+            ColumnSchema("area", "float", "in square meters"),
+        ),
+        geometry_type="Polygon",
+        description="Parks and green spaces",
+        keywords=("park", "garden", "green", "playground", "פארק", "גן", "גנים", "ירוק"),
+    ),
+    TableSchema(
+        name="roads",
+        columns=(
+            ColumnSchema("id", "integer", "primary key"),
+            ColumnSchema("name", "text"),
+            ColumnSchema("geom", "geometry, SRID 4326 - LineString"),
+            ColumnSchema("road_type", "text"),
+        ),
+        geometry_type="LineString",
+        description="Roads and streets",
+        keywords=("road", "street", "avenue", "highway", "boulevard", "כביש", "רחוב", "שדרה", "דרך"),
+    ),
+    TableSchema(
+        name="plans",
+        columns=(
+            ColumnSchema("id", "integer", "primary key"),
+            ColumnSchema("pl_number", "text", "plan number / מספר תכנית"),
+            ColumnSchema("pl_name", "text", "plan name / שם תכנית"),
+            ColumnSchema("pl_url", "text", "link to planning website / קישור לאתר מידע תכנוני"),
+            ColumnSchema("pl_area_dunam", "float", "plan area in dunams / שטח בדונם"),
+            ColumnSchema("quantity_delta_120", "float", "change in housing units / שינוי יחידות דיור"),
+            ColumnSchema("station_desc", "text", "status description / תיאור סטטוס"),
+            ColumnSchema("internet_short_status", "text", "current planning stage / שלב תכנוני"),
+            ColumnSchema("pl_date_advertise", "date", "newspaper publication date / תאריך פרסום בעיתונים"),
+            ColumnSchema("pl_date_8", "date", "official publication date / תאריך פרסום ברשומות"),
+            ColumnSchema("plan_county_name", "text", "settlement name / שם יישוב"),
+            ColumnSchema("pl_landuse_string", "text", "land use designation / ייעוד קרקע"),
+            ColumnSchema("geom", "geometry, SRID 4326 - Polygon", "plan boundaries / גבולות התכנית"),
+        ),
+        geometry_type="Polygon",
+        description="תכניות בניין עיר - Israeli Planning Data",
+        keywords=(
+            "plan", "planning", "zoning", "development", "construction", "building",
+            "approved", "תכנית", "תכניות", "תוכנית", "תוכניות", "תב״ע", "בניין",
+        ),
+        core_columns=(
+            "id", "pl_number", "pl_name", "station_desc", "internet_short_status",
+            "plan_county_name", "pl_landuse_string", "geom",
+        ),
+        notes="Use pl_name as the name column and include relevant planning fields "
+              "such as status and land use.",
+    ),
+)
+
+
+class SchemaRegistry:
+    """The tables SQL may be generated for, in a stable order"""
+
+    def __init__(self, tables: Sequence[TableSchema]):
+        self.tables: Dict[str, TableSchema] = {table.name: table for table in tables}
+        # Changes whenever a table, column or description changes
+        self.version = hashlib.sha256(repr(tuple(tables)).encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.tables)
+
+    def get(self, name: str) -> Optional[TableSchema]:
+        return self.tables.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tables
+
+
+# Spatial tables and their columns; generated columns (e.g. the geometry
+# LOD pyramid) are maintained by the database and never queried directly
+CATALOG_COLUMNS_SQL = """
+SELECT c.table_name, c.column_name, c.data_type, c.udt_name,
+       col_description(format('%I.%I', c.table_schema, c.table_name)::regclass,
+                       c.ordinal_position) AS column_comment,
+       obj_description(format('%I.%I', c.table_schema, c.table_name)::regclass,
+                       'pg_class') AS table_comment
+FROM information_schema.columns c
+JOIN information_schema.tables t
+  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE c.table_schema = 'public'
+  AND t.table_type = 'BASE TABLE'
+  AND c.is_generated = 'NEVER'
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+CATALOG_GEOMETRY_SQL = """
+SELECT f_table_name, f_geometry_column, type, srid
+FROM geometry_columns
+WHERE f_table_schema = 'public'
+"""
+
+
+def build_registry(
+    column_rows: Sequence[Tuple], geometry_rows: Sequence[Tuple]
+) -> SchemaRegistry:
+    """
+    Build a registry from catalog rows
+
+    Only tables with a geometry column are registered. Curated descriptions
+    in DEFAULT_TABLES take precedence over catalog comments; curated tables
+    come first, in their curated order, then the others by name.
+
+    Args:
+        column_rows: Rows of CATALOG_COLUMNS_SQL
+        geometry_rows: Rows of CATALOG_GEOMETRY_SQL
+
+    Returns:
+        SchemaRegistry of the spatial tables in the catalog
+    """
+    geometries: Dict[Tuple[str, str], Tuple[str, int]] = {
+        (table, column): (geometry_type, srid)
+        for table, column, geometry_type, srid in geometry_rows
+    }
+    spatial_tables = {table for table, _ in geometries}
+
+    columns: Dict[str, List[ColumnSchema]] = {}
+    comments: Dict[str, str] = {}
+    for table, column, data_type, udt_name, column_comment, table_comment in column_rows:
+        if table not in spatial_tables:
+            continue
+        if (table, column) in geometries:
+            geometry_type, srid = geometries[(table, column)]
+            data_type = f"geometry, SRID {srid} - {_geometry_name(geometry_type)}"
+        elif data_type == "USER-DEFINED":
+            data_type = udt_name
+        columns.setdefault(table, []).append(ColumnSchema(column, data_type, column_comment or ""))
+        comments[table] = table_comment or ""
+
+    curated = {table.name: table for table in DEFAULT_TABLES}
+    order = [name for name in curated if name in columns]
+    order += sorted(name for name in columns if name not in curated)
+
+    tables = []
+    for name in order:
+        known = curated.get(name)
+        known_columns = {column.name: column for column in known.columns} if known else {}
+        table_columns = tuple(
+            column._replace(
+                description=known_columns[column.name].description or column.description
+            )
+            if column.name in known_columns else column
+            for column in columns[name]
+        )
+        geometry_type = next(
+            (_geometry_name(geometries[(name, column.name)][0])
+             for column in columns[name] if (name, column.name) in geometries),
+            "Geometry"
+        )
+        if known:
+            tables.append(known._replace(columns=table_columns, geometry_type=geometry_type))
+        else:
+            tables.append(TableSchema(
+                name=name,
+                columns=table_columns,
+                geometry_type=geometry_type,
+                description=comments.get(name, ""),
+            ))
+    return SchemaRegistry(tables)
+
+
+def _geometry_name(geometry_type: str) -> str:
+    """'MULTIPOLYGON' -> 'MultiPolygon', as PostGIS spells geometry types elsewhere"""
+    names = {
+        "POINT": "Point", "LINESTRING": "LineString", "POLYGON": "Polygon",
+        "MULTIPOINT": "MultiPoint", "MULTILINESTRING": "MultiLineString",
+        "MULTIPOLYGON": "MultiPolygon", "GEOMETRYCOLLECTION": "GeometryCollection",
+    }
+    return names.get(geometry_type.upper(), "Geometry")
+
+
+# Singleton instance
+_schema_registry = None
+
+
+def get_schema_registry() -> SchemaRegistry:
+    """Get the current schema registry (the curated tables until introspected)"""
+    global _schema_registry
+    if _schema_registry is None:
+        _schema_registry = SchemaRegistry(DEFAULT_TABLES)
+    return _schema_registry
+
+
+def set_schema_registry(registry: SchemaRegistry) -> None:
+    """Replace the schema registry, e.g. after introspecting the catalog"""
+    global _schema_registry
+    _schema_registry = registry
+    logger.info(f"Schema registry: {', '.join(registry.names)} (version {registry.version})")
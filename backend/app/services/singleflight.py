@@ -0,0 +1,102 @@
+"""Single-flight coalescing of concurrent identical operations"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+from typing import Any, Callable, Coroutine, Dict, Optional, TypeVar
+
+from app.services.deadline import Deadline, current_deadline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight operation
+
+    The first caller for a key starts the operation as a task; callers that
+    arrive while it is running await the same task. The operation runs
+    detached from any one caller, so a caller that is cancelled (e.g. a client
+    disconnect) does not fail the others; once every caller has gone away the
+    operation itself is cancelled.
+
+    The operation gets its own deadline rather than the first caller's: it
+    is extended to the latest deadline of the callers waiting on it, while
+    each caller still gives up at its own deadline. An operation started
+    without a deadline keeps running without one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._deadlines: Dict[str, Optional[Deadline]] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        """
+        Run fn once for all concurrent callers with the same key
+
+        Args:
+            key: Coalescing key
+            fn: Zero-argument coroutine function producing the result
+
+        Returns:
+            The shared result; exceptions are raised to every waiter
+        """
+        deadline = current_deadline.get()
+        task = self._inflight.get(key)
+        if task is None:
+            shared = None
+            if deadline is not None:
+                shared = Deadline(deadline.timeout)
+                shared.expires_at = deadline.expires_at
+            context = contextvars.copy_context()
+            context.run(current_deadline.set, shared)
+            task = asyncio.get_running_loop().create_task(fn(), context=context)
+            self._inflight[key] = task
+            self._deadlines[key] = shared
+            task.add_done_callback(functools.partial(self._done, key))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"{self.name}: coalesced request onto in-flight operation")
+            shared = self._deadlines[key]
+            if shared is not None and deadline is not None:
+                shared.expires_at = max(shared.expires_at, deadline.expires_at)
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                logger.info(f"{self.name}: all callers gone, cancelling operation")
+                self.abandoned += 1
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._deadlines[key]
+        # Mark the exception as retrieved when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return coalescing counters"""
+        return {
+            "in_flight": len(self._inflight),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
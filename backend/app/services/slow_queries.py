@@ -0,0 +1,159 @@
+"""Slow-query log and plan-shape tracking per SQL fingerprint"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from app.services.metrics import PLAN_FLIPS, SLOW_QUERIES
+from app.services.sql_utils import fingerprint_sql
+
+logger = logging.getLogger(__name__)
+
+# Question the current request's SQL was generated for (None outside a question)
+current_question: ContextVar[Optional[str]] = ContextVar("current_question", default=None)
+
+
+def plan_shape(node: Dict[str, Any]) -> str:
+    """
+    Structure of an EXPLAIN plan: node types with the relations and indexes
+    they read, without costs, estimates or timings
+
+    e.g. "Nested Loop(Seq Scan[parks], Index Scan[cafes_geom_idx])"
+    """
+    label: str = node["Node Type"]
+    target = node.get("Index Name") or node.get("Relation Name")
+    if target:
+        label += f"[{target}]"
+    children = node.get("Plans") or []
+    if children:
+        label += "(" + ", ".join(plan_shape(child) for child in children) + ")"
+    return label
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of slow executions and the last plan shape per SQL fingerprint
+
+    Entries are dicts so the plan captured afterwards can be attached to
+    them. At most `capture_concurrency` plans are captured at a time, and a
+    fingerprint is captured again only after `capture_interval` seconds.
+    The `max_fingerprints` most recently planned shapes are kept; a shape
+    differing from the previous one for the same SQL is a plan flip.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_fingerprints: int,
+        capture_interval: float,
+        capture_concurrency: int
+    ):
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.flips: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.max_fingerprints = max_fingerprints
+        self.capture_interval = capture_interval
+        self.capture_concurrency = capture_concurrency
+        self._shapes: "OrderedDict[str, str]" = OrderedDict()
+        self._captured_at: "OrderedDict[str, float]" = OrderedDict()
+        self.capturing = 0
+        self.counts = {
+            "slow": 0, "captured": 0, "capture_skipped": 0, "capture_failed": 0, "plan_flips": 0,
+        }
+
+    def record(self, sql: str, elapsed: float, rows: int) -> Dict[str, Any]:
+        """Log a slow execution and return its entry"""
+        self.counts["slow"] += 1
+        SLOW_QUERIES.inc()
+        entry = {
+            "at": time.time(),
+            "fingerprint": fingerprint_sql(sql),
+            "question": current_question.get(),
+            "sql": sql,
+            "execution_ms": round(elapsed * 1000, 1),
+            "rows": rows,
+            "capture": "pending",
+            "plan": None,
+        }
+        self.entries.append(entry)
+        logger.warning(
+            f"Slow query {entry['fingerprint']}: {entry['execution_ms']:.0f} ms, "
+            f"{rows} rows: {sql[:200]}"
+        )
+        return entry
+
+    def start_capture(self, entry: Dict[str, Any]) -> bool:
+        """Claim a capture slot for an entry's plan (False if it should be skipped)"""
+        fingerprint = entry["fingerprint"]
+        captured_at = self._captured_at.get(fingerprint)
+        if captured_at is not None and time.monotonic() - captured_at < self.capture_interval:
+            entry["capture"] = "skipped: captured recently"
+        elif self.capturing >= self.capture_concurrency:
+            entry["capture"] = "skipped: capture busy"
+        else:
+            self.capturing += 1
+            self._captured_at[fingerprint] = time.monotonic()
+            self._captured_at.move_to_end(fingerprint)
+            if len(self._captured_at) > self.max_fingerprints:
+                self._captured_at.popitem(last=False)
+            return True
+        self.counts["capture_skipped"] += 1
+        return False
+
+    def finish_capture(
+        self,
+        entry: Dict[str, Any],
+        explained: Optional[Dict[str, Any]],
+        error: Optional[str] = None
+    ) -> None:
+        """Attach an EXPLAIN ANALYZE result (or the reason it failed) to an entry"""
+        self.capturing -= 1
+        if explained is None:
+            self.counts["capture_failed"] += 1
+            entry["capture"] = f"failed: {error}"
+            return
+        self.counts["captured"] += 1
+        entry["capture"] = "captured"
+        entry["plan"] = explained
+        self.observe_plan(entry["sql"], explained["Plan"])
+
+    def observe_plan(self, sql: str, plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Remember the shape of a plan for its SQL and report a change of shape
+
+        Returns:
+            The flip record if the shape differs from the last one seen, else None
+        """
+        fingerprint = fingerprint_sql(sql)
+        shape = plan_shape(plan)
+        previous = self._shapes.get(fingerprint)
+        self._shapes[fingerprint] = shape
+        self._shapes.move_to_end(fingerprint)
+        if len(self._shapes) > self.max_fingerprints:
+            self._shapes.popitem(last=False)
+
+        if previous is None or previous == shape:
+            return None
+        flip = {
+            "at": time.time(),
+            "fingerprint": fingerprint,
+            "sql": sql,
+            "before": previous,
+            "after": shape,
+        }
+        self.flips.append(flip)
+        self.counts["plan_flips"] += 1
+        PLAN_FLIPS.inc()
+        logger.warning(f"Plan flip for {fingerprint}: {previous} -> {shape}")
+        return flip
+
+    def snapshot(self, limit: int) -> Dict[str, List[Dict[str, Any]]]:
+        """Most recent slow queries and plan flips, newest first"""
+        return {
+            "slow_queries": list(reversed(self.entries))[:limit],
+            "plan_flips": list(reversed(self.flips))[:limit],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, "fingerprints": len(self._shapes)}
@@ -0,0 +1,382 @@
+"""Index-aware rewriting of generated PostGIS SQL"""
+
+import logging
+from functools import lru_cache
+from typing import List, Optional, Sequence, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from app.services.sql_utils import TRACKED_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Names of the rewrites, as reported in query responses
+BBOX_PREFILTER = "bbox_prefilter"
+KNN_ORDER_BY = "knn_order_by"
+EXISTS_SEMIJOIN = "exists_semijoin"
+
+# Lower bounds on the length of one degree in meters, over both the WGS84
+# spheroid and the mean-radius sphere: a degree of latitude is never shorter
+# than 110574 m and a degree of longitude never shorter than
+# 111195 m * cos(latitude). Envelopes built from them cannot miss a match.
+METERS_PER_DEGREE_LAT = 110574.0
+METERS_PER_DEGREE_LON = 111195.0
+
+# Head-room for rounding differences between the envelope and ST_DWithin
+ENVELOPE_MARGIN = 1.001
+
+# Primary key of every tracked table
+PRIMARY_KEY_COLUMN = "id"
+
+# Functions whose value can differ between calls on the same row
+_VOLATILE_FUNCTIONS = {"random", "clock_timestamp", "nextval", "gen_random_uuid"}
+
+
+def rewrite_sql(sql: str) -> Tuple[str, List[str]]:
+    """
+    Rewrite generated SQL so PostGIS can use the spatial (GiST) indexes
+
+    - `ST_DWithin(a::geography, b::geography, d)` gets a bounding-box
+      prefilter `a && ST_Expand(b, dx, dy)` whose envelope is wide enough to
+      contain every match, so the index narrows the candidates and the exact
+      geography predicate still decides.
+    - `ORDER BY ST_Distance(a, b) ... LIMIT n` on geometry becomes the KNN
+      operator `a <-> b`, which returns the same distance.
+    - `SELECT DISTINCT o.id, ... FROM o, i WHERE ...` selecting only columns
+      of `o` (including its primary key) becomes a semijoin
+      `FROM o WHERE EXISTS (SELECT 1 FROM i WHERE ...)`.
+
+    Each rewrite only fires when the result is provably unchanged. SQL that
+    cannot be parsed, or that nothing applies to, is returned untouched.
+
+    Args:
+        sql: Validated SQL query
+
+    Returns:
+        Tuple of (SQL to execute, names of the rewrites applied)
+    """
+    rewritten, rewrites = _rewrite(sql)
+    return rewritten, list(rewrites)
+
+
+@lru_cache(maxsize=1024)
+def _rewrite(sql: str) -> Tuple[str, Tuple[str, ...]]:
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except SqlglotError as e:
+        logger.debug(f"Not rewriting SQL that sqlglot cannot parse: {e}")
+        return sql, ()
+
+    rewrites: List[str] = []
+    # Semijoins first, so the prefilter pass sees the new EXISTS subqueries
+    for select in list(tree.find_all(exp.Select)):
+        if _exists_semijoin(select):
+            rewrites.append(EXISTS_SEMIJOIN)
+    for select in list(tree.find_all(exp.Select)):
+        rewrites.extend([BBOX_PREFILTER] * _bbox_prefilters(select))
+        if _knn_order_by(select):
+            rewrites.append(KNN_ORDER_BY)
+
+    if not rewrites:
+        return sql, ()
+    return tree.sql(dialect="postgres"), tuple(rewrites)
+
+
+def _call_args(node: exp.Expr, name: str) -> Optional[List[exp.Expr]]:
+    """Arguments of a call to function `name`, or None if `node` is not one"""
+    if isinstance(node, exp.Anonymous):
+        return list(node.expressions) if node.name.lower() == name else None
+    if isinstance(node, exp.Func) and node.sql_name().lower() == name:
+        return [arg for arg in node.args.values() if isinstance(arg, exp.Expression)]
+    return None
+
+
+def _geography_operand(node: exp.Expr) -> Optional[exp.Expr]:
+    """The geometry inside a `geometry::geography` cast, or None"""
+    if isinstance(node, exp.Cast) and node.to.is_type("geography"):
+        operand: exp.Expr = node.this
+        return operand
+    return None
+
+
+def _conjuncts(condition: exp.Expr) -> List[exp.Expr]:
+    return list(condition.flatten()) if isinstance(condition, exp.And) else [condition]
+
+
+# ---------------------------------------------------------------------------
+# Bounding-box prefilters
+# ---------------------------------------------------------------------------
+
+def _bbox_prefilters(select: exp.Select) -> int:
+    """Add `&&` prefilters to the WHERE and JOIN ... ON conditions of a SELECT"""
+    count = 0
+    local_aliases = _local_aliases(select)
+    where = select.args.get("where")
+    if where is not None:
+        condition, added = _with_prefilters(where.this, local_aliases)
+        if added:
+            where.set("this", condition)
+            count += added
+    for join in select.args.get("joins") or []:
+        on = join.args.get("on")
+        if on is not None:
+            condition, added = _with_prefilters(on, local_aliases)
+            if added:
+                join.set("on", condition)
+                count += added
+    return count
+
+
+def _local_aliases(select: exp.Select) -> Set[str]:
+    """Aliases of the tables in a SELECT's own FROM and JOIN clauses"""
+    from_ = select.args.get("from_")
+    sources = [from_.this] if from_ is not None else []
+    sources += [join.this for join in select.args.get("joins") or []]
+    return {source.alias_or_name for source in sources if isinstance(source, exp.Table)}
+
+
+def _with_prefilters(
+    condition: exp.Expr, local_aliases: Set[str]
+) -> Tuple[exp.Expr, int]:
+    """
+    Insert a prefilter ahead of every top-level geography ST_DWithin conjunct
+
+    The prefilter is implied by the predicate it guards, so AND-ing it in
+    never changes the condition. Predicates under OR/NOT are left alone.
+    """
+    conjuncts = _conjuncts(condition)
+    existing = {
+        c.this.sql(dialect="postgres") for c in conjuncts if isinstance(c, exp.ArrayOverlaps)
+    }
+    rewritten: List[exp.Expr] = []
+    added = 0
+    for conjunct in conjuncts:
+        prefilter = _dwithin_prefilter(conjunct.unnest(), local_aliases)
+        if prefilter is not None and prefilter.this.sql(dialect="postgres") not in existing:
+            rewritten.append(prefilter)
+            added += 1
+        rewritten.append(conjunct.copy())
+    if not added:
+        return condition, 0
+    return exp.and_(*rewritten), added
+
+
+def _dwithin_prefilter(node: exp.Expr, local_aliases: Set[str]) -> Optional[exp.Expr]:
+    """
+    `a && ST_Expand(b, dx, dy)` for `ST_DWithin(a::geography, b::geography, d)`
+
+    `a` is the column scanned through its index, preferably one of the
+    query's own tables rather than a correlated outer one.
+    """
+    args = _call_args(node, "st_dwithin")
+    if args is None or len(args) not in (3, 4):
+        return None
+    first, second = _geography_operand(args[0]), _geography_operand(args[1])
+    distance = args[2]
+    if first is None or second is None:
+        return None
+    if not isinstance(distance, exp.Literal) or distance.is_string:
+        return None
+
+    # The indexed side must be a bare column; the other side is expanded
+    if not _is_local_column(first, local_aliases) and _is_local_column(second, local_aliases):
+        first, second = second, first
+    elif not isinstance(first, exp.Column):
+        first, second = second, first
+    if not isinstance(first, exp.Column) or isinstance(second, exp.Literal):
+        return None
+
+    meters = float(distance.name) * ENVELOPE_MARGIN
+    if meters < 0:
+        return None
+    other = second.sql(dialect="postgres")
+    dy = meters / METERS_PER_DEGREE_LAT
+    # A degree of longitude is shortest at the highest latitude a match can
+    # reach: the far edge of `other`'s box plus the latitude margin
+    latitude = f"LEAST(90, GREATEST(ABS(ST_YMin({other})), ABS(ST_YMax({other}))) + {dy!r})"
+    dx = f"{meters / METERS_PER_DEGREE_LON!r} / COS(RADIANS({latitude}))"
+    return sqlglot.parse_one(
+        f"{first.sql(dialect='postgres')} && ST_Expand({other}, {dx}, {dy!r})", read="postgres"
+    )
+
+
+def _is_local_column(node: exp.Expr, local_aliases: Set[str]) -> bool:
+    return isinstance(node, exp.Column) and (not node.table or node.table in local_aliases)
+
+
+# ---------------------------------------------------------------------------
+# KNN ORDER BY
+# ---------------------------------------------------------------------------
+
+def _knn_order_by(select: exp.Select) -> bool:
+    """
+    Turn a leading `ORDER BY ST_Distance(a, b)` into `ORDER BY a <-> b`
+
+    For geometry, `<->` is the true distance (PostGIS 2.2+) and can be
+    answered from the GiST index when the query has a LIMIT. Geography
+    distances are left alone: `<->` on geography measures on the sphere and
+    would not order exactly like ST_Distance on the spheroid.
+    """
+    order = select.args.get("order")
+    if order is None or select.args.get("limit") is None or not order.expressions:
+        return False
+    ordered = order.expressions[0]
+    if ordered.args.get("desc"):
+        return False
+    args = _call_args(ordered.this, "st_distance")
+    if args is None or len(args) != 2:
+        return False
+    if any(_geography_operand(arg) is not None for arg in args):
+        return False
+    if not any(isinstance(arg, exp.Column) for arg in args):
+        return False
+    ordered.set("this", exp.Distance(this=args[0].copy(), expression=args[1].copy()))
+    return True
+
+
+# ---------------------------------------------------------------------------
+# EXISTS semijoins
+# ---------------------------------------------------------------------------
+
+def _exists_semijoin(select: exp.Select) -> bool:
+    """
+    Replace a comma join + DISTINCT with an EXISTS semijoin
+
+    Only applies when every output column comes from the outer table and its
+    primary key is among them: each outer row then produces exactly one
+    distinct output row either way, so dropping DISTINCT and the join
+    returns the same rows without building and deduplicating the product.
+    """
+    tables = _semijoin_tables(select)
+    if tables is None:
+        return False
+    _, inner = tables
+    inner_alias = inner.alias_or_name
+
+    where = select.args.get("where")
+    outer_conditions: List[exp.Expr] = []
+    inner_conditions: List[exp.Expr] = []
+    for conjunct in _conjuncts(where.this) if where is not None else []:
+        aliases = _referenced_aliases(conjunct, select)
+        if aliases is None:
+            return False
+        if inner_alias in aliases:
+            inner_conditions.append(conjunct)
+        else:
+            outer_conditions.append(conjunct)
+
+    subquery = exp.select("1").from_(inner.copy())
+    if inner_conditions:
+        subquery = subquery.where(exp.and_(*[c.copy() for c in inner_conditions]))
+    conditions = [c.copy() for c in outer_conditions] + [exp.Exists(this=subquery)]
+
+    select.set("distinct", None)
+    select.set("joins", None)
+    select.set("where", exp.Where(this=exp.and_(*conditions)))
+    return True
+
+
+def _semijoin_tables(select: exp.Select) -> Optional[Tuple[exp.Table, exp.Table]]:
+    """The (outer, inner) tables of a DISTINCT comma join eligible for a semijoin, if any"""
+    distinct = select.args.get("distinct")
+    if distinct is None or distinct.args.get("on") is not None:
+        return None
+    if any(select.args.get(key) for key in ("group", "having", "qualify", "windows")):
+        return None
+
+    from_ = select.args.get("from_")
+    joins = select.args.get("joins") or []
+    if from_ is None or len(joins) != 1 or not _is_comma_join(joins[0]):
+        return None
+    outer, inner = from_.this, joins[0].this
+    if not isinstance(outer, exp.Table) or not isinstance(inner, exp.Table):
+        return None
+    if outer.name.lower() not in TRACKED_TABLES or outer.args.get("db"):
+        return None
+    outer_alias, inner_alias = outer.alias_or_name, inner.alias_or_name
+    if outer_alias == inner_alias:
+        return None
+
+    if not _outer_only_projections(select, outer_alias):
+        return None
+    if not _outer_only_ordering(select, outer_alias):
+        return None
+    return outer, inner
+
+
+def _is_comma_join(join: exp.Join) -> bool:
+    """Whether a join is a plain cross product (`FROM a, b` / CROSS JOIN)"""
+    kind = (join.args.get("kind") or "").upper()
+    return (
+        kind in ("", "CROSS")
+        and not join.args.get("side")
+        and not join.args.get("method")
+        and join.args.get("on") is None
+        and not join.args.get("using")
+    )
+
+
+def _referenced_aliases(node: exp.Expr, select: exp.Select) -> Optional[Set[str]]:
+    """
+    Table aliases a condition of `select` refers to
+
+    Returns None if a column of `select` itself is unqualified, since it
+    could belong to either table. Unqualified columns inside nested
+    subqueries belong to those subqueries.
+    """
+    aliases: Set[str] = set()
+    for column in node.find_all(exp.Column):
+        if column.table:
+            aliases.add(column.table)
+        elif column.find_ancestor(exp.Select) is select:
+            return None
+    return aliases
+
+
+def _is_plain_expression(node: exp.Expr) -> bool:
+    """No aggregates, window functions, subqueries or volatile functions"""
+    if node.find(exp.AggFunc, exp.Window, exp.Select, exp.Subquery):
+        return False
+    for call in node.find_all(exp.Anonymous, exp.Func):
+        name = call.name if isinstance(call, exp.Anonymous) else call.sql_name()
+        if name.lower() in _VOLATILE_FUNCTIONS:
+            return False
+    return True
+
+
+def _outer_only_projections(select: exp.Select, outer_alias: str) -> bool:
+    """Every output column reads only the outer table, and its key is one of them"""
+    has_key = False
+    for projection in select.expressions:
+        if not _is_plain_expression(projection):
+            return False
+        columns = list(projection.find_all(exp.Column))
+        if isinstance(projection, exp.Star):
+            return False
+        if any(column.table != outer_alias for column in columns):
+            return False
+        value = projection.unalias()
+        if isinstance(value, exp.Column) and (
+            isinstance(value.this, exp.Star) or value.name == PRIMARY_KEY_COLUMN
+        ):
+            has_key = True
+    return has_key
+
+
+def _outer_only_ordering(select: exp.Select, outer_alias: str) -> bool:
+    """ORDER BY reads only the outer table or output column names"""
+    order = select.args.get("order")
+    if order is None:
+        return True
+    output_names: Sequence[str] = select.named_selects
+    for ordered in order.expressions:
+        if not _is_plain_expression(ordered):
+            return False
+        for column in ordered.find_all(exp.Column):
+            if column.table != outer_alias and not (
+                not column.table and column.name in output_names
+            ):
+                return False
+    return True
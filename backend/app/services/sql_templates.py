@@ -0,0 +1,160 @@
+"""Parameterized SQL templates and template-level execution statistics"""
+
+import logging
+import re
+from collections import OrderedDict
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+logger = logging.getLogger(__name__)
+
+# Bind parameter names are PARAMETER_PREFIX + position (":p1", ":p2", ...)
+PARAMETER_PREFIX = "p"
+
+_NUMBER = re.compile(r"^(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+# Clauses whose literals vary between otherwise identical questions
+_FILTER_CLAUSES = (exp.Where, exp.Join, exp.Having)
+
+# Literals that are part of the query's shape rather than its arguments
+_STRUCTURAL = (
+    exp.Select, exp.Limit, exp.Offset, exp.Fetch, exp.Ordered, exp.Group, exp.DataType, exp.Interval
+)
+
+_INT4_MAX = 2 ** 31 - 1
+_INT8_MAX = 2 ** 63 - 1
+
+
+def parameterize_sql(sql: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Extract the numeric literals of a query's filters into bind parameters
+
+    `WHERE area > 5000` and `WHERE area > 8000` both become
+    `WHERE area > CAST(:p1 AS INTEGER)`, so they share one server-side
+    prepared statement. Each placeholder is cast to the type PostgreSQL
+    gives the literal itself (integer, bigint or numeric), so operator and
+    function resolution, and therefore index use, are unchanged.
+
+    Only numbers in WHERE, JOIN ... ON and HAVING are extracted: select-list
+    constants, ORDER BY / GROUP BY positions, LIMIT / OFFSET and type
+    modifiers stay part of the template. String literals are left in place
+    because their type comes from context (a date, a text column, ...) and
+    the driver needs a value of that exact type. The literals are replaced
+    in the original text, so the rest of the query is byte-for-byte as
+    generated.
+
+    Args:
+        sql: Validated SQL query
+
+    Returns:
+        Tuple of (template, parameters); the query itself and no parameters
+        if it has nothing to extract or cannot be parsed
+    """
+    template, values = _parameterize(sql)
+    return template, {f"{PARAMETER_PREFIX}{i}": value for i, value in enumerate(values, 1)}
+
+
+@lru_cache(maxsize=1024)
+def _parameterize(sql: str) -> Tuple[str, Tuple[Any, ...]]:
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except SqlglotError as e:
+        logger.debug(f"Not parameterizing SQL that sqlglot cannot parse: {e}")
+        return sql, ()
+
+    spans = []
+    for literal in tree.find_all(exp.Literal):
+        if literal.is_string or not _NUMBER.match(literal.this):
+            continue
+        if not isinstance(literal.find_ancestor(*_FILTER_CLAUSES, *_STRUCTURAL), _FILTER_CLAUSES):
+            continue
+        start, end = literal.meta.get("start"), literal.meta.get("end")
+        if start is None or end is None or sql[start:end + 1] != literal.this:
+            continue
+        spans.append((start, end + 1, literal.this))
+
+    if not spans:
+        return sql, ()
+
+    parts: List[str] = []
+    values: List[Any] = []
+    position = 0
+    for start, end, number in sorted(spans):
+        value, type_name = _number_value(number)
+        values.append(value)
+        parts.append(sql[position:start])
+        parts.append(f"CAST(:{PARAMETER_PREFIX}{len(values)} AS {type_name})")
+        position = end
+    parts.append(sql[position:])
+    return "".join(parts), tuple(values)
+
+
+def _number_value(number: str) -> Tuple[Any, str]:
+    """Python value and PostgreSQL type of a numeric literal, as the server would type it"""
+    if number.isdigit():
+        value = int(number)
+        if value <= _INT4_MAX:
+            return value, "INTEGER"
+        if value <= _INT8_MAX:
+            return value, "BIGINT"
+    return Decimal(number), "NUMERIC"
+
+
+class TemplateStats:
+    """
+    Execution counts and timings per SQL template
+
+    Keeps the `max_templates` most recently executed templates. Distinct
+    parameter sets are counted up to `max_distinct` per template.
+    """
+
+    def __init__(self, max_templates: int, max_distinct: int = 1000):
+        self.max_templates = max_templates
+        self.max_distinct = max_distinct
+        self._templates: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.executions = 0
+        self.parameterized = 0
+
+    def record(self, template: str, params: Mapping[str, Any], elapsed: float) -> None:
+        """Record one execution of a template"""
+        self.executions += 1
+        if params:
+            self.parameterized += 1
+
+        entry = self._templates.get(template)
+        if entry is None:
+            entry = {"executions": 0, "total_seconds": 0.0, "params": set()}
+            self._templates[template] = entry
+            if len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        else:
+            self._templates.move_to_end(template)
+
+        entry["executions"] += 1
+        entry["total_seconds"] += elapsed
+        if len(entry["params"]) < self.max_distinct:
+            entry["params"].add(tuple(params.values()))
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        busiest = sorted(
+            self._templates.items(), key=lambda item: -item[1]["executions"]
+        )[:top]
+        return {
+            "executions": self.executions,
+            "parameterized": self.parameterized,
+            "templates": len(self._templates),
+            "top": [
+                {
+                    "template": template[:200],
+                    "executions": entry["executions"],
+                    "distinct_params": len(entry["params"]),
+                    "mean_ms": round(entry["total_seconds"] / entry["executions"] * 1000, 2),
+                }
+                for template, entry in busiest
+            ],
+        }
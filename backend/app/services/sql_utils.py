@@ -0,0 +1,503 @@
+"""Helpers for canonicalizing and inspecting generated SQL"""
+
+import hashlib
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Spatial tables whose contents can change underneath cached results
+TRACKED_TABLES = ("cafes", "parks", "roads", "plans")
+
+# Single-quoted literals (with '' escapes) or double-quoted identifiers
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION_SPACING = re.compile(r"\s*([(),=<>+*/-])\s*")
+_IDENTIFIER = re.compile(r"[a-z_][a-z0-9_]*")
+# Relation (optionally schema-qualified) read by a FROM/JOIN; a following
+# parenthesis marks a function call such as generate_series(...)
+_FROM_TARGET = re.compile(
+    r"\b(?:from|join)\s+([a-z_][a-z0-9_]*(?:\.[a-z_][a-z0-9_]*)?)\s*(\()?"
+)
+# Precomputed level-of-detail geometries (init-data/06-geometry-lod.sql), read
+# only through geometry_detail_sql and never returned as result columns
+_LOD_COLUMN = re.compile(r"geom_lod\d+")
+_CTE_NAME = re.compile(r"(?:\bwith(?:\s+recursive)?|,)\s*([a-z_][a-z0-9_]*)\s+as\s*\(")
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Return a canonical form of a SQL statement
+
+    Lowercases and collapses whitespace outside quoted literals/identifiers
+    and strips the trailing semicolon, so formatting differences between
+    otherwise identical generations map to the same string.
+
+    Args:
+        sql: SQL query string
+
+    Returns:
+        Canonical SQL string
+    """
+    parts = _QUOTED.split(strip_statement(sql))
+    canonical = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            canonical.append(part)
+        else:
+            part = _WHITESPACE.sub(" ", part.lower())
+            canonical.append(_PUNCTUATION_SPACING.sub(r"\1", part))
+    return "".join(canonical).strip()
+
+
+def fingerprint_sql(sql: str) -> str:
+    """Return a short stable hash of the canonical SQL"""
+    return hashlib.sha256(canonicalize_sql(sql).encode("utf-8")).hexdigest()[:16]
+
+
+def referenced_tables(sql: str, tables: Sequence[str] = TRACKED_TABLES) -> List[str]:
+    """
+    Return the tracked tables a query reads from
+
+    Identifiers inside quoted literals are ignored. When no tracked table is
+    recognized the query is conservatively treated as depending on all of them.
+    """
+    unquoted = " ".join(_QUOTED.split(sql.lower())[::2])
+    identifiers = set(_IDENTIFIER.findall(unquoted))
+    found = [table for table in tables if table in identifiers]
+    return found or list(tables)
+
+
+def untracked_tables(
+    sql: str, known: Sequence[str] = (), tables: Sequence[str] = TRACKED_TABLES
+) -> List[str]:
+    """
+    Return the relations a query reads that have no version tracking
+
+    Relations named after FROM/JOIN (other than CTEs and set-returning
+    function calls) count, as do identifiers naming any of the `known`
+    relations, which catches comma joins. Results of such queries cannot be
+    invalidated by table version bumps.
+    """
+    unquoted = " ".join(_QUOTED.split(sql.lower())[::2])
+    ctes = set(_CTE_NAME.findall(unquoted))
+    found = {
+        name.removeprefix("public.") for name, call in _FROM_TARGET.findall(unquoted)
+        if not call and name not in ctes
+    }
+    identifiers = set(_IDENTIFIER.findall(unquoted))
+    found.update(name for name in known if name.lower() in identifiers)
+    return sorted(name for name in found if name not in tables)
+
+
+def is_lod_column(name: str) -> bool:
+    """Whether a result column is one of the generated geom_lod<N> columns"""
+    return _LOD_COLUMN.fullmatch(name.lower()) is not None
+
+
+def sql_literal(value: Any) -> str:
+    """Render an int/float/str value as a safe SQL literal"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"Unsupported literal type: {type(value).__name__}")
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+_DOLLAR_QUOTE = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)?\$")
+
+
+def strip_statement(sql: str) -> str:
+    """
+    Remove surrounding whitespace, trailing comments and the trailing semicolon
+
+    Callers append to or wrap the result, which a trailing `--` comment would
+    otherwise swallow.
+    """
+    statement = _without_trailing_comments(sql).rstrip().rstrip(";")
+    return _without_trailing_comments(statement).strip()
+
+
+def _without_trailing_comments(sql: str) -> str:
+    """The SQL up to the end of its last token that is not in a comment"""
+    end = i = 0
+    while i < len(sql):
+        skipped = _skip_quoted(sql, i)
+        is_comment = sql.startswith(("--", "/*"), i)
+        if skipped is None:
+            if not sql[i].isspace():
+                end = i + 1
+            i += 1
+        elif skipped < 0:
+            if not is_comment:
+                end = len(sql)
+            break
+        else:
+            if not is_comment:
+                end = skipped
+            i = skipped
+    return sql[:end]
+
+
+def _skip_quoted(text: str, i: int) -> Optional[int]:
+    """
+    The index just past a string, quoted identifier or comment starting at `i`
+
+    Returns None if none starts there and -1 if it is not terminated yet.
+    """
+    char = text[i]
+    if char in ("'", '"'):
+        # Doubled quotes are escapes; scanning on past them is equivalent
+        opener = closer = char
+    elif text.startswith("--", i):
+        opener, closer = "--", "\n"
+    elif text.startswith("/*", i):
+        opener, closer = "/*", "*/"
+    elif char == "$" and (match := _DOLLAR_QUOTE.match(text, i)):
+        opener = closer = match.group(0)
+    else:
+        return None
+    end = text.find(closer, i + len(opener))
+    return -1 if end < 0 else end + len(closer)
+
+
+_CODE_FENCE = "```"
+
+
+def complete_statement(text: str, final: bool = False) -> Optional[str]:
+    """
+    Return the first complete statement of partially generated SQL
+
+    Used while the LLM output is still streaming: a statement is complete
+    at its first top-level semicolon (not inside a string, quoted
+    identifier, dollar quote or comment) or at the closing markdown code
+    fence. A leading ```sql fence is dropped.
+
+    Args:
+        text: LLM output received so far
+        final: The output is complete; return what there is even without
+            a terminator
+
+    Returns:
+        The statement including its semicolon, or None while incomplete
+    """
+    start = 0
+    stripped = text.lstrip()
+    if stripped.startswith(_CODE_FENCE):
+        newline = stripped.find("\n")
+        text, start = stripped, newline + 1 if newline >= 0 else len(stripped)
+
+    statement = _first_statement(text, start)
+    if statement is None and final:
+        statement = text[start:].strip()
+    return statement or None
+
+
+def _first_statement(text: str, start: int) -> Optional[str]:
+    """The text from `start` to the first top-level terminator, if there is one yet"""
+    i, length = start, len(text)
+    while i < length:
+        skipped = _skip_quoted(text, i)
+        if skipped is not None:
+            if skipped < 0:
+                return None
+            i = skipped
+        elif text[i] == ";":
+            return text[start:i + 1].strip()
+        elif text.startswith(_CODE_FENCE, i):
+            return text[start:i].strip()
+        else:
+            i += 1
+    return None
+
+
+def keyset_page_sql(sql: str, key_column: str, after: Optional[Any], limit: int) -> str:
+    """
+    Wrap a query to fetch one keyset page ordered by key_column
+
+    Args:
+        sql: Validated SQL query string
+        key_column: Column to page on (must be a plain identifier)
+        after: Last key of the previous page, or None for the first page
+        limit: Maximum rows to fetch
+
+    Returns:
+        SQL selecting rows with key_column > after, ordered by key_column
+    """
+    if not _IDENTIFIER.fullmatch(key_column):
+        raise ValueError(f"Invalid key column: {key_column}")
+    where = "" if after is None else f" WHERE _page.{key_column} > {sql_literal(after)}"
+    return (
+        f"SELECT * FROM ({strip_statement(sql)}) AS _page{where} "
+        f"ORDER BY _page.{key_column} LIMIT {int(limit)}"
+    )
+
+
+_TRAILING_LIMIT = re.compile(
+    r"\bLIMIT\s+(\d+|ALL)(\s+OFFSET\s+\d+)?$", re.IGNORECASE
+)
+_FETCH_FIRST = re.compile(r"\bFETCH\s+(FIRST|NEXT)\b", re.IGNORECASE)
+
+
+def apply_row_limit(sql: str, limit: int) -> str:
+    """
+    Inject or clamp the top-level LIMIT of a SELECT
+
+    An existing trailing LIMIT is lowered to `limit` if it is larger; a query
+    without one gets `LIMIT limit` appended. Queries using FETCH FIRST are
+    wrapped in a limited subquery instead.
+
+    Args:
+        sql: Validated SQL query string
+        limit: Maximum number of rows the query may return
+
+    Returns:
+        SQL returning at most `limit` rows
+    """
+    statement = strip_statement(sql)
+    match = _TRAILING_LIMIT.search(statement)
+    if match:
+        current = match.group(1)
+        if current.upper() != "ALL" and int(current) <= limit:
+            return statement
+        return f"{statement[:match.start(1)]}{int(limit)}{match.group(2) or ''}"
+
+    if _FETCH_FIRST.search(statement):
+        return f"SELECT * FROM ({statement}) AS _limited LIMIT {int(limit)}"
+
+    return f"{statement} LIMIT {int(limit)}"
+
+
+def spatial_preview_sql(sql: str, limit: int, grid_size: int) -> str:
+    """
+    Wrap a query to return a spatially stratified sample instead of the first rows
+
+    Features are bucketed into a grid_size x grid_size grid over the extent of
+    the result (by the centroid of their `geojson` geometry) and returned
+    round-robin across cells, so a truncated map still covers the whole area.
+
+    Args:
+        sql: Validated SQL query string with a `geojson` column
+        limit: Maximum number of rows to return
+        grid_size: Number of grid cells per axis
+
+    Returns:
+        SQL returning at most `limit` rows spread across the result extent
+    """
+    centroid = "ST_Centroid(ST_GeomFromGeoJSON(_q.geojson))"
+    n = int(grid_size)
+    width = "GREATEST(ST_XMax(_e.ext) - ST_XMin(_e.ext), 1e-9)"
+    height = "GREATEST(ST_YMax(_e.ext) - ST_YMin(_e.ext), 1e-9)"
+    return (
+        f"WITH _q AS ({strip_statement(sql)}), "
+        f"_e AS (SELECT ST_Extent(ST_GeomFromGeoJSON(geojson)) AS ext FROM _q) "
+        f"SELECT _q.* FROM _q, _e "
+        f"ORDER BY row_number() OVER ("
+        f"PARTITION BY "
+        f"floor((ST_X({centroid}) - ST_XMin(_e.ext)) / {width} * {n}), "
+        f"floor((ST_Y({centroid}) - ST_YMin(_e.ext)) / {height} * {n}) "
+        f"ORDER BY random()), random() "
+        f"LIMIT {int(limit)}"
+    )
+
+
+def feature_collection_sql(
+    sql: str, columns: Sequence[str], max_rows: int, max_bytes: int
+) -> str:
+    """
+    Wrap a query so PostGIS returns the final GeoJSON FeatureCollection
+
+    The `geojson` column (ST_AsGeoJSON text) becomes each Feature's geometry,
+    an `id` column its id, and the remaining columns its properties, except
+    geom_lod<N> columns (e.g. from SELECT * on a table with levels of detail).
+    Features beyond max_rows, or beyond max_bytes of geometry text, are left
+    out; the second output column reports whether any were.
+
+    Args:
+        sql: Validated SQL query string
+        columns: Column names the query produces
+        max_rows: Maximum number of Features
+        max_bytes: Approximate maximum size of the Features' geometry text
+
+    Returns:
+        SQL returning one row of (collection text, truncated flag)
+    """
+    has_geometry = "geojson" in columns
+    geometry = "(_r._f).geojson::json" if has_geometry else "NULL::json"
+    hidden = [column for column in columns if column == "geojson" or is_lod_column(column)]
+    properties = "to_jsonb(_r._f)" + "".join(f" - {sql_literal(column)}" for column in hidden)
+    id_member = "'id', (_r._f).id, " if "id" in columns else ""
+    size = "COALESCE(octet_length((_f).geojson), 0)" if has_geometry else "0"
+    limited = apply_row_limit(sql, int(max_rows) + 1)
+    return (
+        f"SELECT json_build_object("
+        f"'type', 'FeatureCollection', "
+        f"'features', COALESCE(json_agg(json_build_object("
+        f"'type', 'Feature', {id_member}'geometry', {geometry}, 'properties', {properties}"
+        f") ORDER BY _r._n) FILTER (WHERE _r._keep), '[]'::json)"
+        f")::text AS collection, "
+        f"COALESCE(bool_or(NOT _r._keep), false) AS truncated "
+        f"FROM (SELECT _f, _n, "
+        f"_n <= {int(max_rows)} AND sum({size}) OVER (ORDER BY _n) <= {int(max_bytes)} AS _keep "
+        f"FROM (SELECT _f, row_number() OVER () AS _n FROM ({limited}) AS _f) AS _numbered"
+        f") AS _r"
+    )
+
+
+def quote_identifier(name: str) -> str:
+    """Quote a column name as a SQL identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def mvt_tile_sql(
+    sql: str, columns: Sequence[str], z: int, x: int, y: int, extent: int, buffer: int
+) -> str:
+    """
+    Wrap a query to render one Mapbox Vector Tile of its results
+
+    Geometries are rebuilt from the `geojson` column (SRID 4326), filtered to
+    the tile envelope (plus buffer), projected to Web Mercator and clipped with
+    ST_AsMVTGeom. All other columns become feature properties.
+
+    Args:
+        sql: Validated SQL query string with a `geojson` column
+        columns: Column names the query produces
+        z, x, y: Tile coordinates
+        extent: Tile extent in tile coordinate units
+        buffer: Clipping buffer in tile coordinate units
+
+    Returns:
+        SQL returning one bytea row with the encoded tile
+    """
+    properties = "".join(
+        f", _q.{quote_identifier(column)}" for column in columns
+        if column != "geojson" and not is_lod_column(column)
+    )
+    envelope = f"ST_TileEnvelope({int(z)}, {int(x)}, {int(y)})"
+    margin = buffer / extent
+    return (
+        f"SELECT ST_AsMVT(_tile, 'query', {int(extent)}, '_mvt_geom') FROM ("
+        f"SELECT ST_AsMVTGeom(ST_Transform(_g.geom, 3857), {envelope}, "
+        f"{int(extent)}, {int(buffer)}, true) AS _mvt_geom{properties} "
+        f"FROM ({strip_statement(sql)}) AS _q "
+        f"CROSS JOIN LATERAL (SELECT ST_GeomFromGeoJSON(_q.geojson) AS geom) AS _g "
+        f"WHERE _g.geom && ST_Transform("
+        f"ST_TileEnvelope({int(z)}, {int(x)}, {int(y)}, margin => {margin}), 4326)"
+        f") AS _tile WHERE _tile._mvt_geom IS NOT NULL"
+    )
+
+
+def wkb_export_sql(sql: str, columns: Sequence[str], geometry_column: str = "geometry") -> str:
+    """
+    Wrap a query to return its geometry as WKB instead of GeoJSON text
+
+    The `geojson` column is replaced by ST_AsBinary of the same geometry,
+    named geometry_column; all other columns except geom_lod<N> are passed
+    through.
+    """
+    selected = [
+        f"_q.{quote_identifier(column)}" for column in columns
+        if column != "geojson" and not is_lod_column(column)
+    ]
+    selected.append(
+        f"ST_AsBinary(ST_GeomFromGeoJSON(_q.geojson)) AS {quote_identifier(geometry_column)}"
+    )
+    return f"SELECT {', '.join(selected)} FROM ({strip_statement(sql)}) AS _q"
+
+
+# Degrees per pixel at zoom 0 for 256px web map tiles
+_DEGREES_PER_PIXEL_Z0 = 360 / 256
+
+_AS_GEOJSON = re.compile(
+    r"\bST_AsGeoJSON\(\s*(?:([a-z_][a-z0-9_]*)\.)?([a-z_][a-z0-9_]*)\s*\)", re.IGNORECASE
+)
+_NOT_ALIASES = (
+    "where", "join", "inner", "left", "right", "full", "cross", "on", "group", "order",
+    "limit", "offset", "union", "having", "natural", "lateral", "using", "window",
+)
+_ALIAS = rf"(?:\s+(?:AS\s+)?(?!(?:{'|'.join(_NOT_ALIASES)})\b)([a-z_][a-z0-9_]*))?"
+_TABLE_REFERENCE = re.compile(
+    rf"\b(?:FROM|JOIN)\s+([a-z_][a-z0-9_]*){_ALIAS}|,\s*([a-z_][a-z0-9_]*){_ALIAS}",
+    re.IGNORECASE
+)
+
+
+def detail_for_resolution(
+    resolution: float, tolerances: Sequence[float], max_digits: int
+) -> Tuple[int, int]:
+    """
+    Pick a level of detail and coordinate precision for a map resolution
+
+    Args:
+        resolution: Size of one screen pixel (or the acceptable error) in degrees
+        tolerances: Simplification tolerances of geom_lod1..N, finest first
+        max_digits: Upper bound for maxdecimaldigits
+
+    Returns:
+        Tuple of (LOD level, 0 for full resolution; decimal digits)
+    """
+    level = 0
+    for i, tolerance in enumerate(tolerances, 1):
+        if tolerance <= resolution:
+            level = i
+    digits = math.ceil(-math.log10(resolution)) + 1
+    return level, max(1, min(max_digits, digits))
+
+
+def zoom_resolution(zoom: float) -> float:
+    """Degrees per pixel at a web map zoom level"""
+    return _DEGREES_PER_PIXEL_Z0 / (2 ** zoom)
+
+
+def _table_aliases(sql: str) -> Dict[str, str]:
+    """Map the tables (and their aliases) referenced in FROM/JOIN clauses to table names"""
+    aliases: Dict[str, str] = {}
+    for match in _TABLE_REFERENCE.finditer(sql):
+        table = (match.group(1) or match.group(3)).lower()
+        alias = match.group(2) or match.group(4)
+        if table not in TRACKED_TABLES:
+            continue
+        aliases[table] = table
+        if alias:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def geometry_detail_sql(
+    sql: str, lod_level: int, digits: Optional[int], lod_tables: Sequence[str]
+) -> str:
+    """
+    Rewrite ST_AsGeoJSON(...) calls to a simplified geometry column and precision
+
+    `ST_AsGeoJSON(geom)` / `ST_AsGeoJSON(alias.geom)` reading a table with
+    precomputed levels of detail is pointed at `geom_lod<level>`; every
+    single-column ST_AsGeoJSON call gets `maxdecimaldigits`. Unqualified
+    columns are only redirected when the query reads a single table. Calls on
+    expressions are left untouched.
+
+    Args:
+        sql: Validated SQL query string
+        lod_level: Level of detail to use (0 keeps full-resolution geom)
+        digits: maxdecimaldigits to apply, or None to keep the default
+        lod_tables: Tables that have geom_lod1..N columns
+
+    Returns:
+        Rewritten SQL
+    """
+    parts = _QUOTED.split(sql)
+    unquoted = " ".join(parts[::2])
+    aliases = _table_aliases(unquoted)
+    single_table = set(aliases.values()) if len(set(aliases.values())) == 1 else set()
+
+    def rewrite(match: "re.Match") -> str:
+        qualifier, column = match.group(1), match.group(2)
+        if lod_level and column.lower() == "geom":
+            table = aliases.get(qualifier.lower()) if qualifier else next(iter(single_table), None)
+            if table in lod_tables:
+                column = f"geom_lod{lod_level}"
+        argument = f"{qualifier}.{column}" if qualifier else column
+        precision = f", {int(digits)}" if digits is not None else ""
+        return f"ST_AsGeoJSON({argument}{precision})"
+
+    for i in range(0, len(parts), 2):
+        parts[i] = _AS_GEOJSON.sub(rewrite, parts[i])
+    return "".join(parts)
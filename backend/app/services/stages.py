@@ -0,0 +1,61 @@
+"""Per-stage timing of the query pipeline"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from app.services.metrics import STAGE_DURATION
+from app.services.tracing import tracer
+
+# Stages of /query, in pipeline order
+STAGES = ("generation", "validation", "execution", "formatting", "serialization")
+
+# Seconds spent per stage by the request being recorded (None when not recording)
+current_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "current_stage_timings", default=None
+)
+
+# Time spent in stages nested in the innermost open stage
+_nested_time: ContextVar[Optional[List[float]]] = ContextVar("stage_nested_time", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a stage of the current request
+
+    The stage is traced as a span, its time observed in the stage latency
+    histogram and, when the request's timings are being recorded, added to
+    them. Time is exclusive:
+    a stage nested in another (validation inside generation) is not counted
+    twice. Repeated stages accumulate.
+    """
+    parent = _nested_time.get()
+    nested = [0.0]
+    token = _nested_time.set(nested)
+    start = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _nested_time.reset(token)
+        own_time = elapsed - nested[0]
+        if parent is not None:
+            parent[0] += elapsed
+        STAGE_DURATION.labels(name).observe(own_time)
+        timings = current_stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + own_time
+
+
+@contextmanager
+def recording_stages() -> Iterator[Dict[str, float]]:
+    """Record the stage timings of the work done inside the block"""
+    timings: Dict[str, float] = {}
+    token = current_stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_stage_timings.reset(token)
@@ -0,0 +1,93 @@
+"""OpenTelemetry tracing of the query pipeline"""
+
+import logging
+import os
+from typing import Mapping, Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.context import Context
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Spans are no-ops until setup_tracing installs a provider
+tracer = trace.get_tracer("geosql")
+
+TRACING_EXPORTERS = ("none", "console", "file", "otlp")
+
+
+def _otlp_exporter() -> Optional[SpanExporter]:
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.error("TRACING_EXPORTER=otlp requires opentelemetry-exporter-otlp-proto-http")
+        return None
+    # Without an endpoint the exporter follows OTEL_EXPORTER_OTLP_* (localhost:4318 by default)
+    exporter: SpanExporter
+    if settings.tracing_otlp_endpoint:
+        exporter = OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)
+    else:
+        exporter = OTLPSpanExporter()
+    return exporter
+
+
+class _FileSpanExporter(ConsoleSpanExporter):
+    """Appends one JSON span per line to a file, which it closes on shutdown"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        super().__init__(
+            out=self._file, formatter=lambda span: span.to_json(indent=None) + os.linesep
+        )
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self._file.close()
+
+
+def setup_tracing() -> Optional[TracerProvider]:
+    """
+    Install the tracer provider configured by TRACING_EXPORTER
+
+    Returns:
+        The provider (to be shut down, flushing pending spans, on exit),
+        or None when tracing is disabled
+    """
+    name = settings.tracing_exporter
+    if name not in TRACING_EXPORTERS:
+        raise ValueError(f"TRACING_EXPORTER must be one of {', '.join(TRACING_EXPORTERS)}")
+    if name == "none":
+        return None
+
+    exporter: Optional[SpanExporter]
+    if name == "console":
+        exporter = ConsoleSpanExporter()
+    elif name == "file":
+        exporter = _FileSpanExporter(settings.tracing_file_path)
+    else:
+        exporter = _otlp_exporter()
+        if exporter is None:
+            return None
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.tracing_service_name}),
+        # Follow the caller's sampling decision when a trace is propagated
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(
+        f"Tracing enabled: exporter={name}, sample_ratio={settings.tracing_sample_ratio}"
+    )
+    return provider
+
+
+def extract_context(headers: Mapping[str, str]) -> Context:
+    """Trace context propagated by the caller (W3C traceparent by default)"""
+    return propagate.extract(headers)
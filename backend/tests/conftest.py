@@ -2,13 +2,21 @@
 Pytest configuration and fixtures
 """
 
+import asyncio
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
-from app.services.database import DatabaseService
+from app.services.database import DatabaseService, RenderedResult, ResultSet
+from app.services.query_service import QueryService
+from app.services.result_cache import ResultCache
+
+SAMPLE_SQL = "SELECT id, name, ST_AsGeoJSON(geom) as geojson FROM cafes"
+SAMPLE_COLUMNS = ["id", "name", "geojson"]
+SAMPLE_ROWS = [(1, "Test Cafe", '{"type": "Point", "coordinates": [34.7818, 32.0853]}')]
 
 
 @pytest.fixture
@@ -72,3 +80,67 @@ def mock_openai_response():
             self.choices = [MockChoice()]
 
     return MockResponse()
+
+
+class FakeOpenAIService:
+    """Stand-in for OpenAIService with simulated latency"""
+
+    prompt_version = "test"
+    # A single model, no cascade
+    tiers = []
+    strongest_tier = 0
+
+    def __init__(self, sql=SAMPLE_SQL, latency=0.2):
+        self.sql = sql
+        self.latency = latency
+        self.calls = 0
+        # Text deltas of streamed generations (the SQL in one piece by default)
+        self.chunks = None
+        self.streamed_chunks = 0
+        self.stream_closed = False
+
+    async def generate_sql(self, question, tier=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.sql
+
+    async def stream_sql(self, question):
+        self.calls += 1
+        try:
+            for chunk in self.chunks or [self.sql]:
+                await asyncio.sleep(0)
+                self.streamed_chunks += 1
+                yield chunk
+        finally:
+            self.stream_closed = True
+
+    def stats(self):
+        return {"calls": self.calls}
+
+
+@pytest.fixture
+def query_service(tmp_path):
+    """QueryService with simulated async LLM and database latency"""
+    service = QueryService()
+    service.result_cache = ResultCache(
+        path=str(tmp_path / "results.sqlite3"), ttl=60, stale_ttl=60, swr_min_hits=1,
+        max_entries=100, max_bytes=10_000_000, max_entry_bytes=1_000_000,
+        record_types=(ResultSet, RenderedResult)
+    )
+    service.tile_cache = ResultCache(
+        path=str(tmp_path / "tiles.sqlite3"), ttl=60, stale_ttl=0, swr_min_hits=1,
+        max_entries=100, max_bytes=10_000_000, max_entry_bytes=1_000_000
+    )
+
+    async def stream_query(sql, batch_size):
+        await asyncio.sleep(0.05)
+        yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+    async def explain(sql):
+        return None
+
+    service.openai_service = FakeOpenAIService()
+    service.db_service = DatabaseService()
+    service.db_service.stream_query = stream_query
+    service.db_service.explain = explain
+    return service
@@ -2,9 +2,13 @@
 API endpoint tests
 """
 
+import json
+
 import pytest
 from fastapi import status
 
+from app.api import routes
+
 
 class TestRootEndpoint:
     """Test root endpoint"""
@@ -102,13 +106,110 @@ class TestQueryEndpoint:
         # For now, just test the endpoint exists and validates input
         response = client.post("/query", json=sample_query_request)
 
-        # Will fail without OpenAI key or database, which is expected
+        # Will fail without OpenAI key or database, which is expected; once
+        # earlier calls have failed the model's circuit breaker answers 503
         assert response.status_code in [
             status.HTTP_200_OK,
             status.HTTP_500_INTERNAL_SERVER_ERROR,
-            status.HTTP_400_BAD_REQUEST
+            status.HTTP_400_BAD_REQUEST,
+            status.HTTP_503_SERVICE_UNAVAILABLE
         ]
 
+    def test_query_endpoint_rejects_unknown_format(self, client, sample_query_request):
+        """Test unsupported output formats are rejected"""
+        response = client.post("/query?format=xml", json=sample_query_request)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_query_endpoint_rejects_invalid_timeout(self, client, sample_query_request):
+        """Test a non-positive request timeout header is rejected"""
+        response = client.post(
+            "/query", json=sample_query_request, headers={"X-Request-Timeout": "0"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestProgressStreamEndpoint:
+    """Test the Server-Sent Events progress endpoint"""
+
+    def test_events_are_streamed(self, client, sample_query_request, query_service, monkeypatch):
+        """Test the stream carries each stage as an event"""
+        monkeypatch.setattr(routes, "get_query_service", lambda: query_service)
+
+        response = client.post("/query/stream", json=sample_query_request)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [line[len("event: "):] for line in response.text.splitlines() if line.startswith("event: ")]
+        assert events == ["sql", "validated", "executing", "rows", "done"]
+
+    def test_failure_is_an_error_event(self, client, sample_query_request, query_service, monkeypatch):
+        """Test a validation failure ends the stream with a 400 error event"""
+        query_service.openai_service.sql = "DROP TABLE cafes"
+        monkeypatch.setattr(routes, "get_query_service", lambda: query_service)
+
+        response = client.post("/query/stream", json=sample_query_request)
+
+        assert response.status_code == status.HTTP_200_OK
+        event, data = response.text.strip().split("\n\n")[-1].splitlines()
+        assert event == "event: error"
+        assert json.loads(data[len("data: "):])["status"] == 400
+
+
+class TestBatchEndpoint:
+    """Test the batch query endpoint"""
+
+    def test_results_are_streamed_per_question(self, client, query_service, monkeypatch):
+        """Test each distinct question gets one NDJSON line with its status"""
+        monkeypatch.setattr(routes, "get_query_service", lambda: query_service)
+
+        response = client.post(
+            "/query/batch",
+            json={"questions": ["Show all cafes", "show all cafes", "Drop -- cafes"]}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        results = {
+            tuple(line["indices"]): line
+            for line in map(json.loads, response.text.splitlines())
+        }
+        assert set(results) == {(0, 1), (2,)}
+        assert results[(0, 1)]["status"] == 200
+        assert results[(0, 1)]["response"]["result_count"] == 1
+        assert results[(2,)]["status"] == 400
+        assert results[(2,)]["response"] is None
+
+    def test_batch_size_is_limited(self, client, monkeypatch):
+        """Test batches over BATCH_MAX_QUESTIONS are rejected"""
+        monkeypatch.setattr(routes.settings, "batch_max_questions", 2)
+
+        response = client.post("/query/batch", json={"questions": ["Show all cafes"] * 3})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_empty_batch_is_rejected(self, client):
+        """Test a batch needs at least one question"""
+        response = client.post("/query/batch", json={"questions": []})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestExportEndpoint:
+    """Test columnar export endpoint"""
+
+    def test_export_rejects_unknown_format(self, client, sample_query_request):
+        """Test unsupported export formats are rejected before generating SQL"""
+        response = client.post("/query/export?format=shapefile", json=sample_query_request)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestTileEndpoint:
+    """Test vector tile endpoint"""
+
+    def test_tile_rejects_invalid_handle(self, client):
+        """Test tiles require a valid query handle"""
+        response = client.get("/query/not-a-handle/tiles/0/0/0.mvt")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 
 class TestCORS:
     """Test CORS configuration"""
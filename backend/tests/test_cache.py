@@ -0,0 +1,70 @@
+"""
+Cache tests
+"""
+
+import time
+
+from app.services.cache import TTLCache, normalize_question
+
+
+class TestNormalizeQuestion:
+    """Test question normalization for cache keys"""
+
+    def test_case_whitespace_and_punctuation(self):
+        """Test case, whitespace and punctuation are folded"""
+        assert normalize_question("  Show ALL parks,  larger than 5000?") == \
+            normalize_question("show all parks larger than 5000")
+
+    def test_numbers_are_preserved(self):
+        """Test thousands separators are dropped but decimals kept"""
+        assert normalize_question("parks over 5,000 m") == "parks over 5000 m"
+        assert normalize_question("within 2.5 km") == "within 2.5 km"
+        assert normalize_question("within 2.5 km") != normalize_question("within 25 km")
+
+    def test_operators_and_signs_are_kept(self):
+        """Test comparison, arithmetic and sign characters change the key"""
+        assert normalize_question("a > 5") != normalize_question("a < 5")
+        assert normalize_question("parks with area > 5000") != \
+            normalize_question("parks with area < 5000")
+        assert normalize_question("x = -5") != normalize_question("x = 5")
+        assert normalize_question("within 10% of") != normalize_question("within 10 of")
+
+    def test_hebrew_niqqud_and_final_letters(self):
+        """Test niqqud is stripped and final letters are normalized"""
+        assert normalize_question("מְצָא תכניות") == normalize_question("מצא תכניות")
+        assert normalize_question("גן") == normalize_question("גנ")
+
+
+class TestTTLCache:
+    """Test LRU + TTL cache behaviour"""
+
+    def test_lru_eviction(self):
+        """Test least recently used entries are evicted first"""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        """Test entries expire after their TTL"""
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set("a", 1, ttl=0.01)
+        time.sleep(0.02)
+
+        assert cache.get("a") is None
+
+    def test_persistence_round_trip(self, tmp_path):
+        """Test entries survive save/load"""
+        path = str(tmp_path / "sql_cache.json")
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set("q", "SELECT 1")
+        cache.save(path)
+
+        restored = TTLCache(max_size=10, ttl=60)
+        assert restored.load(path) == 1
+        assert restored.get("q") == "SELECT 1"
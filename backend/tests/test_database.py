@@ -2,8 +2,12 @@
 Database service tests
 """
 
+from contextlib import asynccontextmanager
+
 import pytest
+from app.services import database as database_module
 from app.services.database import DatabaseService
+from app.services.sql_utils import apply_row_limit, feature_collection_sql, mvt_tile_sql
 
 
 class TestSQLValidation:
@@ -108,3 +112,279 @@ class TestDatabaseConnection:
 
         assert isinstance(count, int)
         assert count >= 0
+
+    @pytest.mark.asyncio
+    async def test_explain_without_connection_skips_the_guard(self):
+        """Test an unreachable database makes EXPLAIN unavailable instead of failing"""
+        db = DatabaseService()
+
+        @asynccontextmanager
+        async def refused():
+            raise ConnectionRefusedError("Connect call failed")
+            yield
+
+        db.get_request_connection = refused
+
+        assert await db.explain("SELECT id FROM parks") is None
+
+
+class TestResultBudget:
+    """Test row/byte budgets and LIMIT injection"""
+
+    def test_limit_is_injected(self):
+        """Test a LIMIT is appended to unbounded queries"""
+        assert apply_row_limit("SELECT * FROM plans;", 101) == "SELECT * FROM plans LIMIT 101"
+
+    def test_larger_limit_is_clamped(self):
+        """Test an existing larger LIMIT is lowered and OFFSET kept"""
+        assert apply_row_limit("SELECT * FROM plans LIMIT 5000 OFFSET 10", 101) == \
+            "SELECT * FROM plans LIMIT 101 OFFSET 10"
+        assert apply_row_limit("SELECT * FROM plans limit all", 101) == \
+            "SELECT * FROM plans limit 101"
+
+    def test_smaller_limit_is_kept(self):
+        """Test an existing smaller LIMIT is left alone"""
+        assert apply_row_limit("SELECT * FROM plans LIMIT 5", 101) == "SELECT * FROM plans LIMIT 5"
+
+    def test_subquery_limit_is_not_top_level(self):
+        """Test a LIMIT inside a subquery does not count as the top-level LIMIT"""
+        sql = "SELECT * FROM parks WHERE area = (SELECT area FROM parks LIMIT 1)"
+        assert apply_row_limit(sql, 10) == sql + " LIMIT 10"
+
+    def test_trailing_comments_do_not_swallow_the_limit(self):
+        """Test a LIMIT is not appended inside a trailing comment"""
+        assert apply_row_limit("SELECT id FROM cafes -- all cafes", 10) == \
+            "SELECT id FROM cafes LIMIT 10"
+        assert apply_row_limit("SELECT id FROM cafes LIMIT 5000 -- many\n;", 10) == \
+            "SELECT id FROM cafes LIMIT 10"
+        assert apply_row_limit("SELECT '--' AS d FROM cafes /* x */", 10) == \
+            "SELECT '--' AS d FROM cafes LIMIT 10"
+
+    @staticmethod
+    def _db_with_rows(rows, estimate=1000):
+        """DatabaseService whose cursor yields the given rows"""
+        db = DatabaseService()
+        db.executed = []
+
+        async def stream_query(sql, batch_size):
+            db.executed.append(sql)
+            for i in range(0, len(rows), batch_size):
+                yield ["id", "geojson"], rows[i:i + batch_size]
+
+        async def explain(sql):
+            return {"Plan Rows": estimate}
+
+        db.stream_query = stream_query
+        db.explain = explain
+        return db
+
+    @pytest.mark.asyncio
+    async def test_row_budget_truncates(self):
+        """Test results beyond the row budget are cut and flagged"""
+        db = self._db_with_rows([(i, "{}") for i in range(50)])
+        result = await db.execute_bounded("SELECT id, geojson FROM cafes", 10, 10_000)
+
+        assert len(result.rows) == 10
+        assert result.truncated is True
+        assert result.estimated_total == 1000
+        assert db.executed[0].endswith("LIMIT 11")
+
+    @pytest.mark.asyncio
+    async def test_byte_budget_stops_fetching(self):
+        """Test fetching stops once the byte budget is exhausted"""
+        db = self._db_with_rows([(i, "x" * 100) for i in range(50)])
+        result = await db.execute_bounded("SELECT id, geojson FROM plans", 1000, 550)
+
+        assert len(result.rows) == 5
+        assert result.truncated is True
+
+    @pytest.mark.asyncio
+    async def test_within_budget_not_truncated(self):
+        """Test small results are returned whole"""
+        db = self._db_with_rows([(1, "{}")])
+        result = await db.execute_bounded("SELECT id, geojson FROM cafes", 10, 10_000)
+
+        assert result.rows == [(1, "{}")]
+        assert result.truncated is False
+        assert result.estimated_total is None
+
+    @pytest.mark.asyncio
+    async def test_buffered_fetch_skips_cursor(self):
+        """Test small results are fetched in one round trip without a cursor"""
+        db = self._db_with_rows([(1, "{}")])
+        executed = []
+
+        async def execute_query(sql):
+            executed.append(sql)
+            return ["id", "geojson"], [(1, "{}"), (2, "{}")]
+
+        db.execute_query = execute_query
+        result = await db.execute_bounded(
+            "SELECT id, geojson FROM cafes", 10, 10_000, buffered=True
+        )
+
+        assert result.rows == [(1, "{}"), (2, "{}")]
+        assert executed == ["SELECT id, geojson FROM cafes LIMIT 11"]
+        assert db.executed == []
+
+    @pytest.mark.asyncio
+    async def test_known_estimate_skips_explain(self):
+        """Test a row estimate from the planning step is reused on truncation"""
+        db = self._db_with_rows([(i, "{}") for i in range(50)])
+
+        async def explain(sql):
+            raise AssertionError("EXPLAIN should not run again")
+
+        db.explain = explain
+        result = await db.execute_bounded(
+            "SELECT id, geojson FROM cafes", 10, 10_000, estimated_rows=40
+        )
+
+        assert result.estimated_total == 40
+
+    @pytest.mark.asyncio
+    async def test_preview_uses_spatial_sample(self):
+        """Test preview mode wraps the query in a stratified sample"""
+        db = self._db_with_rows([(1, "{}")])
+
+        async def describe_columns(sql):
+            return ["id", "geojson"]
+
+        db.describe_columns = describe_columns
+        await db.execute_bounded("SELECT id, geojson FROM plans", 10, 10_000, preview=True)
+
+        assert "PARTITION BY" in db.executed[0]
+        assert db.executed[0].endswith("LIMIT 11")
+
+    @pytest.mark.asyncio
+    async def test_lod_columns_are_dropped_from_results(self):
+        """Test the generated geom_lod<N> columns never reach the result"""
+        db = DatabaseService()
+
+        async def execute_query(sql):
+            return ["id", "geom_lod1", "geom_lod2", "name"], [(1, "g1", "g2", "Meir Park")]
+
+        db.execute_query = execute_query
+        result = await db.execute_bounded("SELECT * FROM parks", 10, 10_000, buffered=True)
+
+        assert result.columns == ["id", "name"]
+        assert result.rows == [(1, "Meir Park")]
+
+
+class TestFeatureCollection:
+    """Test FeatureCollections built by PostGIS"""
+
+    def test_sql_uses_geojson_and_id_columns(self):
+        """Test geometry, id and properties are mapped from the query columns"""
+        sql = feature_collection_sql(
+            "SELECT id, name, ST_AsGeoJSON(geom) AS geojson FROM cafes;",
+            ["id", "name", "geojson"], 100, 1000
+        )
+
+        assert "json_agg" in sql
+        assert "(_r._f).geojson::json" in sql
+        assert "'id', (_r._f).id" in sql
+        assert "to_jsonb(_r._f) - 'geojson'" in sql
+        assert "FROM cafes LIMIT 101)" in sql
+
+    def test_lod_columns_are_not_properties(self):
+        """Test SELECT * on a table with levels of detail leaves geom_lod<N> out"""
+        columns = ["id", "name", "geom", "geom_lod1", "geom_lod2", "geom_lod3", "geojson"]
+        sql = feature_collection_sql("SELECT *, geom AS geojson FROM parks", columns, 10, 1000)
+
+        assert "to_jsonb(_r._f) - 'geom_lod1' - 'geom_lod2' - 'geom_lod3' - 'geojson'" in sql
+
+    def test_sql_without_geometry(self):
+        """Test queries without a geojson column get null geometries"""
+        sql = feature_collection_sql("SELECT count(*) FROM cafes", ["count"], 10, 1000)
+
+        assert "NULL::json" in sql
+        assert "'id'" not in sql
+
+    @pytest.mark.asyncio
+    async def test_collection_is_passed_through(self):
+        """Test the database output is returned as bytes without parsing"""
+        db = DatabaseService()
+        collection = '{"type" : "FeatureCollection", "features" : []}'
+
+        async def describe_columns(sql):
+            return ["id", "geojson"]
+
+        async def execute_query(sql):
+            return ["collection", "truncated"], [(collection, False)]
+
+        db.describe_columns = describe_columns
+        db.execute_query = execute_query
+        result = await db.execute_feature_collection("SELECT id, geojson FROM cafes", 10, 1000)
+
+        assert result.body == collection.encode("utf-8")
+        assert result.truncated is False
+        assert result.estimated_total is None
+
+
+class TestVectorTileSQL:
+    """Test ST_AsMVT tile queries"""
+
+    def test_tile_sql_clips_to_envelope(self):
+        """Test the query is clipped to the tile and geojson is not a property"""
+        sql = mvt_tile_sql(
+            "SELECT id, pl_name, ST_AsGeoJSON(geom) AS geojson FROM plans;",
+            ["id", "pl_name", "geojson"], 12, 2446, 1655, 4096, 64
+        )
+
+        assert "ST_AsMVT(_tile, 'query', 4096, '_mvt_geom')" in sql
+        assert "ST_AsMVTGeom(ST_Transform(_g.geom, 3857), ST_TileEnvelope(12, 2446, 1655)" in sql
+        assert '_q."id", _q."pl_name" ' in sql
+        assert '_q."geojson"' not in sql
+        assert "FROM plans) AS _q" in sql
+
+
+class TestPreparedTemplates:
+    """Test queries are sent as parameterized templates"""
+
+    @staticmethod
+    def _db_recording_statements():
+        db = DatabaseService()
+        db.statements = []
+
+        class Result:
+            def keys(self):
+                return ["id"]
+
+            def fetchall(self):
+                return [(1,)]
+
+        class Connection:
+            async def execute(self, statement, params=None):
+                db.statements.append((statement.text, params))
+                return Result()
+
+        @asynccontextmanager
+        async def get_request_connection():
+            yield Connection()
+
+        db.get_request_connection = get_request_connection
+        return db
+
+    @pytest.mark.asyncio
+    async def test_filter_literals_are_bound(self):
+        """Test numeric filter literals are sent as bind parameters and counted per template"""
+        db = self._db_recording_statements()
+
+        await db.execute_query("SELECT id FROM parks WHERE area > 5000")
+        await db.execute_query("SELECT id FROM parks WHERE area > 8000")
+
+        template = "SELECT id FROM parks WHERE area > CAST(:p1 AS INTEGER)"
+        assert db.statements == [(template, {"p1": 5000}), (template, {"p1": 8000})]
+        assert db.templates.stats()["top"][0]["executions"] == 2
+        assert db.templates.stats()["top"][0]["distinct_params"] == 2
+
+    @pytest.mark.asyncio
+    async def test_templates_can_be_disabled(self, monkeypatch):
+        """Test SQL_TEMPLATES_ENABLED=false sends the SQL as generated"""
+        monkeypatch.setattr(database_module.settings, "sql_templates_enabled", False)
+        db = self._db_recording_statements()
+
+        await db.execute_query("SELECT id FROM parks WHERE area > 5000")
+
+        assert db.statements == [("SELECT id FROM parks WHERE area > 5000", {})]
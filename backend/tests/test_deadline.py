@@ -0,0 +1,157 @@
+"""
+Request deadline tests
+"""
+
+import asyncio
+
+import pytest
+
+from app.config import get_settings
+from app.models.schemas import QueryRequest
+from app.services.deadline import (
+    ClientDisconnected,
+    Deadline,
+    DeadlineExceeded,
+    current_deadline,
+    iterate_with_deadline,
+    remaining_time,
+    run_with_deadline
+)
+
+settings = get_settings()
+
+
+class TestDeadline:
+    """Test deadline construction"""
+
+    def test_default_timeout(self):
+        """Test a missing header uses the configured default"""
+        assert Deadline.from_header(None).timeout == settings.request_timeout
+
+    def test_header_is_capped(self):
+        """Test header values above the maximum are capped"""
+        deadline = Deadline.from_header(str(settings.max_request_timeout * 10))
+        assert deadline.timeout == settings.max_request_timeout
+
+    def test_non_positive_header_is_rejected(self):
+        """Test zero/negative timeouts are rejected"""
+        with pytest.raises(ValueError):
+            Deadline.from_header("0")
+
+    def test_remaining_time_without_deadline(self):
+        """Test background work without a deadline gets the default"""
+        assert remaining_time(5.0) == 5.0
+
+    def test_remaining_time_after_expiry(self):
+        """Test an expired deadline raises"""
+        token = current_deadline.set(Deadline(0))
+        try:
+            with pytest.raises(DeadlineExceeded):
+                remaining_time(5.0)
+        finally:
+            current_deadline.reset(token)
+
+
+class TestRunWithDeadline:
+    """Test deadline enforcement and cancel-on-disconnect"""
+
+    @pytest.mark.asyncio
+    async def test_result_is_returned(self):
+        """Test work finishing in time returns its result and sees the deadline"""
+        deadline = Deadline(1)
+
+        async def work():
+            return current_deadline.get()
+
+        assert await run_with_deadline(work(), deadline) is deadline
+
+    @pytest.mark.asyncio
+    async def test_expired_deadline_cancels_work(self):
+        """Test work is cancelled when the deadline passes"""
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with pytest.raises(DeadlineExceeded):
+            await run_with_deadline(work(), Deadline(0.05))
+        assert cancelled.is_set()
+
+    @pytest.mark.asyncio
+    async def test_generator_is_cancelled_and_closed_at_deadline(self):
+        """Test each step of a generator runs under the deadline"""
+        closed = asyncio.Event()
+        deadline = Deadline(0.1)
+
+        async def events():
+            try:
+                yield current_deadline.get()
+                await asyncio.sleep(10)
+                yield None
+            finally:
+                closed.set()
+
+        received = []
+        with pytest.raises(DeadlineExceeded):
+            async for item in iterate_with_deadline(events(), deadline):
+                received.append(item)
+        assert received == [deadline]
+        assert closed.is_set()
+
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_work(self):
+        """Test work is cancelled when the client disconnects"""
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def is_disconnected():
+            return True
+
+        with pytest.raises(ClientDisconnected):
+            await run_with_deadline(work(), Deadline(5), is_disconnected)
+        assert cancelled.is_set()
+
+    @pytest.mark.asyncio
+    async def test_query_cancelled_at_deadline(self, query_service):
+        """Test a slow query is cancelled and the database is not left running"""
+        db_cancelled = asyncio.Event()
+
+        async def stream_query(sql, batch_size):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                db_cancelled.set()
+                raise
+            yield [], []
+
+        query_service.openai_service.latency = 0
+        query_service.db_service.stream_query = stream_query
+
+        with pytest.raises(DeadlineExceeded):
+            await run_with_deadline(
+                query_service.process_query(QueryRequest(question="Show all cafes")),
+                Deadline(0.1)
+            )
+        await asyncio.wait_for(db_cancelled.wait(), 1)
+        assert query_service.execution_flight.stats()["abandoned"] == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_deadline_skips_database(self, query_service):
+        """Test no statement is sent once the deadline has passed"""
+        token = current_deadline.set(Deadline(0))
+        try:
+            with pytest.raises(DeadlineExceeded):
+                async with query_service.db_service.get_request_connection():
+                    pass
+        finally:
+            current_deadline.reset(token)
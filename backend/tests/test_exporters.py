@@ -0,0 +1,153 @@
+"""
+Columnar export tests
+"""
+
+import io
+from decimal import Decimal
+
+import pytest
+
+from app.models.schemas import QueryRequest
+from app.services.exporters import RecordBatchBuilder, check_export_format, export_batches
+from app.services.sql_utils import wkb_export_sql
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+COLUMNS = ["id", "area", "geometry"]
+# int4, numeric, bytea
+TYPE_OIDS = [23, 1700, 17]
+POINT_WKB = bytes.fromhex("0101000000000000000000f03f0000000000000040")
+
+
+async def cursor(*batches):
+    for rows in batches:
+        yield COLUMNS, rows
+
+
+async def collect(body):
+    return b"".join([chunk async for chunk in body])
+
+
+class TestRecordBatchBuilder:
+    """Test conversion of cursor rows into Arrow batches"""
+
+    def test_schema_is_inferred_from_first_batch(self):
+        """Test numerics become float64 and geometry is tagged as WKB"""
+        builder = RecordBatchBuilder(COLUMNS)
+        batch = builder.build([(1, Decimal("12.5"), POINT_WKB)])
+
+        assert batch.schema.field("area").type == pa.float64()
+        assert batch.schema.field("geometry").type == pa.binary()
+        assert batch.schema.field("geometry").metadata[b"ARROW:extension:name"] == b"geoarrow.wkb"
+        assert b"geo" in batch.schema.metadata
+
+    def test_later_batches_are_cast_to_schema(self):
+        """Test every batch of an export shares the first batch's schema"""
+        builder = RecordBatchBuilder(COLUMNS)
+        first = builder.build([(1, Decimal("12.5"), POINT_WKB)])
+        second = builder.build([(2, None, None), (3, 7, POINT_WKB)])
+
+        assert second.schema == first.schema
+        assert second.column(1).to_pylist() == [None, 7.0]
+
+    def test_all_null_first_batch_keeps_column_types(self):
+        """Test typed columns are not turned into strings by a NULL first batch"""
+        builder = RecordBatchBuilder(COLUMNS, TYPE_OIDS)
+        first = builder.build([(1, None, POINT_WKB)])
+        second = builder.build([(2, Decimal("12.5"), POINT_WKB)])
+
+        assert first.schema.field("area").type == pa.float64()
+        assert second.column(1).to_pylist() == [12.5]
+
+    def test_wider_value_in_later_batch(self):
+        """Test a fractional value after whole numbers is not truncated"""
+        builder = RecordBatchBuilder(["id", "score"], [23, 701])
+        builder.build([(1, 2.0)])
+        second = builder.build([(2, 2.5)])
+
+        assert second.column(1).to_pylist() == [2.5]
+
+    def test_unmapped_types_are_inferred(self):
+        """Test columns of unknown types fall back to inference"""
+        builder = RecordBatchBuilder(["id", "tags"], [23, None])
+        batch = builder.build([(1, ["a", "b"])])
+
+        assert batch.schema.field("id").type == pa.int64()
+        assert batch.schema.field("tags").type == pa.list_(pa.string())
+
+
+class TestExportBatches:
+    """Test streamed export files"""
+
+    @pytest.mark.asyncio
+    async def test_geoparquet_round_trip(self):
+        """Test one row group per batch and readable GeoParquet metadata"""
+        body = export_batches(
+            COLUMNS, cursor([(2, 2.0, POINT_WKB)], [(3, 3.0, POINT_WKB)]),
+            "geoparquet", first_rows=[(1, 1.0, POINT_WKB)]
+        )
+        data = await collect(body)
+        parquet = pq.ParquetFile(io.BytesIO(data))
+
+        assert parquet.metadata.num_row_groups == 3
+        assert parquet.read().column("id").to_pylist() == [1, 2, 3]
+        assert b'"primary_column": "geometry"' in parquet.schema_arrow.metadata[b"geo"]
+
+    @pytest.mark.asyncio
+    async def test_arrow_stream_is_written_incrementally(self):
+        """Test the IPC stream yields data per batch"""
+        body = export_batches(
+            COLUMNS, cursor([(2, 2.0, POINT_WKB)]), "arrow", first_rows=[(1, 1.0, POINT_WKB)]
+        )
+        chunks = [chunk async for chunk in body]
+        table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+
+        assert len(chunks) >= 2
+        assert table.column("geometry").to_pylist() == [POINT_WKB, POINT_WKB]
+
+    def test_unknown_format_is_rejected(self):
+        """Test unsupported formats raise ValueError"""
+        with pytest.raises(ValueError):
+            check_export_format("shapefile")
+
+    def test_export_sql_converts_geometry_to_wkb(self):
+        """Test the geojson column is replaced by WKB geometry"""
+        sql = wkb_export_sql("SELECT id, ST_AsGeoJSON(geom) AS geojson FROM parks", ["id", "geojson"])
+        assert sql == (
+            'SELECT _q."id", ST_AsBinary(ST_GeomFromGeoJSON(_q.geojson)) AS "geometry" '
+            "FROM (SELECT id, ST_AsGeoJSON(geom) AS geojson FROM parks) AS _q"
+        )
+
+
+class TestExportQuery:
+    """Test export through the query service"""
+
+    @pytest.mark.asyncio
+    async def test_export_query_streams_geoparquet(self, query_service):
+        """Test the service exports the cursor rows with WKB geometry"""
+        executed = []
+
+        async def describe_columns(sql):
+            return ["id", "name", "geojson"]
+
+        async def describe_column_types(sql):
+            return [23, 25, 17]
+
+        async def stream_query(sql, batch_size):
+            executed.append(sql)
+            yield ["id", "name", "geometry"], [(1, "Test Cafe", None)]
+
+        query_service.db_service.describe_columns = describe_columns
+        query_service.db_service.describe_column_types = describe_column_types
+        query_service.db_service.stream_query = stream_query
+
+        _, body = await query_service.export_query(
+            QueryRequest(question="Show all cafes"), "geoparquet"
+        )
+        table = pq.read_table(io.BytesIO(await collect(body)))
+
+        assert "ST_AsBinary" in executed[0]
+        assert table.column("name").to_pylist() == ["Test Cafe"]
+        assert table.schema.field("id").type == pa.int64()
+        assert (await query_service.get_stats())["exports"]["requests"] == 1
@@ -0,0 +1,72 @@
+"""
+GeoJSON / NDJSON formatter tests
+"""
+
+import json
+from datetime import date
+from decimal import Decimal
+
+from app.services import formatters
+
+COLUMNS = ["id", "name", "area", "pl_date_8", "geojson"]
+ROWS = [
+    (1, "גן מאיר", Decimal("38500.5"), date(2024, 1, 1), '{"type":"Point","coordinates":[34.78,32.08]}'),
+    (2, "Rothschild", None, None, None),
+]
+
+
+class TestFeatureEncoding:
+    """Test row to Feature encoding"""
+
+    def test_feature_passes_geometry_through(self):
+        """Test geometry text is spliced in and properties are typed"""
+        feature = json.loads(formatters.encode_feature(COLUMNS, ROWS[0]))
+
+        assert feature["type"] == "Feature"
+        assert feature["id"] == 1
+        assert feature["geometry"] == {"type": "Point", "coordinates": [34.78, 32.08]}
+        assert feature["properties"] == {
+            "id": 1, "name": "גן מאיר", "area": 38500.5, "pl_date_8": "2024-01-01"
+        }
+
+    def test_missing_geometry_is_null(self):
+        """Test rows without geometry produce null geometry"""
+        feature = json.loads(formatters.encode_feature(COLUMNS, ROWS[1]))
+        assert feature["geometry"] is None
+
+    def test_ndjson_has_one_feature_per_line(self):
+        """Test NDJSON output is newline-delimited"""
+        lines = formatters.encode_ndjson_batch(COLUMNS, ROWS).decode().splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [1, 2]
+
+    def test_streamed_feature_collection_is_valid(self):
+        """Test batches join into one valid FeatureCollection"""
+        body = b"".join([
+            formatters.FEATURE_COLLECTION_PREFIX,
+            formatters.encode_feature_collection_batch(COLUMNS, [], first=True),
+            formatters.encode_feature_collection_batch(COLUMNS, ROWS[:1], first=True),
+            formatters.encode_feature_collection_batch(COLUMNS, ROWS[1:], first=False),
+            formatters.FEATURE_COLLECTION_SUFFIX,
+        ])
+        collection = json.loads(body)
+        assert collection["type"] == "FeatureCollection"
+        assert len(collection["features"]) == 2
+
+
+class TestServerSentEvents:
+    """Test Server-Sent Event encoding"""
+
+    def test_event_data_is_one_json_line(self):
+        event = formatters.encode_sse("validated", {"sql": "SELECT 1\nFROM cafes", "area": Decimal("2.5")})
+
+        lines = event.split(b"\n")
+        assert lines[0] == b"event: validated"
+        assert json.loads(lines[1][len(b"data: "):]) == {"sql": "SELECT 1\nFROM cafes", "area": 2.5}
+        assert event.endswith(b"\n\n") and len(lines) == 4
+
+    def test_encoded_feature_batch_is_passed_through(self):
+        data = formatters.encode_feature_batch(COLUMNS, ROWS)
+        event = formatters.encode_sse("rows", data)
+
+        assert event == b"event: rows\ndata: " + data + b"\n\n"
+        assert [feature["id"] for feature in json.loads(data)["features"]] == [1, 2]
@@ -0,0 +1,232 @@
+"""
+Tests for hedged and speculative LLM calls
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.schemas import QueryRequest
+from app.services import query_service as query_service_module
+from app.services.hedging import CallBudget, Hedger, LatencyTracker, first_success
+from app.services.openai_service import OpenAIService
+from conftest import SAMPLE_SQL
+
+
+def make_hedger(budget=None, **kwargs):
+    options = dict(min_delay=0.0, initial_delay=0.05, min_samples=5)
+    options.update(kwargs)
+    return Hedger(budget or CallBudget(ratio=1.0, burst=5), **options)
+
+
+class TestLatencyTracker:
+    """Tests for the rolling latency window"""
+
+    def test_quantile_over_window(self):
+        tracker = LatencyTracker(window=10)
+        for seconds in range(1, 21):
+            tracker.record(seconds)
+
+        assert len(tracker) == 10
+        assert tracker.quantile(0.9) == 19
+        assert tracker.quantile(0.0) == 11
+        assert LatencyTracker(window=10).quantile(0.9) is None
+
+
+class TestCallBudget:
+    """Tests for the extra-call token bucket"""
+
+    def test_extra_calls_are_a_fraction_of_primary_calls(self):
+        budget = CallBudget(ratio=0.25, burst=1)
+        assert budget.try_spend()
+
+        spent = 0
+        for _ in range(100):
+            budget.deposit()
+            spent += budget.try_spend()
+
+        assert spent == 25
+
+    def test_balance_is_capped_at_burst(self):
+        budget = CallBudget(ratio=1.0, burst=2)
+        for _ in range(10):
+            budget.deposit()
+
+        assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+
+
+class TestHedger:
+    """Tests for hedging slow calls"""
+
+    @pytest.mark.asyncio
+    async def test_slow_call_is_hedged_and_loser_cancelled(self):
+        hedger = make_hedger()
+        delays = [10.0, 0.01]
+        cancelled = []
+
+        async def call():
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return delay
+
+        assert await hedger.run(call) == 0.01
+        assert cancelled == [10.0]
+        stats = hedger.stats()
+        assert stats["hedged"] == 1
+        assert stats["hedge_wins"] == 1
+        assert stats["win_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_fast_call_is_not_hedged(self):
+        hedger = make_hedger()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            return "sql"
+
+        assert await hedger.run(call) == "sql"
+        assert len(calls) == 1
+        assert hedger.stats()["hedged"] == 0
+
+    @pytest.mark.asyncio
+    async def test_delay_follows_observed_quantile(self):
+        hedger = make_hedger(quantile=0.9, min_delay=0.5, initial_delay=3.0)
+        assert hedger.delay() == 3.0
+
+        for seconds in (0.1, 0.2, 0.3, 0.4, 2.0):
+            hedger.latencies.record(seconds)
+        assert hedger.delay() == 2.0
+
+        for _ in range(50):
+            hedger.latencies.record(0.1)
+        assert hedger.delay() == 0.5
+
+    @pytest.mark.asyncio
+    async def test_no_hedge_without_budget(self):
+        hedger = make_hedger(budget=CallBudget(ratio=0.0, burst=0))
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "sql"
+
+        assert await hedger.run(call) == "sql"
+        assert len(calls) == 1
+        assert hedger.stats()["budget_denied"] == 1
+
+    @pytest.mark.asyncio
+    async def test_hedge_covers_a_failed_first_call(self):
+        hedger = make_hedger()
+        outcomes = [(0.1, TimeoutError("slow and failed")), (0.15, "sql")]
+
+        async def call():
+            delay, outcome = outcomes.pop(0)
+            await asyncio.sleep(delay)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        assert await hedger.run(call) == "sql"
+
+    @pytest.mark.asyncio
+    async def test_first_error_is_raised_when_all_fail(self):
+        async def fail(message, delay):
+            await asyncio.sleep(delay)
+            raise TimeoutError(message)
+
+        tasks = [asyncio.ensure_future(fail("first", 0.02)), asyncio.ensure_future(fail("second", 0.01))]
+
+        with pytest.raises(TimeoutError, match="first"):
+            await first_success(tasks)
+
+
+class TestOpenAIHedging:
+    """Tests for hedged and speculative generation in OpenAIService"""
+
+    @pytest.fixture
+    def service(self):
+        service = OpenAIService()
+        service.tiers[-1].hedger = make_hedger(budget=service.call_budget)
+        service.latencies = []
+        service.temperatures = []
+
+        async def create(**kwargs):
+            service.temperatures.append(kwargs["temperature"])
+            sql = f"SELECT {len(service.temperatures)}"
+            await asyncio.sleep(service.latencies.pop(0))
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=sql))])
+
+        service.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+        return service
+
+    @pytest.mark.asyncio
+    async def test_slow_generation_is_hedged(self, service):
+        service.latencies = [5.0, 0.01]
+
+        assert await service.generate_sql("Show all parks") == "SELECT 2"
+        assert service.stats()["tiers"][-1]["hedging"]["hedge_wins"] == 1
+
+    @pytest.mark.asyncio
+    async def test_candidates_arrive_fastest_first(self, service):
+        service.latencies = [0.1, 0.02, 0.05]
+
+        candidates = [sql async for sql in service.generate_candidates("Show all parks", 3)]
+
+        assert candidates == ["SELECT 2", "SELECT 3", "SELECT 1"]
+        assert service.temperatures[1:] == [0.4, 0.4]
+        assert service.stats()["speculative_calls"] == 2
+
+
+class TestSpeculativeGeneration:
+    """Tests for executing the first candidate that validates and plans"""
+
+    @pytest.fixture
+    def speculative_service(self, query_service, monkeypatch):
+        monkeypatch.setattr(query_service_module.settings, "llm_speculative_candidates", 3)
+        fake = query_service.openai_service
+        fake.candidates = []
+
+        async def generate_candidates(question, count):
+            fake.calls += 1
+            for sql in fake.candidates[:count]:
+                yield sql
+
+        fake.generate_candidates = generate_candidates
+        return query_service
+
+    @pytest.mark.asyncio
+    async def test_first_candidate_that_plans_is_executed(self, speculative_service, monkeypatch):
+        # Execution itself runs unplanned
+        monkeypatch.setattr(query_service_module.settings, "cost_guard_enabled", False)
+        plans = {"SELECT id FROM missing_table": None}
+
+        async def explain(sql):
+            return plans.get(sql, {"Node Type": "Seq Scan", "Total Cost": 10.0, "Plan Rows": 1})
+
+        speculative_service.db_service.explain = explain
+        speculative_service.openai_service.candidates = [
+            "DROP TABLE cafes", "SELECT id FROM missing_table", SAMPLE_SQL
+        ]
+
+        response = await speculative_service.process_query(QueryRequest(question="Show all cafes"))
+
+        assert response.sql.startswith(SAMPLE_SQL)
+        stats = (await speculative_service.get_stats())["speculation"]
+        assert stats["rescued"] == 1
+        assert stats["explain"] == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_candidates_raise_the_first_error(self, speculative_service):
+        speculative_service.openai_service.candidates = ["DROP TABLE cafes", "DELETE FROM cafes"]
+
+        with pytest.raises(ValueError, match="Only SELECT"):
+            await speculative_service.process_query(QueryRequest(question="Show all cafes"))
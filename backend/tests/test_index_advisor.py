@@ -0,0 +1,216 @@
+"""
+Tests for the query log and the index advisor's workload analysis
+
+Costing needs a live database; these cover candidate extraction, plan
+mining, existing-index filtering and the report.
+"""
+
+import json
+
+from app.services.query_log import QueryLog, read_query_log
+from tools.index_advisor import (
+    Candidate,
+    Evaluation,
+    existing_index_keys,
+    extract_candidates,
+    format_report,
+    is_covered,
+    load_workload,
+    seq_scanned_tables,
+)
+
+CATALOG = {
+    "plans": {
+        "id": "integer", "code": "text", "title": "text", "status": "text",
+        "approved_at": "date", "geom": "USER-DEFINED",
+    },
+    "parks": {"id": "integer", "name": "text", "area": "double precision", "geom": "USER-DEFINED"},
+}
+
+
+def keys(candidates):
+    return {(c.table, c.method, c.key) for c in candidates}
+
+
+class TestQueryLog:
+    """Tests for the JSONL query log"""
+
+    def test_records_round_trip(self, tmp_path):
+        path = str(tmp_path / "queries.jsonl")
+        log = QueryLog(path)
+        log.record("parks", "SELECT * FROM parks")
+        log.record("near", "SELECT id FROM plans", ["bbox_prefilter"])
+        log.close()
+
+        entries = list(read_query_log(path))
+        assert log.records == 2
+        assert [entry["sql"] for entry in entries] == ["SELECT * FROM parks", "SELECT id FROM plans"]
+        assert "rewrites" not in entries[0]
+        assert entries[1]["rewrites"] == ["bbox_prefilter"]
+
+    def test_read_skips_malformed_lines(self, tmp_path):
+        path = tmp_path / "queries.jsonl"
+        path.write_text(
+            json.dumps({"sql": "SELECT 1"}) + "\n"
+            "not json\n"
+            "\n"
+            + json.dumps({"question": "no sql"}) + "\n"
+            + json.dumps(["SELECT 2"]) + "\n"
+        )
+
+        assert [entry["sql"] for entry in read_query_log(str(path))] == ["SELECT 1"]
+
+    def test_appends_to_existing_log(self, tmp_path):
+        path = str(tmp_path / "queries.jsonl")
+        for sql in ("SELECT 1", "SELECT 2"):
+            log = QueryLog(path)
+            log.record("q", sql)
+            log.close()
+
+        assert len(list(read_query_log(path))) == 2
+
+
+class TestWorkload:
+    """Tests for workload grouping and plan mining"""
+
+    def test_load_workload_groups_by_fingerprint(self):
+        workload = load_workload([
+            {"sql": "SELECT * FROM parks"},
+            {"sql": "SELECT id FROM plans WHERE status = 'approved'"},
+            {"sql": "select *  from parks;"},
+        ])
+
+        assert [query.runs for query in workload] == [2, 1]
+        assert workload[0].sql == "SELECT * FROM parks"
+
+    def test_seq_scanned_tables_walks_plan_tree(self):
+        plan = {
+            "Node Type": "Limit",
+            "Plans": [{
+                "Node Type": "Nested Loop",
+                "Plans": [
+                    {"Node Type": "Seq Scan", "Relation Name": "plans"},
+                    {"Node Type": "Index Scan", "Relation Name": "parks"},
+                ],
+            }],
+        }
+
+        assert seq_scanned_tables(plan) == {"plans"}
+
+
+class TestExtractCandidates:
+    """Tests for proposing indexes from query predicates"""
+
+    def test_geography_cast_gets_expression_gist(self):
+        sql = (
+            "SELECT p.id FROM plans p JOIN parks k "
+            "ON ST_DWithin(p.geom::geography, k.geom::geography, 500)"
+        )
+
+        assert keys(extract_candidates(sql, CATALOG)) == {
+            ("plans", "gist", "(geom::geography)"),
+            ("parks", "gist", "(geom::geography)"),
+        }
+
+    def test_geography_in_order_by(self):
+        sql = (
+            "SELECT id FROM parks ORDER BY "
+            "ST_Distance(geom::geography, ST_MakePoint(-122.4, 37.8)::geography) LIMIT 5"
+        )
+
+        assert ("parks", "gist", "(geom::geography)") in keys(extract_candidates(sql, CATALOG))
+
+    def test_like_gets_trigram_gin(self):
+        sql = "SELECT * FROM plans WHERE title ILIKE '%housing%'"
+
+        assert keys(extract_candidates(sql, CATALOG)) == {("plans", "gin", "title gin_trgm_ops")}
+
+    def test_equality_and_in_get_btree(self):
+        sql = "SELECT * FROM plans WHERE status = 'approved' AND code IN ('A', 'B')"
+
+        assert keys(extract_candidates(sql, CATALOG)) == {
+            ("plans", "btree", "status"),
+            ("plans", "btree", "code"),
+        }
+
+    def test_date_range_gets_btree_and_brin(self):
+        sql = "SELECT * FROM plans WHERE approved_at >= CURRENT_DATE - INTERVAL '1 year'"
+
+        assert keys(extract_candidates(sql, CATALOG)) == {
+            ("plans", "btree", "approved_at"),
+            ("plans", "brin", "approved_at"),
+        }
+
+    def test_numeric_range_gets_btree_only(self):
+        sql = "SELECT * FROM parks WHERE area BETWEEN 100 AND 500"
+
+        assert keys(extract_candidates(sql, CATALOG)) == {("parks", "btree", "area")}
+
+    def test_unqualified_column_resolved_from_catalog(self):
+        sql = "SELECT p.id FROM plans p, parks k WHERE name = 'Dolores' AND p.id = k.id"
+
+        assert keys(extract_candidates(sql, CATALOG)) == {("parks", "btree", "name")}
+
+    def test_ignores_projections_and_column_comparisons(self):
+        sql = "SELECT geom::geography, status = 'x' FROM plans p, parks k WHERE p.id = k.id"
+
+        assert extract_candidates(sql, CATALOG) == []
+
+    def test_unparseable_sql(self):
+        assert extract_candidates("SELECT FROM WHERE (", CATALOG) == []
+
+
+class TestExistingIndexes:
+    """Tests for filtering candidates already covered by an index"""
+
+    def test_matches_pg_indexes_definitions(self):
+        existing = existing_index_keys([
+            "CREATE INDEX idx_plans_geog ON public.plans USING gist (((geom)::geography))",
+            "CREATE UNIQUE INDEX plans_pkey ON public.plans USING btree (id)",
+            "CREATE INDEX idx_parks_name ON public.parks USING gin (name gin_trgm_ops)",
+        ])
+
+        assert is_covered(Candidate("plans", "gist", "(geom::geography)", ""), existing)
+        assert is_covered(Candidate("plans", "btree", "id", ""), existing)
+        assert is_covered(Candidate("parks", "gin", "name gin_trgm_ops", ""), existing)
+        assert not is_covered(Candidate("parks", "btree", "name", ""), existing)
+        assert not is_covered(Candidate("parks", "gist", "(geom::geography)", ""), existing)
+
+
+class TestReport:
+    """Tests for the ranked report and DDL"""
+
+    def test_candidate_ddl(self):
+        candidate = Candidate("plans", "gist", "(geom::geography)", "geography predicate")
+
+        assert candidate.name == "idx_plans_geom_geography_gist"
+        assert candidate.ddl() == (
+            "CREATE INDEX CONCURRENTLY idx_plans_geom_geography_gist "
+            "ON plans USING gist ((geom::geography))"
+        )
+        assert "CONCURRENTLY" not in candidate.ddl(concurrently=False)
+
+    def test_report_ranks_and_filters_by_savings(self):
+        workload = load_workload([{"sql": "SELECT * FROM plans WHERE title ILIKE '%a%'"}] * 4)
+        trigram = Candidate("plans", "gin", "title gin_trgm_ops", "ILIKE pattern")
+        status = Candidate("plans", "btree", "status", "equality filter")
+        evaluations = [
+            Evaluation(trigram, "trial", 600.0, 1, 2 * 1024 * 1024),
+            Evaluation(status, "hypopg", 5.0, 1, 8192),
+        ]
+
+        report = format_report(workload, 1000.0, evaluations, min_savings=0.01)
+
+        assert "4 queries (1 distinct)" in report
+        assert report.index("gin_trgm_ops") < report.index("USING btree (status)")
+        assert "CREATE EXTENSION IF NOT EXISTS pg_trgm;" in report
+        assert f"{trigram.ddl()};" in report
+        assert status.ddl() not in report
+
+    def test_report_without_recommendations(self):
+        workload = load_workload([{"sql": "SELECT 1"}])
+
+        report = format_report(workload, 10.0, [])
+
+        assert "No index is estimated" in report
+        assert "CREATE" not in report
@@ -0,0 +1,129 @@
+"""
+Tests for the Prometheus metrics
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import status
+from prometheus_client import REGISTRY
+
+from app.api import routes
+from app.services import query_service as query_service_module
+from app.services.metrics import EventLoopLagMonitor
+from app.services.openai_service import OpenAIService
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMetricsEndpoint:
+    """Test the /metrics endpoint"""
+
+    @pytest.fixture
+    def service(self, query_service, monkeypatch):
+        monkeypatch.setattr(routes, "get_query_service", lambda: query_service)
+        monkeypatch.setattr(query_service_module, "get_query_service", lambda: query_service)
+        return query_service
+
+    def test_stage_latencies_are_exposed(self, client, service):
+        """Test a /query observes every pipeline stage, serialization included"""
+        before = {
+            stage: sample("geosql_stage_duration_seconds_count", stage=stage)
+            for stage in ("generation", "validation", "execution", "formatting", "serialization")
+        }
+
+        response = client.post("/query", json={"question": "Show all cafes"})
+        assert response.status_code == status.HTTP_200_OK
+
+        for stage, count in before.items():
+            assert sample("geosql_stage_duration_seconds_count", stage=stage) == count + 1
+
+        metrics = client.get("/metrics")
+        assert metrics.status_code == status.HTTP_200_OK
+        assert metrics.headers["content-type"].startswith("text/plain")
+        assert 'geosql_stage_duration_seconds_bucket{le="0.25",stage="generation"}' in metrics.text
+
+    def test_service_gauges_are_collected_at_scrape_time(self, client, service):
+        """Test pool, queue depth and cache metrics are read from the services"""
+        service.planner.slow_lane_waiting = 3
+        service.sql_cache.set("show all cafes", "SELECT 1")
+        service.sql_cache.get("show all cafes")
+
+        text = client.get("/metrics").text
+
+        assert 'geosql_queue_depth{queue="slow_lane"} 3.0' in text
+        assert 'geosql_queue_depth{queue="db_pool"} 0.0' in text
+        assert "geosql_db_pool_checked_out 0.0" in text
+        assert 'geosql_cache_hits_total{cache="sql_cache"} 1.0' in text
+        assert 'geosql_cache_entries{cache="result_cache"} 0.0' in text
+
+    def test_requests_are_labelled_by_route_template(self, client, service):
+        """Test HTTP latency uses the route path, not the raw URL"""
+        labels = {"method": "GET", "route": "/query/{handle}/tiles/{z}/{x}/{y}.mvt", "status": "400"}
+        before = sample("geosql_http_request_duration_seconds_count", **labels)
+
+        client.get("/query/unknown/tiles/1/0/0.mvt")
+
+        assert sample("geosql_http_request_duration_seconds_count", **labels) == before + 1
+        assert sample("geosql_http_requests_in_flight") == 0
+
+    def test_metrics_can_be_disabled(self, client, monkeypatch):
+        """Test METRICS_ENABLED=false hides the endpoint"""
+        monkeypatch.setattr(routes.settings, "metrics_enabled", False)
+
+        response = client.get("/metrics")
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestTokenCounter:
+    """Test LLM token accounting"""
+
+    @pytest.mark.asyncio
+    async def test_tokens_are_counted_per_model_and_kind(self):
+        usage = SimpleNamespace(
+            prompt_tokens=120, completion_tokens=30,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=100)
+        )
+        service = OpenAIService()
+        before = {
+            kind: sample("geosql_llm_tokens_total", model="counted-model", kind=kind)
+            for kind in ("prompt", "cached_prompt", "completion")
+        }
+
+        service._record_usage(
+            service.prompt_builder.build("Show all cafes"),
+            SimpleNamespace(usage=usage), 0.1, "counted-model"
+        )
+
+        assert sample(
+            "geosql_llm_tokens_total", model="counted-model", kind="prompt"
+        ) == before["prompt"] + 120
+        assert sample(
+            "geosql_llm_tokens_total", model="counted-model", kind="cached_prompt"
+        ) == before["cached_prompt"] + 100
+        assert sample(
+            "geosql_llm_tokens_total", model="counted-model", kind="completion"
+        ) == before["completion"] + 30
+        await service.close()
+
+
+class TestEventLoopLag:
+    """Test the event-loop lag monitor"""
+
+    @pytest.mark.asyncio
+    async def test_blocking_the_loop_is_measured(self):
+        monitor = EventLoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.005)
+        time.sleep(0.1)  # block the loop
+        # The overdue probe runs first and reports the lag
+        await asyncio.sleep(0.001)
+        lag = sample("geosql_event_loop_lag_seconds")
+        await monitor.stop()
+
+        assert lag >= 0.05
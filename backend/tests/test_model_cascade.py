@@ -0,0 +1,222 @@
+"""
+Tests for the model cascade, deadline-aware retries and the circuit breaker
+"""
+
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError, BadRequestError
+from sqlalchemy import exc
+
+from app.models.schemas import QueryRequest
+from app.services import openai_service as openai_module
+from app.services import query_service as query_service_module
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from app.services.deadline import Deadline, current_deadline
+from app.services.openai_service import OpenAIService, _wait_within_deadline
+from conftest import SAMPLE_COLUMNS, SAMPLE_ROWS, SAMPLE_SQL
+
+FAST_SQL = "SELECT id, name, ST_AsGeoJSON(geom) as geojson FROM cafes WHERE id > 0"
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def fail(breaker, error):
+    with pytest.raises(type(error)):
+        with breaker.guard():
+            raise error
+
+
+class TestCircuitBreaker:
+    """Tests for opening, rejecting and recovering"""
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("upstream", failure_threshold=2, reset_timeout=60)
+
+        fail(breaker, TimeoutError())
+        assert breaker.state == CLOSED
+        fail(breaker, TimeoutError())
+
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            with breaker.guard():
+                pass
+        assert breaker.stats()["rejected"] == 1
+
+    def test_success_resets_the_count(self):
+        breaker = CircuitBreaker("upstream", failure_threshold=2, reset_timeout=60)
+
+        fail(breaker, TimeoutError())
+        with breaker.guard():
+            pass
+        fail(breaker, TimeoutError())
+
+        assert breaker.state == CLOSED
+
+    def test_half_open_trial_closes_or_reopens(self):
+        breaker = CircuitBreaker("upstream", failure_threshold=1, reset_timeout=60)
+        fail(breaker, TimeoutError())
+        breaker.opened_at = time.monotonic() - 61
+        assert breaker.state == HALF_OPEN
+
+        fail(breaker, TimeoutError())
+        assert breaker.state == OPEN
+
+        breaker.opened_at = time.monotonic() - 61
+        with breaker.guard():
+            # Only one trial call at a time
+            assert not breaker.available
+        assert breaker.state == CLOSED
+
+    def test_only_backend_failures_count(self):
+        breaker = CircuitBreaker(
+            "upstream", failure_threshold=1, reset_timeout=60,
+            is_failure=openai_module._is_backend_failure
+        )
+        response = httpx.Response(400, request=REQUEST)
+
+        fail(breaker, BadRequestError("bad request", response=response, body=None))
+        assert breaker.state == CLOSED
+
+        fail(breaker, APIConnectionError(request=REQUEST))
+        assert breaker.state == OPEN
+
+
+class TestRetryBackoff:
+    """Tests for jittered, deadline-aware retry waits"""
+
+    def test_backoff_is_jittered_and_capped(self):
+        waits = {_wait_within_deadline(SimpleNamespace(attempt_number=3)) for _ in range(50)}
+
+        assert len(waits) > 1
+        assert all(0 <= wait <= 4 for wait in waits)
+
+    def test_wait_leaves_time_for_another_attempt(self):
+        token = current_deadline.set(Deadline(3))
+        try:
+            wait = _wait_within_deadline(SimpleNamespace(attempt_number=10))
+        finally:
+            current_deadline.reset(token)
+
+        assert wait <= 3 - openai_module.MIN_ATTEMPT_TIME
+
+
+@pytest.fixture
+def cascade(query_service, monkeypatch):
+    """QueryService with a fast and a strong model answering from a fake client"""
+    monkeypatch.setattr(openai_module.settings, "openai_fast_model", "fast-model")
+    monkeypatch.setattr(openai_module.settings, "llm_hedge_enabled", False)
+    # Execution itself runs unplanned
+    monkeypatch.setattr(query_service_module.settings, "cost_guard_enabled", False)
+    service = OpenAIService()
+    service.answers = {"fast-model": FAST_SQL, "gpt-4": SAMPLE_SQL}
+    service.models = []
+
+    async def create(**kwargs):
+        service.models.append(kwargs["model"])
+        answer = service.answers[kwargs["model"]]
+        if isinstance(answer, Exception):
+            raise answer
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    async def explain(sql):
+        return {"Node Type": "Seq Scan", "Total Cost": 10.0, "Plan Rows": 1}
+
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    query_service.openai_service = service
+    query_service.db_service.explain = explain
+    return query_service
+
+
+async def tier_stats(query_service, index):
+    return (await query_service.get_stats())["llm"]["tiers"][index]
+
+
+class TestModelCascade:
+    """Tests for escalating from the fast model to the strong one"""
+
+    @pytest.mark.asyncio
+    async def test_fast_model_answers_when_its_sql_is_usable(self, cascade):
+        response = await cascade.process_query(QueryRequest(question="Show all cafes"))
+
+        assert response.sql.startswith(FAST_SQL)
+        assert cascade.openai_service.models == ["fast-model"]
+        assert (await tier_stats(cascade, 0))["escalation_rate"] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_invalid_sql_escalates(self, cascade):
+        cascade.openai_service.answers["fast-model"] = "DELETE FROM cafes"
+
+        response = await cascade.process_query(QueryRequest(question="Show all cafes"))
+
+        assert response.sql.startswith(SAMPLE_SQL)
+        assert cascade.openai_service.models == ["fast-model", "gpt-4"]
+        stats = await tier_stats(cascade, 0)
+        assert stats["escalation_rate"] == 1.0
+        assert stats["escalation_reasons"] == {"validation": 1}
+
+    @pytest.mark.asyncio
+    async def test_unplannable_sql_escalates(self, cascade):
+        async def explain(sql):
+            if sql == FAST_SQL:
+                return None
+            return {"Node Type": "Seq Scan", "Total Cost": 10.0, "Plan Rows": 1}
+
+        cascade.db_service.explain = explain
+
+        sql, tier = await cascade._generate_cascaded("Show all cafes")
+
+        assert (sql, tier) == (SAMPLE_SQL, 1)
+        assert (await tier_stats(cascade, 0))["escalation_reasons"] == {"explain": 1}
+
+    @pytest.mark.asyncio
+    async def test_api_failure_escalates_without_retrying(self, cascade):
+        cascade.openai_service.answers["fast-model"] = APIConnectionError(request=REQUEST)
+
+        sql, tier = await cascade._generate_cascaded("Show all cafes")
+
+        assert tier == 1
+        assert cascade.openai_service.models == ["fast-model", "gpt-4"]
+        assert (await tier_stats(cascade, 0))["api_failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_skips_the_fast_model(self, cascade):
+        cascade.openai_service.tiers[0].breaker.opened_at = time.monotonic()
+
+        sql, tier = await cascade._generate_cascaded("Show all cafes")
+
+        assert tier == 1
+        assert cascade.openai_service.models == ["gpt-4"]
+        assert (await tier_stats(cascade, 0))["escalation_reasons"] == {"circuit_open": 1}
+
+    @pytest.mark.asyncio
+    async def test_execution_error_regenerates_with_strong_model(self, cascade):
+        async def stream_query(sql, batch_size):
+            if sql.startswith(FAST_SQL):
+                raise exc.ProgrammingError(sql, {}, Exception("column does not exist"))
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        cascade.db_service.stream_query = stream_query
+
+        response = await cascade.process_query(QueryRequest(question="Show all cafes"))
+        again = await cascade.process_query(QueryRequest(question="Show all cafes"))
+
+        assert response.sql.startswith(SAMPLE_SQL)
+        assert again.sql.startswith(SAMPLE_SQL)
+        # The strong model's SQL replaced the cached fast one
+        assert cascade.openai_service.models == ["fast-model", "gpt-4"]
+        assert (await tier_stats(cascade, 0))["escalation_reasons"] == {"execution": 1}
+
+    @pytest.mark.asyncio
+    async def test_execution_error_from_strong_model_is_raised(self, cascade):
+        cascade.openai_service.tiers[0].breaker.opened_at = time.monotonic()
+
+        async def stream_query(sql, batch_size):
+            raise exc.ProgrammingError(sql, {}, Exception("column does not exist"))
+            yield
+
+        cascade.db_service.stream_query = stream_query
+
+        with pytest.raises(exc.ProgrammingError):
+            await cascade.process_query(QueryRequest(question="Show all cafes"))
@@ -0,0 +1,122 @@
+"""
+Keyset pagination and query handle tests
+"""
+
+import sqlite3
+
+import pytest
+
+from app.models.schemas import QueryRequest
+from app.services import handles
+from app.services.handles import decode_handle, encode_handle
+from app.services.sql_utils import keyset_page_sql
+from conftest import FakeOpenAIService
+
+PARKS_SQL = "SELECT id, name FROM parks;"
+
+
+@pytest.fixture
+def paged_service(query_service):
+    """QueryService executing SQL against an in-memory SQLite parks table"""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE parks (id INTEGER, name TEXT)")
+    conn.executemany(
+        "INSERT INTO parks VALUES (?, ?)",
+        [(i, f"Park {i}") for i in range(1, 11)] + [(5, "Park 5b")]
+    )
+    executed = []
+
+    async def execute_query(sql):
+        executed.append(sql)
+        cursor = conn.execute(sql)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+
+    async def stream_query(sql, batch_size):
+        yield await execute_query(sql)
+
+    query_service.openai_service = FakeOpenAIService(sql=PARKS_SQL, latency=0)
+    query_service.db_service.execute_query = execute_query
+    query_service.db_service.stream_query = stream_query
+    query_service.result_cache = None
+    query_service.executed = executed
+    return query_service
+
+
+class TestQueryHandles:
+    """Test signed continuation tokens"""
+
+    def test_round_trip(self):
+        """Test payload survives encoding"""
+        token = encode_handle({"sql": "SELECT 1", "after": 5})
+        assert decode_handle(token) == {"sql": "SELECT 1", "after": 5}
+
+    def test_tampered_token_rejected(self):
+        """Test a modified token fails verification"""
+        data, _, signature = encode_handle({"sql": "SELECT 1"}).partition(".")
+        forged = encode_handle({"sql": "SELECT 2"}).partition(".")[0]
+        with pytest.raises(ValueError):
+            decode_handle(f"{forged}.{signature}")
+        with pytest.raises(ValueError):
+            decode_handle(data)
+
+    def test_expired_token_rejected(self, monkeypatch):
+        """Test expired tokens are rejected"""
+        monkeypatch.setattr(handles.settings, "query_handle_ttl", -1)
+        with pytest.raises(ValueError):
+            decode_handle(encode_handle({"sql": "SELECT 1"}))
+
+
+class TestKeysetPagination:
+    """Test paging through results without OFFSET"""
+
+    def test_page_sql(self):
+        """Test the keyset wrapper"""
+        assert keyset_page_sql(PARKS_SQL, "id", 7, 3) == (
+            "SELECT * FROM (SELECT id, name FROM parks) AS _page "
+            "WHERE _page.id > 7 ORDER BY _page.id LIMIT 3"
+        )
+
+    @pytest.mark.asyncio
+    async def test_pages_cover_all_rows_once(self, paged_service):
+        """Test following tokens returns every row exactly once without a second LLM call"""
+        response = await paged_service.process_query(
+            QueryRequest(question="Show all parks", page_size=4)
+        )
+        names = [row["name"] for row in response.results]
+        pages = 1
+
+        while response.next_token:
+            response = await paged_service.fetch_next_page(response.next_token)
+            names.extend(row["name"] for row in response.results)
+            pages += 1
+
+        assert sorted(names) == sorted([f"Park {i}" for i in range(1, 11)] + ["Park 5b"])
+        assert pages == 3
+        assert paged_service.openai_service.calls == 1
+        assert not any("OFFSET" in sql.upper() for sql in paged_service.executed)
+
+    @pytest.mark.asyncio
+    async def test_duplicate_keys_larger_than_a_page_are_not_skipped(self, paged_service):
+        """Test a key shared by more rows than a page holds is returned whole"""
+        paged_service.openai_service.sql = "SELECT id, name FROM parks WHERE id >= 4"
+        response = await paged_service.process_query(
+            QueryRequest(question="Parks from 4", page_size=1)
+        )
+        pages = [[row["name"] for row in response.results]]
+
+        while response.next_token:
+            response = await paged_service.fetch_next_page(response.next_token)
+            pages.append([row["name"] for row in response.results])
+
+        assert pages[:3] == [["Park 4"], ["Park 5", "Park 5b"], ["Park 6"]]
+        assert sum(len(page) for page in pages) == 8
+
+    @pytest.mark.asyncio
+    async def test_results_without_id_are_not_paged(self, paged_service):
+        """Test queries without an id column are returned whole"""
+        paged_service.openai_service.sql = "SELECT name FROM parks"
+        response = await paged_service.process_query(
+            QueryRequest(question="Park names", page_size=4)
+        )
+        assert response.result_count == 11
+        assert response.next_token is None
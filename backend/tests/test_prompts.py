@@ -0,0 +1,215 @@
+"""
+Tests for the schema registry and schema-pruned prompts
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import openai_service as openai_module
+from app.services import schema_registry as registry_module
+from app.services.openai_service import OpenAIService
+from app.services.prompts import STATIC_PROMPT, PromptBuilder
+from app.services.schema_registry import DEFAULT_TABLES, SchemaRegistry, build_registry
+
+GEOMETRY_ROWS = [
+    ("cafes", "geom", "POINT", 4326),
+    ("parks", "geom", "POLYGON", 4326),
+    ("trees", "location", "POINT", 4326),
+]
+
+COLUMN_ROWS = [
+    ("cafes", "id", "integer", "int4", None, None),
+    ("cafes", "name", "text", "text", None, None),
+    ("cafes", "geom", "USER-DEFINED", "geometry", None, None),
+    ("cafes", "address", "text", "text", None, None),
+    ("parks", "id", "integer", "int4", None, None),
+    ("parks", "name", "text", "text", None, None),
+    ("parks", "geom", "USER-DEFINED", "geometry", None, None),
+    ("parks", "area", "double precision", "float8", "שטח", None),
+    ("trees", "id", "integer", "int4", None, "Street trees"),
+    ("trees", "species", "text", "text", "Latin species name", "Street trees"),
+    ("trees", "location", "USER-DEFINED", "geometry", None, "Street trees"),
+    ("geo_table_versions", "table_name", "text", "text", None, None),
+]
+
+
+@pytest.fixture
+def builder():
+    return PromptBuilder(SchemaRegistry(DEFAULT_TABLES))
+
+
+class TestSchemaRegistry:
+    """Tests for building the registry from the catalog"""
+
+    def test_catalog_tables_are_registered(self):
+        registry = build_registry(COLUMN_ROWS, GEOMETRY_ROWS)
+
+        # Curated tables first, in curated order; non-spatial tables are skipped
+        assert registry.names == ["cafes", "parks", "trees"]
+
+    def test_curated_descriptions_win_over_comments(self):
+        parks = build_registry(COLUMN_ROWS, GEOMETRY_ROWS).get("parks")
+
+        assert parks.description == "Parks and green spaces"
+        assert parks.columns[3] == ("area", "double precision", "in square meters")
+        assert parks.columns[2].data_type == "geometry, SRID 4326 - Polygon"
+        assert "park" in parks.keywords
+
+    def test_uncurated_table_is_described_from_comments(self):
+        trees = build_registry(COLUMN_ROWS, GEOMETRY_ROWS).get("trees")
+
+        assert trees.description == "Street trees"
+        assert trees.geometry_type == "Point"
+        assert trees.column_names == ["id", "species", "location"]
+        assert trees.columns[1].description == "Latin species name"
+
+    def test_version_follows_content(self):
+        assert SchemaRegistry(DEFAULT_TABLES).version == SchemaRegistry(DEFAULT_TABLES).version
+        assert SchemaRegistry(DEFAULT_TABLES).version != SchemaRegistry(DEFAULT_TABLES[:2]).version
+
+
+class TestPromptPruning:
+    """Tests for selecting the tables, columns and examples a question needs"""
+
+    @pytest.mark.parametrize("question, tables", [
+        ("Show all parks larger than 5000 square meters", ["parks"]),
+        ("Find cafes within 200m of the largest park", ["cafes", "parks"]),
+        ("Cafes on Dizengoff street", ["cafes", "roads"]),
+        ("מצא תכניות שמכילות בתי קפה", ["cafes", "plans"]),
+        ("Which areas gained the most housing units?", ["plans"]),
+    ])
+    def test_relevant_tables(self, builder, question, tables):
+        assert builder.relevant_tables(question) == tables
+
+    def test_unmatched_question_gets_every_table(self, builder):
+        assert builder.relevant_tables("What is here?") == ["cafes", "parks", "roads", "plans"]
+
+    def test_prompt_only_describes_selected_tables(self, builder):
+        prompt = builder.build("Show all parks larger than 5000 square meters")
+
+        assert prompt.tables == ("parks",)
+        assert "Table: parks" in prompt.system
+        assert "Table: cafes" not in prompt.system
+        # Only examples whose tables are all in the prompt
+        assert prompt.examples == 1
+        assert "FROM parks\n" in prompt.system
+        assert "FROM cafes c" not in prompt.system
+
+    def test_wide_table_keeps_core_and_mentioned_columns(self, builder):
+        system = builder.build("Plans with the most new housing units").system
+
+        assert "quantity_delta_120" in system
+        assert "pl_name" in system
+        assert "pl_url" not in system
+        assert "pl_date_8" not in system
+
+    def test_static_prefix_and_stable_bytes(self, builder):
+        first = builder.build("Show all parks larger than 5000 square meters")
+        second = builder.build("Parks bigger than 8000 square meters")
+
+        assert first.system.startswith(STATIC_PROMPT + "\n\nDatabase Schema:\n")
+        assert first.system == second.system
+
+    def test_pruning_shrinks_the_prompt(self, builder):
+        full = builder.build("Show all parks", prune=False)
+        pruned = builder.build("Show all parks")
+
+        assert full.tables == ("cafes", "parks", "roads", "plans")
+        assert len(pruned.system) < len(full.system) / 2
+
+    def test_version_follows_registry(self, builder):
+        other = PromptBuilder(SchemaRegistry(DEFAULT_TABLES[:3]))
+
+        assert builder.version == PromptBuilder(SchemaRegistry(DEFAULT_TABLES)).version
+        assert builder.version != other.version
+
+
+class TestOpenAIUsage:
+    """Tests for the prompt sent to the LLM and usage accounting"""
+
+    @pytest.fixture
+    def service(self):
+        service = OpenAIService()
+        service.requests = []
+
+        async def create(**kwargs):
+            service.requests.append(kwargs)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content="```sql\nSELECT 1\n```"))],
+                usage=SimpleNamespace(
+                    prompt_tokens=400, completion_tokens=12,
+                    prompt_tokens_details=SimpleNamespace(cached_tokens=256)
+                )
+            )
+
+        service.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+        return service
+
+    @pytest.mark.asyncio
+    async def test_pruned_prompt_is_sent_and_usage_recorded(self, service):
+        sql = await service.generate_sql("Show all parks larger than 5000 square meters")
+
+        system = service.requests[0]["messages"][0]["content"]
+        assert sql == "SELECT 1"
+        assert "Table: parks" in system and "Table: plans" not in system
+
+        stats = service.stats()
+        assert stats["calls"] == 1
+        assert stats["prompt_tokens"] == 400
+        assert stats["cached_prompt_tokens"] == 256
+        assert stats["completion_tokens"] == 12
+        assert stats["mean_tables"] == 1.0
+
+    def test_prompt_version_follows_registry(self, service, monkeypatch):
+        version = service.prompt_version
+        monkeypatch.setattr(registry_module, "_schema_registry", SchemaRegistry(DEFAULT_TABLES[:2]))
+
+        assert service.prompt_version != version
+
+    def test_prompt_version_follows_model(self, service, monkeypatch):
+        version = service.prompt_version
+        monkeypatch.setattr(openai_module.settings, "openai_model", "another-model")
+
+        assert service.prompt_version != version
+
+    @pytest.mark.asyncio
+    async def test_streamed_generation_records_usage(self, service):
+        class Stream:
+            closed = False
+
+            def __init__(self, chunks):
+                self.chunks = chunks
+
+            def __aiter__(self):
+                return self._iterate()
+
+            async def _iterate(self):
+                for chunk in self.chunks:
+                    yield chunk
+
+            async def close(self):
+                Stream.closed = True
+
+        def chunk(content=None, usage=None):
+            delta = SimpleNamespace(delta=SimpleNamespace(content=content))
+            return SimpleNamespace(choices=[delta] if content is not None else [], usage=usage)
+
+        async def create(**kwargs):
+            service.requests.append(kwargs)
+            return Stream([
+                chunk("```sql\nSELECT "), chunk("1"), chunk(""), chunk("\n```"),
+                chunk(usage=SimpleNamespace(prompt_tokens=400, completion_tokens=6)),
+            ])
+
+        service.client.chat.completions.create = create
+
+        deltas = [delta async for delta in service.stream_sql("Show all parks")]
+
+        assert "".join(deltas) == "```sql\nSELECT 1\n```"
+        assert service.requests[0]["stream"] is True
+        assert Stream.closed
+        assert service.stats()["prompt_tokens"] == 400
+        assert service.stats()["completion_tokens"] == 6
@@ -0,0 +1,135 @@
+"""
+Cost guard and execution strategy tests
+"""
+
+import asyncio
+
+import pytest
+
+from app.services.query_planner import (
+    BUFFERED,
+    FAST_LANE,
+    HEAVY,
+    LIGHT,
+    MEDIUM,
+    SLOW_LANE,
+    STREAMING,
+    QueryPlanner,
+    QueryTooExpensive,
+    current_tuning,
+    estimate_plan,
+    session_tuning
+)
+
+
+def plan_node(total_cost, rows, width=100, startup_cost=0.0, node_type="Seq Scan"):
+    return {
+        "Node Type": node_type,
+        "Startup Cost": startup_cost,
+        "Total Cost": total_cost,
+        "Plan Rows": rows,
+        "Plan Width": width,
+    }
+
+
+class TestEstimatePlan:
+    """Test plans are classified into query classes, lanes and strategies"""
+
+    @pytest.mark.parametrize("cost,query_class,lane", [
+        (50.0, LIGHT, FAST_LANE),
+        (5e4, MEDIUM, FAST_LANE),
+        (5e6, HEAVY, SLOW_LANE),
+    ])
+    def test_cost_picks_class_and_lane(self, cost, query_class, lane):
+        """Test estimated cost decides the class and lane"""
+        estimate = estimate_plan(plan_node(cost, 10))
+
+        assert estimate.query_class == query_class
+        assert estimate.lane == lane
+
+    def test_row_limit_scales_cost_like_a_limit_node(self):
+        """Test a LIMIT only pays for the fraction of rows it reads"""
+        estimate = estimate_plan(plan_node(2e6, 1_000_000, startup_cost=100.0), row_limit=1000)
+
+        assert estimate.total_cost == pytest.approx(100 + (2e6 - 100) / 1000)
+        assert estimate.query_class == LIGHT
+        assert estimate.rows == 1_000_000
+
+    def test_blocking_plan_keeps_its_startup_cost(self):
+        """Test a sort over everything stays expensive even with a LIMIT"""
+        estimate = estimate_plan(
+            plan_node(3e6, 1_000_000, startup_cost=2.9e6, node_type="Sort"), row_limit=10
+        )
+        assert estimate.query_class == HEAVY
+
+    def test_small_results_are_buffered(self):
+        """Test results expected to fit the budget are fetched in one round trip"""
+        assert estimate_plan(plan_node(10.0, 50), row_limit=101).strategy == BUFFERED
+
+    @pytest.mark.parametrize("rows,width,row_limit", [
+        (5000, 100, 101),  # expected to overrun the row budget
+        (50_000, 1000, None),  # too many bytes to buffer
+    ])
+    def test_large_results_are_streamed(self, rows, width, row_limit):
+        """Test large or truncated results go through the cursor"""
+        estimate = estimate_plan(plan_node(10.0, rows, width), row_limit=row_limit)
+        assert estimate.strategy == STREAMING
+
+
+class TestQueryPlanner:
+    """Test the cost guard and the slow lane"""
+
+    def test_expensive_query_is_rejected(self):
+        """Test estimates over MAX_QUERY_COST raise a ValueError"""
+        planner = QueryPlanner(2)
+
+        with pytest.raises(QueryTooExpensive, match="too expensive"):
+            planner.check(estimate_plan(plan_node(1e12, 10)))
+        assert planner.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_lane_bounds_concurrency(self):
+        """Test heavy queries wait for a slow-lane slot"""
+        planner = QueryPlanner(2)
+        heavy = estimate_plan(plan_node(5e6, 10))
+        running = 0
+        peak = 0
+
+        async def run():
+            nonlocal running, peak
+            async with planner.lane(heavy):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.02)
+                running -= 1
+
+        await asyncio.gather(*(run() for _ in range(6)))
+
+        assert peak == 2
+        assert planner.stats()[SLOW_LANE] == 6
+        assert planner.stats()["slow_lane_waiting"] == 0
+
+    @pytest.mark.asyncio
+    async def test_light_queries_skip_the_slow_lane(self):
+        """Test light queries are not held up by busy slow-lane slots"""
+        planner = QueryPlanner(1)
+        await planner.slow_lane.acquire()
+
+        async with planner.lane(estimate_plan(plan_node(10.0, 10))):
+            pass
+
+        assert planner.stats()[FAST_LANE] == 1
+
+    @pytest.mark.asyncio
+    async def test_unplanned_queries_run_directly(self):
+        """Test queries without an estimate are counted and run"""
+        planner = QueryPlanner(1)
+        async with planner.lane(None):
+            pass
+        assert planner.stats()["unplanned"] == 1
+
+    def test_session_tuning_follows_query_class(self):
+        """Test the class's SET LOCAL settings are in effect only inside the block"""
+        with session_tuning(estimate_plan(plan_node(5e6, 10))):
+            assert current_tuning.get()["work_mem"] == "64MB"
+        assert current_tuning.get() == {}
@@ -0,0 +1,589 @@
+"""
+Query service tests
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.models.schemas import BatchQueryRequest, QueryRequest
+from app.services import query_service as query_service_module
+from app.services.database import RenderedResult
+from app.services.deadline import DeadlineExceeded
+from app.services.query_log import QueryLog, read_query_log
+from app.services.query_planner import current_tuning
+from conftest import SAMPLE_COLUMNS, SAMPLE_ROWS, SAMPLE_SQL
+
+
+class TestAsyncPipeline:
+    """Test the query pipeline does not block the event loop"""
+
+    @pytest.mark.asyncio
+    async def test_process_query_returns_formatted_results(self, query_service):
+        """Test process_query returns SQL and parsed GeoJSON"""
+        response = await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        assert response.sql == SAMPLE_SQL
+        assert response.result_count == 1
+        assert response.results[0]["geojson"]["type"] == "Point"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_queries_overlap(self, query_service):
+        """Test concurrent questions run in parallel on one event loop"""
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            query_service.process_query(QueryRequest(question=f"Show all cafes {i}"))
+            for i in range(10)
+        ))
+        elapsed = time.perf_counter() - start
+
+        # Ten sequential runs would take at least 2.5s
+        assert elapsed < 1.0
+
+
+class TestTableVersions:
+    """Test table version sync at startup"""
+
+    @pytest.mark.asyncio
+    async def test_starts_without_postgres_and_retries(self, query_service, monkeypatch):
+        """Test an unreachable database does not stop startup and LISTEN is retried"""
+        monkeypatch.setattr(query_service_module.settings, "schema_introspection_enabled", False)
+        monkeypatch.setattr(query_service_module, "VERSION_SYNC_RETRY_INTERVAL", 0.01)
+        attempts = []
+
+        async def listen(channel, callback):
+            attempts.append(channel)
+            if len(attempts) < 3:
+                raise ConnectionRefusedError("Connect call failed")
+            return "listener"
+
+        async def get_table_versions():
+            return {"parks": 4}
+
+        query_service.db_service.listen = listen
+        query_service.db_service.get_table_versions = get_table_versions
+
+        await query_service.start()
+        await asyncio.wait_for(query_service._version_sync_task, timeout=1)
+
+        assert len(attempts) == 3
+        assert query_service._version_listener == "listener"
+        stats = await query_service.result_cache.stats()
+        assert stats["table_versions"] == {"parks": 4}
+
+
+class TestResultBudget:
+    """Test oversized results are truncated and flagged"""
+
+    @pytest.mark.asyncio
+    async def test_truncated_result_reports_estimate(self, query_service):
+        """Test max_rows cuts the result and surfaces the planner estimate"""
+        rows = [(i, f"Cafe {i}", SAMPLE_ROWS[0][2]) for i in range(1, 21)]
+
+        async def stream_query(sql, batch_size):
+            yield SAMPLE_COLUMNS, rows
+
+        async def explain(sql):
+            return {"Plan Rows": 20}
+
+        query_service.db_service.stream_query = stream_query
+        query_service.db_service.explain = explain
+
+        response = await query_service.process_query(
+            QueryRequest(question="Show all cafes", max_rows=5)
+        )
+
+        assert response.result_count == 5
+        assert response.truncated is True
+        assert response.estimated_total == 20
+
+
+class TestFeatureCollection:
+    """Test the PostGIS-built FeatureCollection mode"""
+
+    @pytest.mark.asyncio
+    async def test_render_feature_collection_is_cached(self, query_service):
+        """Test rendered collections go through the result cache"""
+        calls = []
+
+        async def execute_feature_collection(sql, max_rows, max_bytes):
+            calls.append((sql, max_rows))
+            return RenderedResult(b'{"type":"FeatureCollection","features":[]}')
+
+        query_service.db_service.execute_feature_collection = execute_feature_collection
+        request = QueryRequest(question="Show all cafes", max_rows=50)
+
+        sql, first = await query_service.render_feature_collection(request)
+        _, second = await query_service.render_feature_collection(request)
+
+        assert sql == SAMPLE_SQL
+        assert first.body == second.body
+        assert calls == [(SAMPLE_SQL, 50)]
+
+
+class TestVectorTiles:
+    """Test vector tiles rendered from a query handle"""
+
+    @pytest.fixture
+    def tile_calls(self, query_service):
+        calls = []
+
+        async def render_tile(sql, columns, z, x, y):
+            calls.append((z, x, y))
+            return b"tile"
+
+        query_service.db_service.render_tile = render_tile
+        return calls
+
+    @pytest.mark.asyncio
+    async def test_tiles_are_cached_per_coordinate(self, query_service, tile_calls):
+        """Test tiles render from the handle and are served from the tile cache"""
+        response = await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        assert await query_service.render_tile(response.query_handle, 3, 4, 2) == b"tile"
+        assert await query_service.render_tile(response.query_handle, 3, 4, 2) == b"tile"
+        await query_service.render_tile(response.query_handle, 3, 4, 3)
+
+        assert tile_calls == [(3, 4, 2), (3, 4, 3)]
+
+    @pytest.mark.asyncio
+    async def test_table_change_invalidates_tiles(self, query_service, tile_calls):
+        """Test a table version bump re-renders cached tiles"""
+        response = await query_service.process_query(QueryRequest(question="Show all cafes"))
+        await query_service.render_tile(response.query_handle, 0, 0, 0)
+
+        await query_service.tile_cache.bump_tables("cafes")
+        await query_service.render_tile(response.query_handle, 0, 0, 0)
+
+        assert tile_calls == [(0, 0, 0), (0, 0, 0)]
+
+    @pytest.mark.asyncio
+    async def test_invalid_tiles_are_rejected(self, query_service, tile_calls):
+        """Test out-of-range coordinates and bad handles raise ValueError"""
+        response = await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        with pytest.raises(ValueError):
+            await query_service.render_tile(response.query_handle, 2, 4, 0)
+        with pytest.raises(ValueError):
+            await query_service.render_tile("not-a-handle", 0, 0, 0)
+        assert tile_calls == []
+
+
+class TestGeometryDetail:
+    """Test zoom hints select simplified geometry"""
+
+    @pytest.mark.asyncio
+    async def test_zoom_hint_rewrites_executed_sql(self, query_service):
+        """Test a zoomed-out request runs against a simplified column"""
+        query_service.openai_service.sql = (
+            "SELECT id, pl_name, ST_AsGeoJSON(geom) as geojson FROM plans"
+        )
+        executed = []
+
+        async def stream_query(sql, batch_size):
+            executed.append(sql)
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        query_service.db_service.stream_query = stream_query
+
+        response = await query_service.process_query(
+            QueryRequest(question="Show all plans", zoom=6)
+        )
+
+        assert "ST_AsGeoJSON(geom_lod3, 3)" in executed[0]
+        assert response.sql.startswith("SELECT id, pl_name, ST_AsGeoJSON(geom_lod3, 3)")
+
+
+class TestCostGuard:
+    """Test the EXPLAIN estimate gates and shapes execution"""
+
+    @staticmethod
+    def _explain_returning(total_cost, rows=10, width=50, startup_cost=0.0):
+        async def explain(sql):
+            return {
+                "Node Type": "Seq Scan", "Startup Cost": startup_cost, "Total Cost": total_cost,
+                "Plan Rows": rows, "Plan Width": width,
+            }
+        return explain
+
+    @pytest.mark.asyncio
+    async def test_plan_estimate_is_reported(self, query_service):
+        """Test the response carries the estimate and small results are buffered"""
+        query_service.db_service.explain = self._explain_returning(120.0)
+        tuning = []
+
+        async def execute_query(sql):
+            tuning.append(current_tuning.get())
+            return SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        query_service.db_service.execute_query = execute_query
+
+        response = await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        assert response.result_count == 1
+        assert response.plan["query_class"] == "light"
+        assert response.plan["strategy"] == "buffered"
+        assert response.plan["total_cost"] == 120.0
+        assert tuning == [{"work_mem": "4MB", "max_parallel_workers_per_gather": "0"}]
+
+    @pytest.mark.asyncio
+    async def test_expensive_query_is_rejected_before_execution(self, query_service):
+        """Test queries over the cost limit never run"""
+        query_service.db_service.explain = self._explain_returning(
+            1e12, rows=10 ** 9, startup_cost=1e12
+        )
+        executed = []
+
+        async def stream_query(sql, batch_size):
+            executed.append(sql)
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        query_service.db_service.stream_query = stream_query
+
+        with pytest.raises(ValueError, match="too expensive"):
+            await query_service.process_query(QueryRequest(question="Join everything"))
+
+        assert executed == []
+        assert (await query_service.get_stats())["planner"]["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_holds_slow_lane_until_finished(self, query_service):
+        """Test a heavy streamed query keeps its slow-lane slot while streaming"""
+        query_service.db_service.explain = self._explain_returning(5e6, rows=10 ** 6)
+
+        _, body = await query_service.stream_query(
+            QueryRequest(question="Show all plans"), "ndjson"
+        )
+        assert query_service.planner.slow_lane._value == query_service_module.settings.slow_lane_concurrency - 1
+
+        async for _ in body:
+            pass
+        assert query_service.planner.slow_lane._value == query_service_module.settings.slow_lane_concurrency
+
+
+class TestSQLRewrites:
+    """Test index-aware rewrites run between generation and execution"""
+
+    DWITHIN_SQL = (
+        "SELECT c.id, c.name, ST_AsGeoJSON(c.geom) as geojson FROM cafes c, parks p "
+        "WHERE ST_DWithin(c.geom::geography, p.geom::geography, 200)"
+    )
+
+    @pytest.mark.asyncio
+    async def test_rewrites_are_executed_and_reported(self, query_service):
+        """Test the prefiltered SQL is what runs and the response lists the rewrite"""
+        query_service.openai_service.sql = self.DWITHIN_SQL
+        executed = []
+
+        async def stream_query(sql, batch_size):
+            executed.append(sql)
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        query_service.db_service.stream_query = stream_query
+
+        response = await query_service.process_query(
+            QueryRequest(question="Cafes within 200 meters of a park")
+        )
+
+        assert response.rewrites == ["bbox_prefilter"]
+        assert "c.geom && ST_EXPAND(p.geom" in executed[0]
+        assert executed[0].startswith(response.sql)
+        assert (await query_service.get_stats())["rewrites"] == {"bbox_prefilter": 1}
+
+    @pytest.mark.asyncio
+    async def test_rewrites_can_be_disabled(self, query_service, monkeypatch):
+        """Test SQL_REWRITE_ENABLED=false executes the generated SQL as-is"""
+        monkeypatch.setattr(query_service_module.settings, "sql_rewrite_enabled", False)
+        query_service.openai_service.sql = self.DWITHIN_SQL
+
+        response = await query_service.process_query(
+            QueryRequest(question="Cafes within 200 meters of a park")
+        )
+
+        assert response.rewrites == []
+        assert response.sql == self.DWITHIN_SQL
+
+    @pytest.mark.asyncio
+    async def test_executed_sql_is_logged(self, query_service, tmp_path):
+        """Test the query log records the rewritten SQL for every request"""
+        path = str(tmp_path / "queries.jsonl")
+        query_service.query_log = QueryLog(path)
+        query_service.openai_service.sql = self.DWITHIN_SQL
+        request = QueryRequest(question="Cafes within 200 meters of a park")
+
+        response = await query_service.process_query(request)
+        await query_service.process_query(request)
+        await query_service.close()
+
+        entries = list(read_query_log(path))
+        assert len(entries) == 2
+        assert entries[0]["sql"] == response.sql
+        assert entries[0]["rewrites"] == ["bbox_prefilter"]
+
+
+class TestSQLCache:
+    """Test the question -> SQL cache in front of the LLM"""
+
+    @pytest.mark.asyncio
+    async def test_repeated_question_hits_cache(self, query_service):
+        """Test normalized repeats of a question skip the LLM"""
+        await query_service.process_query(QueryRequest(question="Show all cafes"))
+        await query_service.process_query(QueryRequest(question="  show ALL cafes?"))
+
+        assert query_service.openai_service.calls == 1
+        stats = (await query_service.get_stats())["sql_cache"]
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_generation_is_negatively_cached(self, query_service):
+        """Test SQL failing validation is cached as an error"""
+        query_service.openai_service.sql = "DELETE FROM cafes"
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await query_service.process_query(QueryRequest(question="Remove cafes"))
+
+        assert query_service.openai_service.calls == 1
+        assert (await query_service.get_stats())["sql_negative_cache"]["hits"] == 1
+
+
+class TestCoalescing:
+    """Test single-flight coalescing of identical in-flight questions"""
+
+    @pytest.mark.asyncio
+    async def test_identical_questions_share_generation_and_execution(self, query_service):
+        """Test concurrent identical questions trigger one LLM call and one query"""
+        executions = 0
+
+        async def stream_query(sql, batch_size):
+            nonlocal executions
+            executions += 1
+            await asyncio.sleep(0.05)
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        query_service.db_service.stream_query = stream_query
+        query_service.result_cache = None
+
+        responses = await asyncio.gather(*(
+            query_service.process_query(QueryRequest(question="Show all cafes!"))
+            for _ in range(20)
+        ))
+
+        assert all(r.result_count == 1 for r in responses)
+        assert query_service.openai_service.calls == 1
+        assert executions == 1
+        stats = (await query_service.get_stats())["coalescing"]
+        assert stats["generation"]["coalesced"] == 19
+        assert stats["execution"]["coalesced"] == 19
+
+    @pytest.mark.asyncio
+    async def test_failures_propagate_to_all_waiters(self, query_service):
+        """Test every coalesced waiter receives the shared error"""
+        query_service.openai_service.sql = "DROP TABLE cafes"
+
+        results = await asyncio.gather(
+            *(query_service.process_query(QueryRequest(question="Drop cafes")) for _ in range(5)),
+            return_exceptions=True
+        )
+
+        assert all(isinstance(r, ValueError) for r in results)
+        assert query_service.openai_service.calls == 1
+
+
+class TestStreaming:
+    """Test streamed GeoJSON / NDJSON output"""
+
+    @pytest.fixture
+    def streaming_service(self, query_service):
+        """QueryService whose database streams two batches"""
+        async def stream_query(sql, batch_size):
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+            yield SAMPLE_COLUMNS, []
+
+        query_service.db_service.stream_query = stream_query
+        return query_service
+
+    @pytest.mark.asyncio
+    async def test_stream_geojson_feature_collection(self, streaming_service):
+        """Test batches are emitted as one FeatureCollection"""
+        sql, body = await streaming_service.stream_query(
+            QueryRequest(question="Show all cafes"), "geojson"
+        )
+        collection = json.loads(b"".join([chunk async for chunk in body]))
+
+        assert sql == SAMPLE_SQL
+        assert len(collection["features"]) == 2
+        stats = (await streaming_service.get_stats())["streaming"]
+        assert stats["rows"] == 2
+        assert stats["ttfb_last"] is not None
+
+    @pytest.mark.asyncio
+    async def test_stream_ndjson(self, streaming_service):
+        """Test NDJSON emits one Feature per line"""
+        _, body = await streaming_service.stream_query(
+            QueryRequest(question="Show all cafes"), "ndjson"
+        )
+        lines = b"".join([chunk async for chunk in body]).splitlines()
+        assert [json.loads(line)["geometry"]["type"] for line in lines] == ["Point", "Point"]
+
+
+class TestProgressEvents:
+    """Test the progress event stream"""
+
+    @staticmethod
+    async def collect(service, question="Show all cafes", **kwargs):
+        return [event async for event in service.stream_events(QueryRequest(question=question, **kwargs))]
+
+    @pytest.mark.asyncio
+    async def test_events_in_order(self, query_service):
+        """Test SQL deltas, validation, execution, rows and done are emitted in order"""
+        query_service.openai_service.chunks = ["```sql\nSELECT id, name, ", "ST_AsGeoJSON(geom) as geojson FROM cafes", "\n```"]
+
+        events = await self.collect(query_service)
+
+        names = [name for name, _ in events]
+        assert names == ["sql", "sql", "sql", "validated", "executing", "rows", "done"]
+        assert events[3][1] == {"sql": SAMPLE_SQL, "rewrites": []}
+        assert json.loads(events[5][1])["features"][0]["properties"]["name"] == "Test Cafe"
+        assert events[6][1]["result_count"] == 1 and events[6][1]["truncated"] is False
+
+    @pytest.mark.asyncio
+    async def test_generation_stops_at_end_of_statement(self, query_service):
+        """Test the LLM stream is closed as soon as the statement is complete"""
+        fake = query_service.openai_service
+        fake.chunks = [SAMPLE_SQL, ";", "\n\nThis query selects", " every cafe."]
+
+        events = await self.collect(query_service)
+
+        assert fake.streamed_chunks == 2
+        assert fake.stream_closed
+        assert dict(events)["validated"]["sql"] == SAMPLE_SQL + ";"
+        assert (await query_service.get_stats())["progress_streams"]["early_stops"] == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_statement_fails_before_execution(self, query_service):
+        """Test validation errors end the stream and are negatively cached"""
+        fake = query_service.openai_service
+        fake.chunks = ["DELETE FROM cafes;", " SELECT 1"]
+
+        with pytest.raises(ValueError):
+            await self.collect(query_service)
+        with pytest.raises(ValueError):
+            await self.collect(query_service)
+
+        assert fake.calls == 1
+        assert fake.streamed_chunks == 1
+
+    @pytest.mark.asyncio
+    async def test_cached_sql_skips_the_llm(self, query_service):
+        """Test a cached question sends the whole statement at once"""
+        await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        events = await self.collect(query_service)
+
+        assert events[0] == ("sql", {"delta": SAMPLE_SQL, "cached": True})
+        assert query_service.openai_service.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_rows_are_truncated_at_max_rows(self, query_service):
+        """Test no more than max_rows rows are sent"""
+        async def stream_query(sql, batch_size):
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS * 3
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS * 3
+
+        query_service.db_service.stream_query = stream_query
+
+        events = await self.collect(query_service, max_rows=4)
+
+        rows = [json.loads(data) for name, data in events if name == "rows"]
+        assert [len(batch["features"]) for batch in rows] == [3, 1]
+        assert events[-1][1]["result_count"] == 4
+        assert events[-1][1]["truncated"] is True
+
+
+class TestBatch:
+    """Test batches of questions"""
+
+    @staticmethod
+    async def collect(service, questions, timeout=10.0, **kwargs):
+        request = BatchQueryRequest(questions=questions, **kwargs)
+        return [outcome async for outcome in service.process_batch(request, timeout)]
+
+    @pytest.mark.asyncio
+    async def test_repeated_questions_are_answered_once(self, query_service):
+        """Test questions equal after normalization share one outcome"""
+        outcomes = await self.collect(
+            query_service, ["Show all cafes", "show all  cafes!", "Show all parks"]
+        )
+
+        assert sorted(outcome.indices for outcome in outcomes) == [[0, 1], [2]]
+        assert all(outcome.response.result_count == 1 for outcome in outcomes)
+        stats = (await query_service.get_stats())["batches"]
+        assert stats["questions"] == 3
+        assert stats["duplicates"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_questions_do_not_end_the_batch(self, query_service):
+        """Test invalid questions are reported in their outcome"""
+        outcomes = await self.collect(query_service, ["Show all cafes", "no", "Drop -- cafes"])
+
+        errors = {outcome.question: outcome.error for outcome in outcomes if outcome.error}
+        assert set(errors) == {"no", "Drop -- cafes"}
+        assert all(isinstance(error, ValueError) for error in errors.values())
+        assert (await query_service.get_stats())["batches"]["errors"] == 2
+
+    @pytest.mark.asyncio
+    async def test_generation_and_execution_are_bounded(self, query_service, monkeypatch):
+        """Test at most BATCH_CONCURRENCY generations and BATCH_EXECUTION_CONCURRENCY queries run at once"""
+        monkeypatch.setattr(query_service_module.settings, "batch_concurrency", 3)
+        monkeypatch.setattr(query_service_module.settings, "batch_execution_concurrency", 1)
+        query_service.result_cache = None
+        running = {"generations": 0, "executions": 0}
+        peak = {"generations": 0, "executions": 0}
+
+        async def track(kind, seconds):
+            running[kind] += 1
+            peak[kind] = max(peak[kind], running[kind])
+            await asyncio.sleep(seconds)
+            running[kind] -= 1
+
+        async def generate_sql(question, tier=None):
+            await track("generations", 0.02)
+            return f"{SAMPLE_SQL} WHERE id > {question.split()[-1]}"
+
+        async def stream_query(sql, batch_size):
+            await track("executions", 0.02)
+            yield SAMPLE_COLUMNS, SAMPLE_ROWS
+
+        query_service.openai_service.generate_sql = generate_sql
+        query_service.db_service.stream_query = stream_query
+
+        outcomes = await self.collect(query_service, [f"Cafes with id over {n}" for n in range(10)])
+
+        assert len(outcomes) == 10
+        assert all(outcome.error is None for outcome in outcomes)
+        assert peak == {"generations": 3, "executions": 1}
+
+    @pytest.mark.asyncio
+    async def test_each_question_has_its_own_deadline(self, query_service, monkeypatch):
+        """Test a slow question times out without failing the others"""
+        monkeypatch.setattr(query_service_module.settings, "batch_concurrency", 1)
+
+        async def generate_sql(question, tier=None):
+            await asyncio.sleep(1.0 if "slow" in question else 0.05)
+            return SAMPLE_SQL
+
+        query_service.openai_service.generate_sql = generate_sql
+
+        outcomes = await self.collect(
+            query_service, ["Show slow cafes", "Show all cafes", "Show all parks"], timeout=0.2
+        )
+
+        errors = [outcome for outcome in outcomes if outcome.error]
+        assert [outcome.question for outcome in errors] == ["Show slow cafes"]
+        assert isinstance(errors[0].error, DeadlineExceeded)
+        assert (await query_service.get_stats())["cancellations"]["deadline"] == 1
@@ -0,0 +1,192 @@
+"""
+Result cache tests
+"""
+
+import asyncio
+import datetime
+import decimal
+import sqlite3
+from typing import List, NamedTuple, Tuple
+
+import pytest
+
+from app.services.result_cache import ResultCache
+from app.services.sql_utils import (
+    canonicalize_sql,
+    fingerprint_sql,
+    referenced_tables,
+    untracked_tables
+)
+
+PARKS_SQL = "SELECT id, name FROM parks WHERE area > 5000"
+COLUMNS = ["id", "name"]
+ROWS = [(1, "Meir Park")]
+
+
+class Rows(NamedTuple):
+    columns: List[str]
+    rows: List[Tuple]
+
+
+def make_cache(path, **overrides):
+    """Create a ResultCache with small test bounds"""
+    options = dict(
+        ttl=60, stale_ttl=60, swr_min_hits=1,
+        max_entries=100, max_bytes=10_000_000, max_entry_bytes=1_000_000
+    )
+    options.update(overrides)
+    return ResultCache(path=str(path), **options)
+
+
+class CountingLoader:
+    """Loader that counts database executions"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, sql):
+        self.calls += 1
+        return COLUMNS, ROWS
+
+
+class TestSQLFingerprint:
+    """Test SQL canonicalization"""
+
+    def test_formatting_does_not_change_fingerprint(self):
+        """Test whitespace, case and trailing semicolons are ignored"""
+        assert fingerprint_sql("SELECT id FROM parks WHERE area > 5000;") == \
+            fingerprint_sql("select id\n  from parks\n where area>5000")
+
+    def test_literals_are_preserved(self):
+        """Test quoted literals keep their case and spacing"""
+        assert "'Meir  Park'" in canonicalize_sql("SELECT * FROM parks WHERE name = 'Meir  Park'")
+        assert fingerprint_sql("SELECT 1 WHERE name = 'A'") != fingerprint_sql("SELECT 1 WHERE name = 'a'")
+
+    def test_referenced_tables(self):
+        """Test tables are detected outside of literals"""
+        sql = "SELECT p.id FROM plans p, cafes c WHERE p.pl_name = 'parks'"
+        assert referenced_tables(sql) == ["cafes", "plans"]
+
+    def test_untracked_tables(self):
+        """Test relations without version tracking are detected"""
+        sql = (
+            "WITH near AS (SELECT id FROM cafes) SELECT * FROM near, public.parks p, "
+            "districts d, generate_series(1, 3) JOIN zones z ON true"
+        )
+        assert untracked_tables(sql, known=["districts"]) == ["districts", "zones"]
+
+
+class TestResultCache:
+    """Test result caching and invalidation"""
+
+    @pytest.mark.asyncio
+    async def test_second_lookup_hits(self, tmp_path):
+        """Test identical SQL is served from the cache"""
+        cache = make_cache(tmp_path / "results.sqlite3")
+        loader = CountingLoader()
+
+        assert await cache.get_or_load(PARKS_SQL, loader) == (COLUMNS, ROWS)
+        assert await cache.get_or_load(PARKS_SQL.lower() + ";", loader) == (COLUMNS, ROWS)
+        assert loader.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_table_version_bump_invalidates(self, tmp_path):
+        """Test bumping a referenced table invalidates the entry"""
+        cache = make_cache(tmp_path / "results.sqlite3")
+        loader = CountingLoader()
+
+        await cache.get_or_load(PARKS_SQL, loader)
+        await cache.bump_tables("cafes")
+        await cache.get_or_load(PARKS_SQL, loader)
+        assert loader.calls == 1
+
+        await cache.set_table_versions({"parks": 7})
+        await cache.get_or_load(PARKS_SQL, loader)
+        assert loader.calls == 2
+        assert (await cache.stats())["invalidations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_store_is_shared_between_instances(self, tmp_path):
+        """Test a second worker sees entries written by the first"""
+        path = tmp_path / "results.sqlite3"
+        loader = CountingLoader()
+
+        await make_cache(path).get_or_load(PARKS_SQL, loader)
+        await make_cache(path).get_or_load(PARKS_SQL, loader)
+        assert loader.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_popular_entry_is_served_and_refreshed(self, tmp_path):
+        """Test stale-while-revalidate for popular entries"""
+        cache = make_cache(tmp_path / "results.sqlite3", ttl=0.05)
+        loader = CountingLoader()
+
+        await cache.get_or_load(PARKS_SQL, loader)
+        await cache.get_or_load(PARKS_SQL, loader)
+        await asyncio.sleep(0.1)
+
+        assert await cache.get_or_load(PARKS_SQL, loader) == (COLUMNS, ROWS)
+        await asyncio.sleep(0.05)
+
+        assert loader.calls == 2
+        assert (await cache.stats())["stale_hits"] == 1
+        assert (await cache.stats())["refreshes"] == 1
+
+    @pytest.mark.asyncio
+    async def test_eviction_respects_max_entries(self, tmp_path):
+        """Test the least recently used entries are evicted"""
+        cache = make_cache(tmp_path / "results.sqlite3", max_entries=2)
+        loader = CountingLoader()
+
+        for area in (1, 2, 3):
+            await cache.get_or_load(f"SELECT id FROM parks WHERE area > {area}", loader)
+
+        assert (await cache.stats())["entries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_values_round_trip_as_json(self, tmp_path):
+        """Test records, tuples, bytes and SQL scalar types survive the store"""
+        path = tmp_path / "results.sqlite3"
+        value = Rows(["id", "area", "opened", "tile"], [
+            (1, decimal.Decimal("5000.25"), datetime.date(2024, 5, 1), b"\x1a\x02"),
+        ])
+
+        async def loader(sql):
+            return value
+
+        await make_cache(path, record_types=(Rows,)).get_or_load(PARKS_SQL, loader)
+        cached, _ = await make_cache(path, record_types=(Rows,)).get(PARKS_SQL)
+
+        assert cached.value == value
+        assert isinstance(cached.value, Rows)
+        with sqlite3.connect(path) as conn:
+            payload = conn.execute("SELECT payload FROM entries").fetchone()[0]
+        assert payload.startswith(b"{")
+
+    @pytest.mark.asyncio
+    async def test_unreadable_entry_is_a_miss(self, tmp_path):
+        """Test an entry that does not decode is dropped instead of loaded"""
+        path = tmp_path / "results.sqlite3"
+        cache = make_cache(path)
+        loader = CountingLoader()
+        await cache.get_or_load(PARKS_SQL, loader)
+        with sqlite3.connect(path) as conn:
+            conn.execute("UPDATE entries SET payload = ?", (b"\x80\x04K\x01.",))
+
+        assert await cache.get_or_load(PARKS_SQL, loader) == (COLUMNS, ROWS)
+        assert loader.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_untracked_tables_are_not_cached(self, tmp_path):
+        """Test queries that no version bump could invalidate always run"""
+        cache = make_cache(tmp_path / "results.sqlite3")
+        loader = CountingLoader()
+        sql = "SELECT p.id FROM parks p JOIN neighborhoods n ON ST_Within(p.geom, n.geom)"
+
+        await cache.get_or_load(sql, loader)
+        await cache.get_or_load(sql, loader)
+
+        assert loader.calls == 2
+        stats = await cache.stats()
+        assert stats["entries"] == 0
+        assert stats["uncacheable"] == 2
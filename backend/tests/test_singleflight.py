@@ -0,0 +1,94 @@
+"""
+Single-flight tests
+"""
+
+import asyncio
+
+import pytest
+
+from app.services.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    current_deadline,
+    remaining_time,
+    run_with_deadline
+)
+from app.services.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    """Test request coalescing primitive"""
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_others(self):
+        """Test cancelling one waiter leaves the shared operation running"""
+        flight = SingleFlight("test")
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return 42
+
+        first = asyncio.create_task(flight.do("k", slow))
+        second = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == 42
+        assert flight.stats() == {
+            "in_flight": 0, "executions": 1, "coalesced": 1, "abandoned": 0
+        }
+
+    @pytest.mark.asyncio
+    async def test_operation_cancelled_when_all_waiters_leave(self):
+        """Test the shared operation is cancelled once nobody awaits it"""
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.create_task(flight.do("k", slow))
+        second = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        second.cancel()
+
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["abandoned"] == 1
+
+    @pytest.mark.asyncio
+    async def test_sequential_calls_are_not_coalesced(self):
+        """Test a finished operation is not reused"""
+        flight = SingleFlight("test")
+
+        async def value():
+            return 1
+
+        await flight.do("k", value)
+        await flight.do("k", value)
+        assert flight.stats()["executions"] == 2
+
+    @pytest.mark.asyncio
+    async def test_operation_runs_until_the_latest_waiter_deadline(self):
+        """Test the first caller's deadline does not cut the shared operation short"""
+        flight = SingleFlight("test")
+        seen = []
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            seen.append(remaining_time(60))
+            return 42
+
+        first = asyncio.create_task(run_with_deadline(flight.do("k", slow), Deadline(0.05)))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(run_with_deadline(flight.do("k", slow), Deadline(5)))
+
+        with pytest.raises(DeadlineExceeded):
+            await first
+        assert await second == 42
+        assert 4 < seen[0] < 5
+        assert current_deadline.get() is None
@@ -0,0 +1,214 @@
+"""
+Tests for the slow-query log and plan-flip detection
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import status
+
+from app.api import routes
+from app.services import database as database_module
+from app.services.database import DatabaseService
+from app.services.slow_queries import SlowQueryLog, current_question, plan_shape
+
+INDEX_PLAN = {
+    "Node Type": "Nested Loop",
+    "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "parks"},
+        {"Node Type": "Index Scan", "Relation Name": "cafes", "Index Name": "cafes_geom_idx"},
+    ],
+}
+SEQ_PLAN = {
+    "Node Type": "Hash Join",
+    "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "parks"},
+        {"Node Type": "Hash", "Plans": [{"Node Type": "Seq Scan", "Relation Name": "cafes"}]},
+    ],
+}
+SQL = "SELECT c.id FROM cafes c JOIN parks p ON ST_DWithin(c.geom, p.geom, 200)"
+
+
+def slow_log(**overrides):
+    options = dict(size=10, max_fingerprints=100, capture_interval=300, capture_concurrency=1)
+    options.update(overrides)
+    return SlowQueryLog(**options)
+
+
+class TestPlanShape:
+    """Tests for plan shapes and flips"""
+
+    def test_shape_keeps_structure_only(self):
+        plan = dict(INDEX_PLAN, **{"Total Cost": 812.5, "Plan Rows": 40})
+
+        assert plan_shape(plan) == (
+            "Nested Loop(Seq Scan[parks], Index Scan[cafes_geom_idx])"
+        )
+
+    def test_changed_shape_is_a_flip(self):
+        log = slow_log()
+
+        assert log.observe_plan(SQL, INDEX_PLAN) is None
+        assert log.observe_plan(SQL + "  ", INDEX_PLAN) is None
+        flip = log.observe_plan(SQL, SEQ_PLAN)
+
+        assert flip["before"] == "Nested Loop(Seq Scan[parks], Index Scan[cafes_geom_idx])"
+        assert flip["after"] == "Hash Join(Seq Scan[parks], Hash(Seq Scan[cafes]))"
+        assert log.snapshot(10)["plan_flips"] == [flip]
+        assert log.stats()["plan_flips"] == 1
+
+    def test_shapes_are_bounded(self):
+        log = slow_log(max_fingerprints=2)
+        for i in range(3):
+            log.observe_plan(f"SELECT {i}", INDEX_PLAN)
+
+        assert log.stats()["fingerprints"] == 2
+
+
+class TestCaptureGating:
+    """Tests for when plans are captured"""
+
+    def test_same_sql_is_not_recaptured_within_the_interval(self):
+        log = slow_log()
+        first = log.record(SQL, 3.0, 10)
+        assert log.start_capture(first)
+        log.finish_capture(first, {"Plan": INDEX_PLAN})
+
+        second = log.record(SQL, 3.0, 10)
+
+        assert not log.start_capture(second)
+        assert second["capture"] == "skipped: captured recently"
+
+    def test_captures_are_bounded(self):
+        log = slow_log()
+        assert log.start_capture(log.record(SQL, 3.0, 10))
+
+        other = log.record("SELECT id FROM parks", 3.0, 10)
+
+        assert not log.start_capture(other)
+        assert other["capture"] == "skipped: capture busy"
+
+    def test_ring_buffer_keeps_the_newest(self):
+        log = slow_log(size=2)
+        for i in range(3):
+            log.record(f"SELECT {i}", 3.0, i)
+
+        assert [entry["rows"] for entry in log.snapshot(10)["slow_queries"]] == [2, 1]
+
+
+class TestSlowQueryCapture:
+    """Tests for DatabaseService's slow-query capture"""
+
+    @staticmethod
+    def _db(explain_plan):
+        db = DatabaseService()
+        db.statements = []
+
+        class Result:
+            def keys(self):
+                return ["id"]
+
+            def fetchall(self):
+                return [(1,), (2,)]
+
+            def scalar(self):
+                return [{"Plan": explain_plan, "Execution Time": 2412.5}]
+
+        class Connection:
+            async def execute(self, statement, params=None):
+                db.statements.append(statement.text)
+                return Result()
+
+        @asynccontextmanager
+        async def connection():
+            yield Connection()
+
+        db.get_request_connection = connection
+        db.get_async_connection = connection
+        return db
+
+    @pytest.mark.asyncio
+    async def test_slow_query_plan_is_captured(self, monkeypatch):
+        monkeypatch.setattr(database_module.settings, "slow_query_threshold", 0.0)
+        db = self._db(SEQ_PLAN)
+        current_question.set("Cafes near parks")
+
+        await db.execute_query(SQL)
+        await asyncio.gather(*db._capture_tasks)
+
+        entry = db.slow_queries.snapshot(10)["slow_queries"][0]
+        assert entry["question"] == "Cafes near parks"
+        assert entry["rows"] == 2
+        assert entry["capture"] == "captured"
+        assert entry["plan"]["Execution Time"] == 2412.5
+        # ANALYZE runs the query again: read-only and under its own timeout
+        assert db.statements[1] == "SET TRANSACTION READ ONLY"
+        assert db.statements[-1].startswith("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT")
+
+    @pytest.mark.asyncio
+    async def test_failed_capture_releases_the_slot(self, monkeypatch):
+        monkeypatch.setattr(database_module.settings, "slow_query_threshold", 0.0)
+        db = self._db(SEQ_PLAN)
+        slow_connection = db.get_async_connection
+
+        @asynccontextmanager
+        async def refused():
+            raise ConnectionRefusedError("Connect call failed")
+            yield
+
+        db.get_async_connection = refused
+        await db.execute_query(SQL)
+        await asyncio.gather(*db._capture_tasks)
+
+        assert db.slow_queries.capturing == 0
+        entry = db.slow_queries.snapshot(10)["slow_queries"][0]
+        assert entry["capture"] == "failed: Connect call failed"
+
+        db.get_async_connection = slow_connection
+        await db.execute_query("SELECT id FROM parks")
+        await asyncio.gather(*db._capture_tasks)
+        assert db.slow_queries.stats()["captured"] == 1
+
+    @pytest.mark.asyncio
+    async def test_fast_queries_are_not_logged(self):
+        db = self._db(SEQ_PLAN)
+
+        await db.execute_query(SQL)
+
+        assert db.slow_queries.stats()["slow"] == 0
+        assert not db._capture_tasks
+
+    @pytest.mark.asyncio
+    async def test_explain_tracks_plan_flips(self):
+        db = self._db(INDEX_PLAN)
+        await db.explain(SQL)
+
+        db.get_request_connection = self._db(SEQ_PLAN).get_request_connection
+        await db.explain(SQL)
+
+        assert db.slow_queries.stats()["plan_flips"] == 1
+
+
+class TestSlowQueryEndpoint:
+    """Test the admin endpoint"""
+
+    def test_endpoint_is_hidden_without_an_admin_token(self, client, monkeypatch):
+        monkeypatch.setattr(routes.settings, "admin_token", None)
+
+        response = client.get("/admin/slow-queries", headers={"X-Admin-Token": ""})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_admin_token_is_required_when_set(self, client, query_service, monkeypatch):
+        monkeypatch.setattr(routes, "get_query_service", lambda: query_service)
+        monkeypatch.setattr(routes.settings, "admin_token", "s3cret")
+        query_service.db_service.slow_queries.record(SQL, 3.0, 10)
+
+        assert client.get("/admin/slow-queries").status_code == status.HTTP_403_FORBIDDEN
+
+        response = client.get("/admin/slow-queries", headers={"X-Admin-Token": "s3cret"})
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["slow_queries"][0]["sql"] == SQL
+        assert data["stats"]["slow"] == 1
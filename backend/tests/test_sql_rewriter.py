@@ -0,0 +1,301 @@
+"""
+Index-aware SQL rewriter tests
+
+Equivalence is checked by running the original and the rewritten SQL
+against the same SQLite tables, with the PostGIS functions involved
+emulated in Python: geometries are vertex lists, geography distances are
+great-circle distances on the mean-radius sphere.
+"""
+
+import json
+import math
+import random
+import sqlite3
+
+import pytest
+import sqlglot
+from sqlglot import exp
+
+from app.services.sql_rewriter import (
+    BBOX_PREFILTER,
+    EXISTS_SEMIJOIN,
+    KNN_ORDER_BY,
+    rewrite_sql
+)
+
+EARTH_RADIUS = 6371008.8
+
+# Two clusters: Tel Aviv, and far north where a degree of longitude is short
+CLUSTERS = [(34.78, 32.08), (18.95, 69.65)]
+
+
+# ---------------------------------------------------------------------------
+# Minimal PostGIS emulation on SQLite
+# ---------------------------------------------------------------------------
+
+def _geometry(coords, geography=False) -> str:
+    return json.dumps({"coords": coords, "geography": geography})
+
+
+def _load(value):
+    data = json.loads(value)
+    return data["coords"], data["geography"]
+
+
+def _sphere_distance(a, b) -> float:
+    (lon1, lat1), (lon2, lat2) = a, b
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    h = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+
+def _distance(a, b) -> float:
+    """Minimum vertex distance: meters for geography, degrees for geometry"""
+    (coords_a, geography_a), (coords_b, geography_b) = _load(a), _load(b)
+    measure = _sphere_distance if geography_a and geography_b else math.dist
+    return min(measure(p, q) for p in coords_a for q in coords_b)
+
+
+def _bbox(value):
+    coords, _ = _load(value)
+    xs, ys = [p[0] for p in coords], [p[1] for p in coords]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _expand(value, dx, dy=None):
+    dy = dx if dy is None else dy
+    xmin, ymin, xmax, ymax = _bbox(value)
+    return _geometry([[xmin - dx, ymin - dy], [xmax + dx, ymax + dy]])
+
+
+def _overlaps(a, b) -> bool:
+    ax1, ay1, ax2, ay2 = _bbox(a)
+    bx1, by1, bx2, by2 = _bbox(b)
+    return ax1 <= bx2 and bx1 <= ax2 and ay1 <= by2 and by1 <= ay2
+
+
+POSTGIS_FUNCTIONS = {
+    "geog": (1, lambda g: _geometry(_load(g)[0], geography=True)),
+    "st_dwithin": (3, lambda a, b, d: _distance(a, b) <= d),
+    "st_distance": (2, _distance),
+    "planar_distance": (2, _distance),
+    "st_expand": (3, _expand),
+    "bbox_overlaps": (2, _overlaps),
+    "st_ymin": (1, lambda g: _bbox(g)[1]),
+    "st_ymax": (1, lambda g: _bbox(g)[3]),
+    "st_asgeojson": (1, lambda g: json.dumps(_load(g)[0])),
+    "st_point": (2, lambda x, y: _geometry([[x, y]])),
+    "st_setsrid": (2, lambda g, srid: g),
+    "cos": (1, math.cos),
+    "radians": (1, math.radians),
+}
+
+
+def to_sqlite(sql: str) -> str:
+    """Translate PostGIS operators and casts into the emulated functions"""
+    def translate(node):
+        if isinstance(node, exp.Cast) and node.to.is_type("geography"):
+            return exp.Anonymous(this="geog", expressions=[node.this])
+        if isinstance(node, exp.ArrayOverlaps):
+            return exp.Anonymous(this="bbox_overlaps", expressions=[node.this, node.expression])
+        if isinstance(node, exp.Distance):
+            return exp.Anonymous(this="planar_distance", expressions=[node.this, node.expression])
+        if isinstance(node, exp.StDistance):
+            return exp.Anonymous(this="st_distance", expressions=[node.this, node.expression])
+        return node
+
+    return sqlglot.parse_one(sql, read="postgres").transform(translate).sql(dialect="sqlite")
+
+
+@pytest.fixture(scope="module")
+def spatial_db():
+    """SQLite database with cafes, parks and plans around two clusters"""
+    rng = random.Random(42)
+    conn = sqlite3.connect(":memory:")
+    for name, (arity, function) in POSTGIS_FUNCTIONS.items():
+        conn.create_function(name, arity, function, deterministic=True)
+
+    conn.execute("CREATE TABLE cafes (id INTEGER PRIMARY KEY, name TEXT, geom TEXT)")
+    conn.execute("CREATE TABLE parks (id INTEGER PRIMARY KEY, name TEXT, area REAL, geom TEXT)")
+    conn.execute("CREATE TABLE plans (id INTEGER PRIMARY KEY, pl_name TEXT, geom TEXT)")
+
+    def point(lon, lat, spread):
+        return [lon + rng.uniform(-spread, spread), lat + rng.uniform(-spread, spread)]
+
+    def square(center, size):
+        lon, lat = center
+        return [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size]]
+
+    for lon, lat in CLUSTERS:
+        for _ in range(80):
+            conn.execute(
+                "INSERT INTO cafes (name, geom) VALUES (?, ?)",
+                (rng.choice(["Aroma", "Cafe Joe", "Landwer"]), _geometry([point(lon, lat, 0.01)]))
+            )
+        for i in range(12):
+            size = rng.uniform(0.0005, 0.003)
+            conn.execute(
+                "INSERT INTO parks (name, area, geom) VALUES (?, ?, ?)",
+                (f"park {i}", size * 1e6, _geometry(square(point(lon, lat, 0.01), size)))
+            )
+        for i in range(25):
+            conn.execute(
+                "INSERT INTO plans (pl_name, geom) VALUES (?, ?)",
+                (f"plan {i}", _geometry(square(point(lon, lat, 0.01), 0.001)))
+            )
+    yield conn
+    conn.close()
+
+
+def run(conn, sql: str):
+    return conn.execute(to_sqlite(sql)).fetchall()
+
+
+# ---------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------
+
+EQUIVALENCE_CASES = [
+    pytest.param(
+        "SELECT c.id, c.name, ST_AsGeoJSON(c.geom) as geojson FROM cafes c, parks p "
+        "WHERE p.area = (SELECT MAX(area) FROM parks) "
+        "AND ST_DWithin(c.geom::geography, p.geom::geography, 200);",
+        [BBOX_PREFILTER], id="prefilter-comma-join"
+    ),
+    pytest.param(
+        "SELECT c.id, p.id FROM cafes c JOIN parks p "
+        "ON ST_DWithin(c.geom::geography, p.geom::geography, 150) WHERE c.name = 'Aroma'",
+        [BBOX_PREFILTER], id="prefilter-join-on"
+    ),
+    pytest.param(
+        "SELECT id, name FROM cafes WHERE ST_DWithin("
+        "ST_SetSRID(ST_MakePoint(18.95, 69.65), 4326)::geography, geom::geography, 700)",
+        [BBOX_PREFILTER], id="prefilter-constant-point"
+    ),
+    pytest.param(
+        "SELECT DISTINCT p.id, p.pl_name, ST_AsGeoJSON(p.geom) as geojson FROM plans p, cafes c "
+        "WHERE ST_DWithin(p.geom::geography, c.geom::geography, 300) AND c.name = 'Landwer'",
+        [EXISTS_SEMIJOIN, BBOX_PREFILTER], id="semijoin"
+    ),
+    pytest.param(
+        "SELECT DISTINCT p.* FROM parks p, cafes c "
+        "WHERE p.area > 1000 AND ST_DWithin(c.geom::geography, p.geom::geography, 100) "
+        "ORDER BY p.name",
+        [EXISTS_SEMIJOIN, BBOX_PREFILTER], id="semijoin-star-ordered"
+    ),
+    pytest.param(
+        "SELECT c.id, c.name FROM cafes c, parks p WHERE p.id = 3 "
+        "ORDER BY ST_Distance(c.geom, p.geom) LIMIT 5",
+        [KNN_ORDER_BY], id="knn"
+    ),
+]
+
+
+class TestEquivalence:
+    """Test rewritten SQL returns exactly what the original returns"""
+
+    @pytest.mark.parametrize("sql,expected_rewrites", EQUIVALENCE_CASES)
+    def test_rewrite_preserves_results(self, spatial_db, sql, expected_rewrites):
+        """Test each rewrite fires and leaves the result unchanged"""
+        rewritten, rewrites = rewrite_sql(sql)
+
+        assert rewrites == expected_rewrites
+        original_rows = run(spatial_db, sql)
+        rewritten_rows = run(spatial_db, rewritten)
+        assert original_rows, "case should match some rows"
+        if "ORDER BY" in sql:
+            assert rewritten_rows == original_rows
+        else:
+            assert sorted(rewritten_rows) == sorted(original_rows)
+
+    @pytest.mark.parametrize("lon,lat", CLUSTERS + [(0.0, 0.0), (-70.0, -55.0)])
+    @pytest.mark.parametrize("bearing", [0, 45, 90, 180, 270])
+    def test_envelope_keeps_matches_at_the_edge(self, lon, lat, bearing):
+        """Test a point just inside the distance survives the prefilter in every direction"""
+        distance = 999.0
+        angle = math.radians(bearing)
+        target = [
+            lon + math.degrees(distance * math.sin(angle) / (EARTH_RADIUS * math.cos(math.radians(lat)))),
+            lat + math.degrees(distance * math.cos(angle) / EARTH_RADIUS),
+        ]
+        conn = sqlite3.connect(":memory:")
+        for name, (arity, function) in POSTGIS_FUNCTIONS.items():
+            conn.create_function(name, arity, function, deterministic=True)
+        conn.execute("CREATE TABLE cafes (id INTEGER PRIMARY KEY, geom TEXT)")
+        conn.execute("CREATE TABLE parks (id INTEGER PRIMARY KEY, geom TEXT)")
+        conn.execute("INSERT INTO cafes (geom) VALUES (?)", (_geometry([target]),))
+        conn.execute("INSERT INTO parks (geom) VALUES (?)", (_geometry([[lon, lat]]),))
+
+        sql = (
+            "SELECT c.id FROM cafes c, parks p "
+            "WHERE ST_DWithin(c.geom::geography, p.geom::geography, 1000)"
+        )
+        rewritten, rewrites = rewrite_sql(sql)
+
+        assert rewrites == [BBOX_PREFILTER]
+        assert run(conn, sql) == run(conn, rewritten) == [(1,)]
+
+    def test_prefilter_discards_far_candidates(self, spatial_db):
+        """Test the envelope is tight enough to be useful"""
+        rewritten, _ = rewrite_sql(
+            "SELECT c.id FROM cafes c, parks p "
+            "WHERE ST_DWithin(c.geom::geography, p.geom::geography, 200)"
+        )
+        prefilter_only = rewritten.split(" AND ST_DWITHIN")[0]
+
+        candidates = run(spatial_db, prefilter_only)
+        pairs = spatial_db.execute("SELECT COUNT(*) FROM cafes, parks").fetchone()[0]
+        assert len(candidates) < pairs / 10
+
+
+class TestRewriteShape:
+    """Test where rewrites go and when they must not apply"""
+
+    def test_semijoin_probes_inner_table_index(self):
+        """Test the correlated prefilter scans the EXISTS table's column"""
+        rewritten, _ = rewrite_sql(
+            "SELECT DISTINCT p.id FROM plans p, cafes c "
+            "WHERE ST_DWithin(p.geom::geography, c.geom::geography, 300)"
+        )
+        assert rewritten.startswith(
+            "SELECT p.id FROM plans AS p WHERE EXISTS(SELECT 1 FROM cafes AS c WHERE "
+            "c.geom && ST_EXPAND(p.geom, "
+        )
+
+    @pytest.mark.parametrize("sql", [
+        # DISTINCT without the key may collapse different outer rows
+        "SELECT DISTINCT p.name FROM parks p, cafes c WHERE ST_Contains(p.geom, c.geom)",
+        # Output reads the inner table
+        "SELECT DISTINCT p.id, c.name FROM parks p, cafes c WHERE ST_Contains(p.geom, c.geom)",
+        # Unqualified columns are ambiguous
+        "SELECT DISTINCT p.id FROM parks p, cafes c WHERE name = 'x'",
+        # Explicit join kinds are left alone
+        "SELECT DISTINCT p.id FROM parks p LEFT JOIN cafes c ON ST_Contains(p.geom, c.geom)",
+        # A prefilter under OR would change the condition
+        "SELECT c.id FROM cafes c, parks p "
+        "WHERE ST_DWithin(c.geom::geography, p.geom::geography, 200) OR c.id = 1",
+        # Geography ordering is not the planar KNN ordering
+        "SELECT c.id FROM cafes c, parks p "
+        "ORDER BY ST_Distance(c.geom::geography, p.geom::geography) LIMIT 1",
+        # Without a LIMIT the index cannot help
+        "SELECT c.id FROM cafes c, parks p ORDER BY ST_Distance(c.geom, p.geom)",
+        # Planar ST_DWithin is already index-aware
+        "SELECT c.id FROM cafes c, parks p WHERE ST_DWithin(c.geom, p.geom, 0.001)",
+    ])
+    def test_unsafe_or_useless_rewrites_are_skipped(self, sql):
+        """Test SQL is returned untouched when no rewrite is provably safe"""
+        assert rewrite_sql(sql) == (sql, [])
+
+    def test_unparseable_sql_is_untouched(self):
+        """Test SQL sqlglot cannot parse passes through"""
+        sql = "SELECT id FROM cafes WHERE ((("
+        assert rewrite_sql(sql) == (sql, [])
+
+    @pytest.mark.parametrize("sql,expected_rewrites", EQUIVALENCE_CASES)
+    def test_rewrites_are_idempotent(self, sql, expected_rewrites):
+        """Test rewriting rewritten SQL applies nothing further"""
+        rewritten, _ = rewrite_sql(sql)
+        assert rewrite_sql(rewritten) == (rewritten, [])
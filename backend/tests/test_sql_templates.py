@@ -0,0 +1,126 @@
+"""
+Tests for parameterized SQL templates
+"""
+
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+from app.services.sql_templates import TemplateStats, parameterize_sql
+
+
+class TestParameterizeSQL:
+    """Tests for extracting filter literals into bind parameters"""
+
+    def test_queries_differing_in_a_number_share_a_template(self):
+        first, first_params = parameterize_sql("SELECT id, name FROM parks WHERE area > 5000")
+        second, second_params = parameterize_sql("SELECT id, name FROM parks WHERE area > 8000")
+
+        assert first == second == "SELECT id, name FROM parks WHERE area > CAST(:p1 AS INTEGER)"
+        assert first_params == {"p1": 5000}
+        assert second_params == {"p1": 8000}
+
+    def test_placeholders_keep_the_literal_type(self):
+        template, params = parameterize_sql(
+            "SELECT id FROM plans WHERE id IN (7, 30000000000) AND pl_area_dunam > 12.5"
+        )
+
+        assert template == (
+            "SELECT id FROM plans WHERE id IN (CAST(:p1 AS INTEGER), CAST(:p2 AS BIGINT)) "
+            "AND pl_area_dunam > CAST(:p3 AS NUMERIC)"
+        )
+        assert params == {"p1": 7, "p2": 30000000000, "p3": Decimal("12.5")}
+
+    def test_spatial_arguments_are_extracted_in_place(self):
+        sql = (
+            "SELECT c.id FROM cafes c JOIN parks p ON ST_DWithin(c.geom::geography, "
+            "ST_SetSRID(ST_MakePoint(34.78, -32.08, 0), 4326)::geography, 500)"
+        )
+
+        template, params = parameterize_sql(sql)
+
+        # The rest of the text is untouched (no re-rendering of ST_MakePoint etc.)
+        assert template == (
+            "SELECT c.id FROM cafes c JOIN parks p ON ST_DWithin(c.geom::geography, "
+            "ST_SetSRID(ST_MakePoint(CAST(:p1 AS NUMERIC), -CAST(:p2 AS NUMERIC), "
+            "CAST(:p3 AS INTEGER)), CAST(:p4 AS INTEGER))::geography, CAST(:p5 AS INTEGER))"
+        )
+        assert list(params.values()) == [Decimal("34.78"), Decimal("32.08"), 0, 4326, 500]
+
+    @pytest.mark.parametrize("sql", [
+        "SELECT id, 1 AS one FROM parks ORDER BY 2 LIMIT 10 OFFSET 5",
+        "SELECT road_type, COUNT(*) FROM roads GROUP BY 1",
+        "SELECT * FROM plans WHERE pl_date_8 > '2020-01-01' AND pl_name ILIKE '%park%'",
+        "SELECT * FROM plans WHERE pl_area_dunam::numeric(10, 2) > pl_area_dunam",
+        "SELECT * FROM plans WHERE pl_date_8 > now() - interval '5 days'",
+        "SELECT FROM WHERE (",
+    ])
+    def test_structural_and_string_literals_are_kept(self, sql):
+        assert parameterize_sql(sql) == (sql, {})
+
+    def test_subquery_filters_and_having(self):
+        template, params = parameterize_sql(
+            "SELECT road_type FROM roads WHERE id IN (SELECT id FROM roads WHERE id > 3 LIMIT 5) "
+            "GROUP BY road_type HAVING COUNT(*) > 10"
+        )
+
+        assert template == (
+            "SELECT road_type FROM roads WHERE id IN "
+            "(SELECT id FROM roads WHERE id > CAST(:p1 AS INTEGER) LIMIT 5) "
+            "GROUP BY road_type HAVING COUNT(*) > CAST(:p2 AS INTEGER)"
+        )
+        assert params == {"p1": 3, "p2": 10}
+
+    def test_templates_return_the_same_rows(self):
+        """Run original and template side by side (SQLite binds :name parameters too)"""
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE parks (id INTEGER, name TEXT, area REAL)")
+        conn.executemany(
+            "INSERT INTO parks VALUES (?, ?, ?)",
+            [(i, f"Park {i}", i * 1250.5) for i in range(1, 21)]
+        )
+        queries = [
+            "SELECT id FROM parks WHERE area > 5000 AND id <> 7 ORDER BY id",
+            "SELECT id FROM parks WHERE area BETWEEN 2500.25 AND 10000 ORDER BY 1",
+            "SELECT id, 2 FROM parks WHERE id IN (1, 3, 5) AND name <> 'Park 3' ORDER BY id",
+        ]
+
+        for sql in queries:
+            template, params = parameterize_sql(sql)
+            params = {name: float(value) if isinstance(value, Decimal) else value
+                      for name, value in params.items()}
+            assert template != sql
+            assert conn.execute(template, params).fetchall() == conn.execute(sql).fetchall()
+
+
+class TestTemplateStats:
+    """Tests for per-template execution statistics"""
+
+    def test_counts_executions_and_distinct_parameters(self):
+        stats = TemplateStats(max_templates=10)
+        stats.record("SELECT * FROM parks WHERE area > CAST(:p1 AS INTEGER)", {"p1": 5000}, 0.01)
+        stats.record("SELECT * FROM parks WHERE area > CAST(:p1 AS INTEGER)", {"p1": 8000}, 0.03)
+        stats.record("SELECT * FROM parks WHERE area > CAST(:p1 AS INTEGER)", {"p1": 5000}, 0.02)
+        stats.record("SELECT * FROM cafes", {}, 0.005)
+
+        summary = stats.stats()
+
+        assert summary["executions"] == 4
+        assert summary["parameterized"] == 3
+        assert summary["templates"] == 2
+        assert summary["top"][0] == {
+            "template": "SELECT * FROM parks WHERE area > CAST(:p1 AS INTEGER)",
+            "executions": 3,
+            "distinct_params": 2,
+            "mean_ms": 20.0,
+        }
+
+    def test_least_recent_template_is_evicted(self):
+        stats = TemplateStats(max_templates=2)
+        stats.record("a", {}, 0.0)
+        stats.record("b", {}, 0.0)
+        stats.record("a", {}, 0.0)
+        stats.record("c", {}, 0.0)
+
+        assert {entry["template"] for entry in stats.stats()["top"]} == {"a", "c"}
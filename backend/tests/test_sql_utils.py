@@ -0,0 +1,77 @@
+"""
+SQL rewriting helper tests
+"""
+
+import pytest
+
+from app.services.sql_utils import (
+    complete_statement,
+    detail_for_resolution,
+    geometry_detail_sql,
+    zoom_resolution
+)
+
+TOLERANCES = [0.00005, 0.0005, 0.005]
+LOD_TABLES = ["plans", "parks"]
+
+
+class TestGeometryDetail:
+    """Test zoom/tolerance driven geometry rewrites"""
+
+    @pytest.mark.parametrize("zoom,expected", [(6, (3, 3)), (12, (1, 5)), (17, (0, 6))])
+    def test_detail_for_zoom(self, zoom, expected):
+        """Test zoomed-out maps get coarser geometry and fewer digits"""
+        assert detail_for_resolution(zoom_resolution(zoom), TOLERANCES, 9) == expected
+
+    def test_digits_are_capped(self):
+        """Test the configured precision is an upper bound"""
+        assert detail_for_resolution(1e-12, TOLERANCES, 7) == (0, 7)
+
+    def test_qualified_lod_table_is_rewritten(self):
+        """Test aliased plans geometry is redirected; other tables only get precision"""
+        sql = (
+            "SELECT p.id, ST_AsGeoJSON(p.geom) AS geojson, ST_AsGeoJSON(c.geom) AS cafe "
+            "FROM plans p, cafes c WHERE ST_Contains(p.geom, c.geom)"
+        )
+        assert geometry_detail_sql(sql, 3, 4, LOD_TABLES) == (
+            "SELECT p.id, ST_AsGeoJSON(p.geom_lod3, 4) AS geojson, ST_AsGeoJSON(c.geom, 4) AS cafe "
+            "FROM plans p, cafes c WHERE ST_Contains(p.geom, c.geom)"
+        )
+
+    def test_unqualified_geometry_needs_single_table(self):
+        """Test unqualified geom is only redirected when the table is unambiguous"""
+        single = "SELECT id, ST_AsGeoJSON(geom) AS geojson FROM parks WHERE area > 5000"
+        joined = "SELECT id, ST_AsGeoJSON(geom) FROM parks JOIN plans ON true"
+
+        assert "ST_AsGeoJSON(geom_lod2)" in geometry_detail_sql(single, 2, None, LOD_TABLES)
+        assert "ST_AsGeoJSON(geom, 5)" in geometry_detail_sql(joined, 2, 5, LOD_TABLES)
+
+    def test_literals_and_expressions_are_untouched(self):
+        """Test quoted text and ST_AsGeoJSON of expressions are not rewritten"""
+        sql = (
+            "SELECT 'ST_AsGeoJSON(geom)' AS label, ST_AsGeoJSON(ST_Buffer(geom, 1)) AS geojson "
+            "FROM parks"
+        )
+        assert geometry_detail_sql(sql, 3, 4, LOD_TABLES) == sql
+
+
+class TestCompleteStatement:
+    """Test detecting the end of a statement in streamed LLM output"""
+
+    @pytest.mark.parametrize("text,expected", [
+        ("SELECT id FROM cafes", None),
+        ("SELECT id FROM cafes;\nThis query", "SELECT id FROM cafes;"),
+        ("```sql\nSELECT id FROM cafes\n```\nExplanation", "SELECT id FROM cafes"),
+        ("```sq", None),
+        ("SELECT 'a;b', \"x;y\" FROM cafes", None),
+        ("SELECT 'it''s;' FROM cafes; --", "SELECT 'it''s;' FROM cafes;"),
+        ("SELECT 1 -- not here;\n", None),
+        ("SELECT 1 /* ; */ + $tag$;$tag$;", "SELECT 1 /* ; */ + $tag$;$tag$;"),
+        ("SELECT $1;", "SELECT $1;"),
+    ])
+    def test_statement_end(self, text, expected):
+        assert complete_statement(text) == expected
+
+    def test_final_output_without_terminator(self):
+        assert complete_statement("```sql\nSELECT id FROM cafes\n", final=True) == "SELECT id FROM cafes"
+        assert complete_statement("  ", final=True) is None
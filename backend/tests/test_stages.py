@@ -0,0 +1,42 @@
+"""
+Tests for per-stage pipeline timing
+"""
+
+import time
+
+import pytest
+
+from app.models.schemas import QueryRequest
+from app.services.stages import current_stage_timings, recording_stages, stage
+
+
+class TestStageTiming:
+    """Tests for the stage timer"""
+
+    def test_nested_stages_are_exclusive(self):
+        with recording_stages() as timings:
+            with stage("generation"):
+                time.sleep(0.02)
+                with stage("validation"):
+                    time.sleep(0.03)
+            with stage("validation"):
+                time.sleep(0.01)
+
+        assert 0.02 <= timings["generation"] < 0.03
+        assert timings["validation"] >= 0.04
+
+    def test_nothing_is_recorded_outside_a_recording(self):
+        with stage("generation"):
+            pass
+
+        assert current_stage_timings.get() is None
+
+    @pytest.mark.asyncio
+    async def test_query_pipeline_reports_its_stages(self, query_service):
+        with recording_stages() as timings:
+            await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        assert set(timings) == {"generation", "validation", "execution", "formatting"}
+        # The fake LLM takes 0.2s, the fake database 0.05s
+        assert timings["generation"] >= 0.2
+        assert 0.05 <= timings["execution"] < 0.2
@@ -0,0 +1,138 @@
+"""
+Tests for OpenTelemetry tracing of the query pipeline
+"""
+
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import status
+from openai import APIConnectionError
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from app.api import routes
+from app.models.schemas import QueryRequest
+from app.services import openai_service as openai_module
+from app.services import tracing
+from app.services.openai_service import OpenAIService
+from app.services.sql_utils import fingerprint_sql
+from conftest import SAMPLE_SQL
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+_exporter = InMemorySpanExporter()
+
+
+@pytest.fixture
+def spans():
+    """Finished spans, recorded by an in-memory exporter"""
+    if not isinstance(trace.get_tracer_provider(), TracerProvider):
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(_exporter))
+        trace.set_tracer_provider(provider)
+    _exporter.clear()
+    yield lambda: {span.name: span for span in _exporter.get_finished_spans()}
+    _exporter.clear()
+
+
+class TestPipelineSpans:
+    """Tests for the spans of a query"""
+
+    @pytest.mark.asyncio
+    async def test_query_stages_are_children_of_the_query_span(self, query_service, spans):
+        await query_service.process_query(QueryRequest(question="Show all cafes"))
+
+        finished = spans()
+        query = finished["query.process"]
+        for name in ("generation", "validation", "execution", "formatting"):
+            assert finished[name].context.trace_id == query.context.trace_id
+        assert finished["execution"].parent.span_id == query.context.span_id
+        assert finished["validation"].parent.span_id == finished["generation"].context.span_id
+        assert query.attributes["geosql.sql.fingerprint"] == fingerprint_sql(SAMPLE_SQL)
+        assert query.attributes["geosql.rows"] == 1
+        assert finished["generation"].attributes["geosql.sql_cache"] == "miss"
+
+    def test_incoming_trace_context_is_continued(self, client, query_service, spans, monkeypatch):
+        monkeypatch.setattr(routes, "get_query_service", lambda: query_service)
+
+        response = client.post(
+            "/query",
+            json={"question": "Show all cafes"},
+            headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        finished = spans()
+        server = finished["POST /query"]
+        assert format(server.context.trace_id, "032x") == TRACE_ID
+        assert server.parent.span_id == 0x00f067aa0ba902b7
+        assert server.attributes["http.status_code"] == 200
+        assert finished["query.process"].context.trace_id == server.context.trace_id
+        assert finished["serialization"].parent.span_id == server.context.span_id
+
+
+class TestLLMSpans:
+    """Tests for the spans of SQL generation"""
+
+    @pytest.mark.asyncio
+    async def test_retries_and_tokens_are_recorded(self, spans, monkeypatch):
+        monkeypatch.setattr(openai_module.settings, "llm_hedge_enabled", False)
+        monkeypatch.setattr(openai_module, "_backoff", lambda retry_state: 0)
+        service = OpenAIService()
+        calls = []
+
+        async def create(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise APIConnectionError(request=REQUEST)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=SAMPLE_SQL))],
+                usage=SimpleNamespace(prompt_tokens=50, completion_tokens=12)
+            )
+
+        service.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+
+        assert await service.generate_sql("Show all cafes") == SAMPLE_SQL
+
+        finished = _exporter.get_finished_spans()
+        generation = next(span for span in finished if span.name == "llm.generate_sql")
+        completions = [span for span in finished if span.name == "llm.completion"]
+        assert generation.attributes["llm.retries"] == 1
+        assert [event.name for event in generation.events] == ["retry"]
+        assert len(completions) == 2
+        assert not completions[0].status.is_ok
+        assert completions[1].attributes["llm.prompt_tokens"] == 50
+        assert completions[1].attributes["llm.completion_tokens"] == 12
+        assert all(span.parent.span_id == generation.context.span_id for span in completions)
+
+
+class TestSetup:
+    """Tests for exporter configuration"""
+
+    def test_tracing_is_off_by_default(self):
+        assert tracing.setup_tracing() is None
+
+    def test_unknown_exporter_is_rejected(self, monkeypatch):
+        monkeypatch.setattr(tracing.settings, "tracing_exporter", "jaeger")
+
+        with pytest.raises(ValueError):
+            tracing.setup_tracing()
+
+    def test_file_exporter_closes_its_file_on_shutdown(self, tmp_path):
+        path = tmp_path / "spans.jsonl"
+        exporter = tracing._FileSpanExporter(str(path))
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+
+        with provider.get_tracer("test").start_as_current_span("query"):
+            pass
+        provider.shutdown()
+
+        assert exporter._file.closed
+        assert '"name": "query"' in path.read_text()
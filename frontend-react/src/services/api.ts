@@ -90,6 +90,22 @@ export const api = {
     const response = await apiClient.post<QueryResponse>('/query', request);
     return response.data;
   },
+
+  /**
+   * Fetch the next page of a paginated query (no new SQL generation)
+   */
+  nextPage: async (token: string): Promise<QueryResponse> => {
+    const response = await apiClient.get<QueryResponse>('/query/next', {
+      params: { token },
+    });
+    return response.data;
+  },
+
+  /**
+   * Vector tile URL template ({z}/{x}/{y}) for a query's results
+   */
+  tileUrl: (queryHandle: string): string =>
+    `${API_BASE_URL}/query/${queryHandle}/tiles/{z}/{x}/{y}.mvt`,
 };
 
 // ==============================================================================
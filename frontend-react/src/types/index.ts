@@ -8,13 +8,20 @@
 
 export interface QueryRequest {
   question: string;
+  page_size?: number;
+  zoom?: number;       // map zoom; selects simplified geometry
+  tolerance?: number;  // acceptable geometry error in degrees
 }
 
 export interface QueryResponse {
   sql: string;
+  rewrites?: string[];
+  plan?: Record<string, unknown> | null;
   results: QueryResult[];
   execution_time: number;
   result_count: number;
+  next_token?: string | null;
+  query_handle?: string | null;
   timestamp: string;
 }
 
@@ -63,6 +63,49 @@ def convert_timestamp_to_date(timestamp):
     except:
         return None
 
+# Level-of-detail columns maintained from geom (degrees; must match
+# 06-geometry-lod.sql and GEOMETRY_LOD_TOLERANCES in the backend)
+LOD_TOLERANCES = {
+    'geom_lod1': 0.00005,
+    'geom_lod2': 0.0005,
+    'geom_lod3': 0.005,
+}
+
+def ensure_lod_columns(cursor):
+    """Add the simplified geometry columns if the database predates them"""
+    for column, tolerance in LOD_TOLERANCES.items():
+        cursor.execute(f"""
+            ALTER TABLE plans ADD COLUMN IF NOT EXISTS {column} GEOMETRY(Geometry, 4326)
+            GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, {tolerance})) STORED
+        """)
+
+def print_lod_statistics(cursor):
+    """Show how many vertices each level of detail keeps"""
+    columns = ['geom'] + list(LOD_TOLERANCES)
+    cursor.execute(
+        "SELECT " + ", ".join(f"COALESCE(SUM(ST_NPoints({c})), 0)" for c in columns) + " FROM plans"
+    )
+    counts = cursor.fetchone()
+    full = counts[0] or 1
+    print("\n[INFO] Vertices per level of detail:")
+    for column, count in zip(columns, counts):
+        print(f"   {column}: {count} ({count / full * 100:.1f}%)")
+
+def bump_table_version(cursor, table_name):
+    """Bump the table's data version so backends drop cached query results"""
+    cursor.execute("SELECT to_regclass('geo_table_versions')")
+    if cursor.fetchone()[0] is None:
+        return
+    cursor.execute("""
+        UPDATE geo_table_versions
+        SET version = version + 1, updated_at = now()
+        WHERE table_name = %s
+        RETURNING version
+    """, (table_name,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("SELECT pg_notify('geo_table_changed', %s)", (f"{table_name}:{row[0]}",))
+
 def import_plans(json_data):
     """Import plans data into PostGIS database"""
 
@@ -73,6 +116,10 @@ def import_plans(json_data):
         conn = psycopg2.connect(**DB_PARAMS)
         cursor = conn.cursor()
 
+        # Simplified geometry columns are generated from geom on insert
+        ensure_lod_columns(cursor)
+        conn.commit()
+
         # Check if table exists and is empty
         cursor.execute("SELECT COUNT(*) FROM plans")
         existing_count = cursor.fetchone()[0]
@@ -145,6 +192,7 @@ def import_plans(json_data):
         # Execute batch insert
         print(f"[INFO] Inserting {len(batch_data)} plans into database...")
         execute_batch(cursor, insert_query, batch_data, page_size=100)
+        bump_table_version(cursor, 'plans')
         conn.commit()
 
         # Get count
@@ -157,6 +205,8 @@ def import_plans(json_data):
         print(f"[WARNING] Skipped (no geometry): {skipped}")
         print("="*60)
 
+        print_lod_statistics(cursor)
+
         # Show some statistics
         cursor.execute("""
             SELECT
@@ -0,0 +1,45 @@
+-- Per-table data versions used to invalidate cached query results
+-- Every write to a spatial table (including the plans importer's TRUNCATE +
+-- INSERT) bumps the table's version and notifies the backend via NOTIFY
+
+CREATE TABLE IF NOT EXISTS geo_table_versions (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO geo_table_versions (table_name)
+VALUES ('cafes'), ('parks'), ('roads'), ('plans')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION geo_bump_table_version() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    INSERT INTO geo_table_versions (table_name, version, updated_at)
+    VALUES (TG_TABLE_NAME, 1, now())
+    ON CONFLICT (table_name) DO UPDATE
+        SET version = geo_table_versions.version + 1, updated_at = now()
+    RETURNING version INTO new_version;
+
+    PERFORM pg_notify('geo_table_changed', TG_TABLE_NAME || ':' || new_version);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers: one bump per statement, not per row
+CREATE TRIGGER trg_cafes_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON cafes
+    FOR EACH STATEMENT EXECUTE FUNCTION geo_bump_table_version();
+
+CREATE TRIGGER trg_parks_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON parks
+    FOR EACH STATEMENT EXECUTE FUNCTION geo_bump_table_version();
+
+CREATE TRIGGER trg_roads_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON roads
+    FOR EACH STATEMENT EXECUTE FUNCTION geo_bump_table_version();
+
+CREATE TRIGGER trg_plans_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON plans
+    FOR EACH STATEMENT EXECUTE FUNCTION geo_bump_table_version();
@@ -0,0 +1,30 @@
+-- Precomputed multi-resolution geometry (level-of-detail pyramid)
+-- Zoomed-out maps read a simplified column instead of the full-resolution
+-- geom. The columns are generated, so every INSERT/UPDATE (including the
+-- plans importer) keeps them in sync with geom.
+--
+-- Tolerances are in degrees (SRID 4326) and must match
+-- GEOMETRY_LOD_TOLERANCES in the backend configuration:
+--   geom_lod1  0.00005  (~5 m)
+--   geom_lod2  0.0005   (~50 m)
+--   geom_lod3  0.005    (~500 m)
+
+ALTER TABLE plans
+    ADD COLUMN IF NOT EXISTS geom_lod1 GEOMETRY(Geometry, 4326)
+        GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, 0.00005)) STORED,
+    ADD COLUMN IF NOT EXISTS geom_lod2 GEOMETRY(Geometry, 4326)
+        GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, 0.0005)) STORED,
+    ADD COLUMN IF NOT EXISTS geom_lod3 GEOMETRY(Geometry, 4326)
+        GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, 0.005)) STORED;
+
+ALTER TABLE parks
+    ADD COLUMN IF NOT EXISTS geom_lod1 GEOMETRY(Geometry, 4326)
+        GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, 0.00005)) STORED,
+    ADD COLUMN IF NOT EXISTS geom_lod2 GEOMETRY(Geometry, 4326)
+        GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, 0.0005)) STORED,
+    ADD COLUMN IF NOT EXISTS geom_lod3 GEOMETRY(Geometry, 4326)
+        GENERATED ALWAYS AS (ST_SimplifyPreserveTopology(geom, 0.005)) STORED;
+
+COMMENT ON COLUMN plans.geom_lod1 IS 'גיאומטריה מפושטת (~5 מ'')';
+COMMENT ON COLUMN plans.geom_lod2 IS 'גיאומטריה מפושטת (~50 מ'')';
+COMMENT ON COLUMN plans.geom_lod3 IS 'גיאומטריה מפושטת (~500 מ'')';